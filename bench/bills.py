@@ -0,0 +1,129 @@
+"""Compare new-bills-query against the local bill mirror and the API.
+
+Run from the repository root:
+
+    python -m bench.bills [--bills 2000] [--queries 500] [--concurrency 20]
+                          [--latency 0.05]
+
+Both paths run NewBillsQuery.check end to end. The API path goes to a
+stub Congress API (bench.stub) that adds --latency seconds per call; the
+mirror path searches a BillMirror synced from that same stub.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+import triggers
+from bench.stub import StubAPI, WORDS
+from mirror import BillMirror
+from upstream import UpstreamClient
+
+
+def make_queries(count, seed=1):
+    rnd = random.Random(seed)
+    queries = []
+    for i in range(count):
+        kind = i % 4
+        a, b = rnd.sample(WORDS, 2)
+        if kind == 0:
+            queries.append(a)
+        elif kind == 1:
+            queries.append('{} {}'.format(a, b))
+        elif kind == 2:
+            queries.append('"{} {}"~5'.format(a, b))
+        else:
+            queries.append('{}*'.format(a[:4]))
+    return queries
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+@asyncio.coroutine
+def run(handler, queries, concurrency, loop):
+
+    sem = asyncio.Semaphore(concurrency, loop=loop)
+    latencies = []
+
+    @asyncio.coroutine
+    def one(query):
+        with (yield from sem):
+            t0 = time.monotonic()
+            yield from handler.check({'query': query}, None, None, 20)
+            latencies.append(time.monotonic() - t0)
+
+    t0 = time.monotonic()
+    yield from asyncio.gather(*[one(q) for q in queries], loop=loop)
+    elapsed = time.monotonic() - t0
+
+    return {
+        'rps': len(queries) / elapsed,
+        'p50': percentile(latencies, 50) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+    }
+
+
+@asyncio.coroutine
+def main(args, loop):
+
+    stub = StubAPI(bills=args.bills, latency=args.latency, loop=loop)
+    triggers.SUNLIGHT_URL = yield from stub.start()
+    triggers.SUNLIGHT_KEY = triggers.SUNLIGHT_KEY or 'bench'
+    triggers.Trigger.client = UpstreamClient(loop=loop)
+
+    handler = triggers.NewBillsQuery()
+    queries = make_queries(args.queries)
+
+    results = {}
+
+    results['api'] = yield from run(handler, queries, args.concurrency, loop)
+    api_calls = stub.calls.get('bills/search', 0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        handler.mirror = BillMirror(os.path.join(tmp, 'bills.db'),
+                                    since='2000-01-01', loop=loop)
+
+        t0 = time.monotonic()
+        synced = yield from handler.mirror.sync(
+            handler.get_json, '{}/bills'.format(triggers.SUNLIGHT_URL))
+        sync_time = time.monotonic() - t0
+
+        before = stub.calls.get('bills/search', 0)
+        results['mirror'] = yield from run(
+            handler, queries, args.concurrency, loop)
+        mirror_calls = stub.calls.get('bills/search', 0) - before
+
+        handler.mirror.close()
+
+    triggers.Trigger.client.close()
+    stub.stop()
+
+    print('{} queries, concurrency {}, {:.0f}ms stub latency'.format(
+        len(queries), args.concurrency, args.latency * 1000))
+    print('mirror sync: {} bills in {:.2f}s'.format(synced, sync_time))
+    print()
+    print('{:<8} {:>10} {:>10} {:>10} {:>10}'.format(
+        'path', 'req/s', 'p50 ms', 'p99 ms', 'upstream'))
+    for name, calls in (('api', api_calls), ('mirror', mirror_calls)):
+        r = results[name]
+        print('{:<8} {:>10.1f} {:>10.2f} {:>10.2f} {:>10}'.format(
+            name, r['rps'], r['p50'], r['p99'], calls))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bills', type=int, default=2000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main(args, loop))
@@ -0,0 +1,88 @@
+"""Time the date helpers used to build trigger records.
+
+Run from the repository root:
+
+    python -m bench.dates [--bills 1000] [--rounds 20]
+
+Each round builds the date fields of a new-bills-query record for every
+bill in a generated payload, once with the previous dateutil-based
+helpers and once with util's. The memo is cleared before every round, so
+the "cold" column shows the parser alone and the "warm" column what a
+busy worker sees once the legislative days it serves have been seen.
+"""
+
+import argparse
+import time
+
+from dateutil.parser import parse
+
+import util
+from bench.stub import make_bills
+
+
+def dateutil_date_to_epoch(dstr):
+    dt = parse(dstr).replace(hour=0, minute=0, second=0, tzinfo=util.EASTERN)
+    return int(dt.timestamp())
+
+
+def dateutil_time_to_epoch(tstr):
+    return int(parse(tstr).timestamp())
+
+
+def dateutil_readable_date(ymd):
+    dt = parse(ymd)
+    return '{} {}, {}'.format(util.MONTHS[dt.month - 1], dt.day, dt.year)
+
+
+def build(bills, date_to_epoch, time_to_epoch, readable_date):
+    for bill in bills:
+        date_to_epoch(bill['introduced_on'])
+        time_to_epoch(bill['last_action_at'])
+        readable_date(bill['introduced_on'])
+
+
+def clear():
+    util.date_to_epoch.cache_clear()
+    util.time_to_epoch.cache_clear()
+    util.readable_date.cache_clear()
+
+
+def timed(rounds, func, *args, before=None):
+    best = None
+    for i in range(rounds):
+        if before:
+            before()
+        t0 = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(args):
+
+    bills = make_bills(args.bills)
+
+    old = timed(args.rounds, build, bills, dateutil_date_to_epoch,
+                dateutil_time_to_epoch, dateutil_readable_date)
+
+    fast = (bills, util.date_to_epoch, util.time_to_epoch, util.readable_date)
+    cold = timed(args.rounds, build, *fast, before=clear)
+    warm = timed(args.rounds, build, *fast)
+
+    per = lambda t: t / len(bills) * 1e6
+
+    print('{} bills, best of {} rounds'.format(len(bills), args.rounds))
+    print()
+    print('{:<10} {:>12} {:>12} {:>10}'.format(
+        '', 'total ms', 'us/record', 'speedup'))
+    for name, t in (('dateutil', old), ('cold', cold), ('warm', warm)):
+        print('{:<10} {:>12.2f} {:>12.2f} {:>9.1f}x'.format(
+            name, t * 1000, per(t), old / t))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bills', type=int, default=1000)
+    parser.add_argument('--rounds', type=int, default=20)
+    main(parser.parse_args())
@@ -0,0 +1,226 @@
+"""Compare upstream calls with fixed and learned cache TTLs.
+
+Run from the repository root:
+
+    python -m bench.freshness [--days 7] [--interval 300] [--seed 1]
+
+Replays simulated days of polling against bench.stub. The stub's data
+changes on a schedule during weekday working hours (9:00 to 17:00):
+
+  new-laws          a bill is enacted about once a day
+  upcoming-bills    a bill is scheduled a few times a day
+  new-bills-query   about three bills an hour are introduced, which
+                    common queries match often and rare ones seldom
+
+Nothing changes at night or on weekends. Every trigger key is polled
+once per --interval seconds. The app's cache runs on the simulated
+clock, so a week takes seconds. It runs twice, once with every result
+cached for 60 seconds (the old fixed TTL) and once with each trigger's
+learned TTLs (Trigger.ttl). The report gives upstream calls per key per
+hour, and how long new items took to show up in a poll after the stub
+got them.
+"""
+
+import argparse
+import asyncio
+import datetime
+import random
+import time
+
+import triggers
+import util
+import web
+from bench.stub import StubAPI, make_bills, matches
+
+START = datetime.datetime(2015, 3, 2)  # a Monday
+
+QUERIES = {
+    'tax': 'common',
+    'health care': 'common',
+    '"wildlife forest"': 'rare',
+    '"postal privacy"': 'rare',
+}
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def date(self):
+        return START + datetime.timedelta(seconds=self.now)
+
+
+def make_keys():
+
+    # (trigger name, request body) pairs, one per cache key polled.
+
+    keys = [('new-laws', {}), ('upcoming-bills', {})]
+    for query in sorted(QUERIES):
+        keys.append(('new-bills-query', {'triggerFields': {'query': query}}))
+    return keys
+
+
+def make_events(days, seed):
+
+    # (seconds into the run, trigger, record) for every change, in order.
+
+    rnd = random.Random(seed)
+    events = []
+    number = 0
+
+    for hour in range(days * 24):
+        when = START + datetime.timedelta(hours=hour)
+        if when.weekday() >= 5 or not 9 <= when.hour < 17:
+            continue
+        day = when.date().isoformat()
+        per_hour = [('new-laws', 0.15), ('upcoming-bills', 0.4),
+                    ('new-bills-query', 3)]
+        for trigger, rate in per_hour:
+            count = int(rate) + (rnd.random() < rate - int(rate))
+            for i in range(count):
+                number += 1
+                offset = hour * 3600 + rnd.uniform(0, 3600)
+                bill = make_bills(1, seed=seed * 100000 + number)[0]
+                bill.update({
+                    'bill_id': 'hr{}-114'.format(number),
+                    'number': number,
+                    'congress': 114,
+                    'introduced_on': day,
+                    'last_action_at': '{}T12:00:00Z'.format(day),
+                    'history': {'enacted': trigger == 'new-laws',
+                                'enacted_at': day
+                                if trigger == 'new-laws' else None},
+                })
+                events.append((offset, trigger, bill))
+
+    events.sort(key=lambda event: event[0])
+    return events
+
+
+def new_ids(trigger, body, bill):
+
+    # meta.ids bill would show up as in the result of a key, if any.
+
+    if trigger == 'new-laws' and bill['history']['enacted']:
+        return [bill['bill_id']]
+    if trigger == 'new-bills-query' and \
+            matches(bill, body['triggerFields']['query']):
+        return [bill['bill_id']]
+    return []
+
+
+@asyncio.coroutine
+def run(mode, args, loop):
+
+    stub = StubAPI(bills=2000, latency=0, loop=loop)
+    triggers.SUNLIGHT_URL = yield from stub.start()
+
+    clock = Clock()
+    web.cache = util.CappedCache(max_size=web.CACHE_SIZE, clock=clock)
+    handlers = {name: triggers.registry[name]
+                for name in ('new-laws', 'upcoming-bills', 'new-bills-query')}
+    for handler in handlers.values():
+        handler._ttls = None
+        if mode == 'fixed':
+            handler.ttl = lambda cache_key, data: 60
+
+    keys = make_keys()
+    events = make_events(args.days, args.seed)
+    pending = {}   # (key index, meta.id) -> when it appeared upstream
+    delays = []
+
+    try:
+        end = args.days * 24 * 3600
+        while clock.now < end:
+
+            while events and events[0][0] <= clock.now:
+                offset, trigger, bill = events.pop(0)
+                if trigger == 'upcoming-bills':
+                    upcoming = {
+                        'bill_id': bill['bill_id'], 'chamber': 'house',
+                        'legislative_day': bill['introduced_on'],
+                        'range': 'day', 'url': 'https://example.com',
+                        'bill': bill,
+                        'scheduled_at': '{}T{:02d}:00:00Z'.format(
+                            bill['introduced_on'], clock.date().hour),
+                    }
+                    stub.add(upcoming=[upcoming])
+                    ident = 'day/{}/{}'.format(bill['introduced_on'],
+                                               bill['bill_id'])
+                    pending[(1, ident)] = offset
+                else:
+                    stub.add(bills=[bill])
+                    for i, (name, body) in enumerate(keys):
+                        if name == trigger:
+                            for ident in new_ids(trigger, body, bill):
+                                pending[(i, ident)] = offset
+
+            for i, (name, body) in enumerate(keys):
+                handler = handlers[name]
+                path = '/ifttt/v1/triggers/{}'.format(name)
+                cache_key = handler.cache_key(web.TriggerRequest(path, body))
+                resp = yield from web.evaluate(
+                    web.app, handler, cache_key, body)
+                # stale results are refreshed in the background
+                while len(web.inflight):
+                    yield from asyncio.sleep(0, loop=loop)
+                for record in resp.data:
+                    appeared = pending.pop((i, record['meta']['id']), None)
+                    if appeared is not None:
+                        delays.append(clock.now - appeared)
+
+            clock.now += args.interval
+
+    finally:
+        for handler in handlers.values():
+            handler.__dict__.pop('ttl', None)
+            handler._ttls = None
+        stub.stop()
+
+    hours = args.days * 24
+    calls = sum(stub.calls.values())
+    return {
+        'calls': calls,
+        'per_key_hour': calls / len(keys) / hours,
+        'by_endpoint': dict(stub.calls),
+        'mean_delay': sum(delays) / len(delays) / 60 if delays else 0,
+        'max_delay': max(delays) / 60 if delays else 0,
+        'seen': len(delays),
+        'missed': len(pending),
+    }
+
+
+def main(args):
+
+    loop = asyncio.get_event_loop()
+    triggers.SUNLIGHT_KEY = triggers.SUNLIGHT_KEY or 'bench'
+
+    print('{} simulated days from {}, every key polled every {}s'.format(
+        args.days, START.date(), args.interval))
+    print()
+    print('{:<8} {:>9} {:>14} {:>16} {:>15} {:>10}'.format(
+        'TTLs', 'upstream', 'per key-hour', 'mean delay min',
+        'max delay min', 'new items'))
+
+    for mode in ('fixed', 'learned'):
+        t0 = time.monotonic()
+        r = loop.run_until_complete(run(mode, args, loop))
+        print('{:<8} {:>9} {:>14.2f} {:>16.1f} {:>15.1f} {:>10}'.format(
+            mode, r['calls'], r['per_key_hour'], r['mean_delay'],
+            r['max_delay'], r['seen']))
+        if args.verbose:
+            print('         {} ({:.1f}s)'.format(
+                r['by_endpoint'], time.monotonic() - t0))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--interval', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--verbose', action='store_true')
+    main(parser.parse_args())
@@ -0,0 +1,156 @@
+"""Measure requests per second on the trigger cache-hit path.
+
+Run from the repository root:
+
+    python -m bench.hits [--requests 20000] [--connections 20] [--keys 50]
+                         [--triggers ...]
+
+Starts bench.stub and the real web.app in this process, polls every one
+of --keys distinct trigger requests once so their results are cached,
+then sends --requests more over --connections keep-alive connections.
+Bodies look like IFTTT's: trigger_identity, triggerFields, limit, user
+and ifttt_source. The client writes prebuilt requests and reads raw
+responses, so as little of the time as possible is spent on its side.
+
+The report gives throughput and the share of responses that weren't a
+200.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import triggers
+import web
+from bench.stub import StubAPI, WORDS
+
+TRIGGERS = ['new-laws', 'new-bills-query', 'new-legislators']
+
+
+def make_bodies(trigger, keys, seed=1):
+
+    # Encoded request bodies, one per poller.
+
+    rnd = random.Random(seed)
+    bodies = []
+    for i in range(keys):
+        body = {
+            'trigger_identity': '{:040x}'.format(rnd.getrandbits(160)),
+            'limit': 50,
+            'user': {'timezone': 'Pacific Time (US & Canada)'},
+            'ifttt_source': {
+                'id': str(rnd.getrandbits(32)),
+                'url': 'https://ifttt.com/myrecipes/personal/{}'.format(i),
+            },
+        }
+        if trigger == 'new-bills-query':
+            body['triggerFields'] = {
+                'query': ' '.join(rnd.sample(WORDS, 1 + i % 2))}
+        elif trigger == 'new-legislators':
+            body['triggerFields'] = {
+                'location': {'lat': round(rnd.uniform(25, 49), 4),
+                             'lng': round(rnd.uniform(-124, -67), 4)}}
+        bodies.append(json.dumps(body).encode('utf-8'))
+    return bodies
+
+
+def make_request(path, body):
+    head = ('POST {} HTTP/1.1\r\n'
+            'Host: 127.0.0.1\r\n'
+            'Content-Type: application/json\r\n'
+            'IFTTT-Channel-Key: {}\r\n'
+            'Content-Length: {}\r\n'
+            '\r\n').format(path, web.CLIENT_SECRET, len(body))
+    return head.encode('latin-1') + body
+
+
+@asyncio.coroutine
+def poll(port, requests, loop):
+
+    # Sends requests one after another on one connection; returns how
+    # many got a status other than 200.
+
+    reader, writer = yield from asyncio.open_connection(
+        '127.0.0.1', port, loop=loop)
+    errors = 0
+
+    for request in requests:
+        writer.write(request)
+        status = yield from reader.readline()
+        length = 0
+        while True:
+            line = yield from reader.readline()
+            if line == b'\r\n':
+                break
+            name, _, value = line.partition(b':')
+            if name.lower() == b'content-length':
+                length = int(value)
+        yield from reader.readexactly(length)
+        if status.split()[1] != b'200':
+            errors += 1
+
+    writer.close()
+    return errors
+
+
+@asyncio.coroutine
+def run(port, trigger, args, loop):
+
+    path = '/ifttt/v1/triggers/{}'.format(trigger)
+    requests = [make_request(path, body)
+                for body in make_bodies(trigger, args.keys)]
+
+    yield from poll(port, requests, loop)
+
+    rnd = random.Random(2)
+    picks = [rnd.choice(requests) for i in range(args.requests)]
+    per = len(picks) // args.connections
+
+    t0 = time.monotonic()
+    errors = yield from asyncio.gather(
+        *[poll(port, picks[i * per:(i + 1) * per], loop)
+          for i in range(args.connections)], loop=loop)
+    elapsed = time.monotonic() - t0
+
+    return {
+        'rps': per * args.connections / elapsed,
+        'errors': sum(errors),
+    }
+
+
+@asyncio.coroutine
+def main(args, loop):
+
+    stub = StubAPI(latency=0, loop=loop)
+    triggers.SUNLIGHT_URL = yield from stub.start()
+    triggers.SUNLIGHT_KEY = triggers.SUNLIGHT_KEY or 'bench'
+
+    server = yield from loop.create_server(
+        web.app.make_handler(), '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+
+    print('{} cache hits over {} connections, {} keys'.format(
+        args.requests, args.connections, args.keys))
+    print()
+    print('{:<20} {:>9} {:>7}'.format('trigger', 'req/s', 'errors'))
+
+    for trigger in args.triggers:
+        r = yield from run(port, trigger, args, loop)
+        print('{:<20} {:>9.1f} {:>7}'.format(trigger, r['rps'], r['errors']))
+
+    server.close()
+    stub.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--connections', type=int, default=20)
+    parser.add_argument('--keys', type=int, default=50)
+    parser.add_argument('--triggers', nargs='+', default=TRIGGERS,
+                        choices=TRIGGERS)
+    args = parser.parse_args()
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main(args, loop))
@@ -0,0 +1,207 @@
+"""Load test the app against a stub Congress API.
+
+Run from the repository root:
+
+    python -m bench.load [--requests 500] [--concurrency 50] [--keys 50]
+                         [--latency 0.05] [--bills 2000] [--legislators 540]
+                         [--terms 10] [--fixtures DIR] [--triggers ...]
+
+Starts bench.stub and the real web.app, both in this process, and POSTs
+to each trigger from a pool of --keys distinct trigger requests (queries
+for new-bills-query, locations for new-legislators; the other triggers
+take no fields and always share one key). Three scenarios per trigger:
+
+  cold    every cache emptied first
+  warm    right after cold, so everything is cached
+  storm   every cached result expired at once: results are cached with a
+          short timeout, left to expire, then the load starts
+
+The report gives throughput, client-side p50/p99 latency, calls made to
+the stub and resident memory after each run.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import time
+
+import aiohttp
+
+import triggers
+import util
+import web
+from bench.stub import StubAPI, WORDS
+
+TRIGGERS = ['new-laws', 'upcoming-bills', 'congress-birthdays',
+            'new-bills-query', 'new-legislators']
+
+SCENARIOS = ['cold', 'warm', 'storm']
+
+
+def rss():
+
+    # Current resident set in KB, or the peak where /proc isn't there.
+
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def make_bodies(trigger, keys, seed=1):
+    rnd = random.Random(seed)
+    bodies = []
+    for i in range(keys):
+        if trigger == 'new-bills-query':
+            fields = {'query': ' '.join(rnd.sample(WORDS, 1 + i % 2))}
+        elif trigger == 'new-legislators':
+            fields = {'location': {'lat': round(rnd.uniform(25, 49), 4),
+                                   'lng': round(rnd.uniform(-124, -67), 4)}}
+        else:
+            return [{}]
+        bodies.append({'triggerFields': fields})
+    return bodies
+
+
+def reset():
+
+    # Empties every cache between the app and the stub.
+
+    web.cache = util.CappedCache(max_size=web.CACHE_SIZE)
+    triggers.congress_birthdays._index = None
+    triggers.new_legislators._rosters = util.CappedCache(max_size=100)
+    for handler in web.handlers:
+        handler._ttls = None
+
+
+@asyncio.coroutine
+def drive(session, url, bodies, concurrency, loop):
+
+    # POSTs each of bodies, concurrency at a time.
+
+    sem = asyncio.Semaphore(concurrency, loop=loop)
+    latencies = []
+    errors = [0]
+
+    @asyncio.coroutine
+    def one(body):
+        with (yield from sem):
+            t0 = time.monotonic()
+            resp = yield from session.request(
+                'POST', url, data=json.dumps(body),
+                headers={'Content-Type': 'application/json',
+                         'IFTTT-Channel-Key': web.CLIENT_SECRET})
+            yield from resp.read()
+            latencies.append(time.monotonic() - t0)
+            if resp.status != 200:
+                errors[0] += 1
+
+    t0 = time.monotonic()
+    yield from asyncio.gather(*[one(body) for body in bodies], loop=loop)
+    elapsed = time.monotonic() - t0
+
+    return {
+        'rps': len(bodies) / elapsed,
+        'p50': percentile(latencies, 50) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+        'errors': errors[0],
+    }
+
+
+@asyncio.coroutine
+def scenario(name, stub, session, handler, url, bodies, args, loop):
+
+    if name == 'cold':
+        reset()
+
+    elif name == 'storm':
+        reset()
+        handler.ttl = lambda cache_key, data: args.storm_ttl
+        try:
+            yield from drive(session, url, bodies, args.concurrency, loop)
+        finally:
+            del handler.ttl
+        yield from asyncio.sleep(args.storm_ttl + 0.1, loop=loop)
+
+    rnd = random.Random(2)
+    picks = [rnd.choice(bodies) for i in range(args.requests)]
+
+    before = sum(stub.calls.values())
+    result = yield from drive(session, url, picks, args.concurrency, loop)
+    result['upstream'] = sum(stub.calls.values()) - before
+    result['rss'] = rss()
+
+    # let background refreshes finish before the next run
+    while len(web.inflight):
+        yield from asyncio.sleep(0.01, loop=loop)
+
+    return result
+
+
+@asyncio.coroutine
+def main(args, loop):
+
+    stub = StubAPI(bills=args.bills, latency=args.latency,
+                   legislators=args.legislators, terms=args.terms,
+                   fixtures=args.fixtures, loop=loop)
+    triggers.SUNLIGHT_URL = yield from stub.start()
+    triggers.SUNLIGHT_KEY = triggers.SUNLIGHT_KEY or 'bench'
+
+    server = yield from loop.create_server(
+        web.app.make_handler(), '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+
+    connector = aiohttp.TCPConnector(loop=loop)
+    session = aiohttp.ClientSession(connector=connector, loop=loop)
+
+    print('{} requests per run, concurrency {}, {} keys, {:.0f}ms stub '
+          'latency'.format(args.requests, args.concurrency, args.keys,
+                           args.latency * 1000))
+    print()
+    print('{:<20} {:<6} {:>9} {:>9} {:>9} {:>9} {:>7} {:>9}'.format(
+        'trigger', 'run', 'req/s', 'p50 ms', 'p99 ms', 'upstream',
+        'errors', 'RSS KB'))
+
+    for trigger in args.triggers:
+        url = 'http://127.0.0.1:{}/ifttt/v1/triggers/{}'.format(port, trigger)
+        handler = triggers.registry[trigger]
+        bodies = make_bodies(trigger, args.keys)
+        for name in SCENARIOS:
+            r = yield from scenario(name, stub, session, handler, url, bodies,
+                                    args, loop)
+            print('{:<20} {:<6} {:>9.1f} {:>9.2f} {:>9.2f} {:>9} {:>7} '
+                  '{:>9}'.format(trigger, name, r['rps'], r['p50'], r['p99'],
+                                 r['upstream'], r['errors'], r['rss']))
+
+    connector.close()
+    server.close()
+    stub.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--keys', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--bills', type=int, default=2000)
+    parser.add_argument('--legislators', type=int, default=540)
+    parser.add_argument('--terms', type=int, default=10)
+    parser.add_argument('--fixtures')
+    parser.add_argument('--storm-ttl', type=float, default=1.0)
+    parser.add_argument('--triggers', nargs='+', default=TRIGGERS,
+                        choices=TRIGGERS)
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main(args, loop))
@@ -0,0 +1,158 @@
+"""Measure upstream payload size, latency and peak memory for a roster.
+
+Run from the repository root:
+
+    python -m bench.payload [--legislators 5000] [--terms 20] [--rounds 5]
+
+Fetches every legislator from a stub Congress API (bench.stub) and builds
+new-legislators records from them, two ways:
+
+  buffered  every field the trigger used to ask for, with the whole body
+            read and decoded before records are built
+  streamed  the fields in the trigger's record spec, with results decoded
+            and turned into records one at a time as the body arrives
+
+Each way runs in its own process so peak RSS is measured separately; the
+stub runs in this one.
+"""
+
+import argparse
+import asyncio
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import triggers
+from bench.stub import StubAPI, make_legislators
+from upstream import UpstreamClient
+
+BUFFERED_FIELDS = [
+    "title", "first_name", "last_name", "bioguide_id",
+    "state", "party", "district", "terms",
+    "twitter_id", "phone", "website"]
+
+
+def peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+@asyncio.coroutine
+def fetch(mode, url, loop):
+
+    handler = triggers.NewLegislatorsTrigger()
+    received = [0]
+
+    class Counting(UpstreamClient):
+
+        @asyncio.coroutine
+        def _fetch(self, method, url, params, headers, feed, data=None):
+            if feed is None:
+                status, body = yield from super(Counting, self)._fetch(
+                    method, url, params, headers, feed, data)
+                received[0] += len(body)
+                return status, body
+
+            def counted(chunk):
+                received[0] += len(chunk)
+                feed(chunk)
+
+            return (yield from super(Counting, self)._fetch(
+                method, url, params, headers, counted, data))
+
+    triggers.Trigger.client = Counting(loop=loop)
+
+    params = {'per_page': 'all'}
+
+    t0 = time.monotonic()
+
+    if mode == 'buffered':
+        params['fields'] = ','.join(BUFFERED_FIELDS)
+        data = yield from handler.get_json(url, params=params)
+        records = [handler.record(l) for l in data['results']]
+        del data
+    else:
+        params['fields'] = handler.record.param
+        records = yield from handler.get_json(
+            url, params=params, each=handler.record)
+
+    elapsed = time.monotonic() - t0
+
+    triggers.Trigger.client.close()
+
+    return len(records), received[0], elapsed
+
+
+def child(args):
+
+    # Runs one mode against the stub at args.url and prints its numbers.
+
+    loop = asyncio.get_event_loop()
+    triggers.SUNLIGHT_KEY = triggers.SUNLIGHT_KEY or 'bench'
+
+    base = peak_rss()
+    times = []
+    for i in range(args.rounds):
+        count, size, elapsed = loop.run_until_complete(
+            fetch(args.mode, args.url, loop))
+        times.append(elapsed)
+
+    print(json.dumps({
+        'records': count,
+        'bytes': size,
+        'best': min(times),
+        'mean': sum(times) / len(times),
+        'base': base,
+        'rss': peak_rss(),
+    }))
+
+
+def main(args):
+
+    loop = asyncio.get_event_loop()
+    stub = StubAPI(bills=0, latency=0, legislators=0, loop=loop)
+    stub.legislators = make_legislators(args.legislators, terms=args.terms)
+
+    url = '{}/legislators'.format(loop.run_until_complete(stub.start()))
+
+    results = {}
+    for mode in ('buffered', 'streamed'):
+        proc = loop.run_until_complete(asyncio.create_subprocess_exec(
+            sys.executable, '-m', 'bench.payload', '--child', mode,
+            '--url', url, '--rounds', str(args.rounds),
+            stdout=subprocess.PIPE, loop=loop))
+        out, _ = loop.run_until_complete(proc.communicate())
+        results[mode] = json.loads(out.decode('utf-8'))
+
+    stub.stop()
+
+    print('{} legislators, {} terms each, best of {} rounds'.format(
+        args.legislators, args.terms, args.rounds))
+    print()
+    print('{:<10} {:>10} {:>12} {:>10} {:>10} {:>14}'.format(
+        'mode', 'records', 'upstream KB', 'best ms', 'mean ms',
+        'peak RSS KB'))
+    for mode in ('buffered', 'streamed'):
+        r = results[mode]
+        print('{:<10} {:>10} {:>12.0f} {:>10.1f} {:>10.1f} {:>14}'.format(
+            mode, r['records'], r['bytes'] / 1024, r['best'] * 1000,
+            r['mean'] * 1000, r['rss']))
+    print()
+    print('peak RSS after imports, before fetching: {} KB'.format(
+        results['buffered']['base']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--legislators', type=int, default=5000)
+    parser.add_argument('--terms', type=int, default=20)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--child', dest='mode')
+    parser.add_argument('--url')
+    args = parser.parse_args()
+
+    if args.mode:
+        child(args)
+    else:
+        main(args)
@@ -0,0 +1,360 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import re
+
+from aiohttp import web
+
+from records import lookup
+
+# A stand-in for the Congress API for benchmarks: generated bills,
+# legislators and upcoming bills served from memory with a configurable
+# delay per request, so runs don't depend on the real API and are
+# repeatable. Recorded responses can be used instead; see load_fixtures.
+
+WORDS = [
+    "common", "core", "education", "standards", "tax", "relief", "energy",
+    "security", "veterans", "health", "care", "water", "rights", "border",
+    "farm", "trade", "student", "loan", "defense", "budget", "medicare",
+    "housing", "transportation", "infrastructure", "privacy", "data",
+    "small", "business", "job", "training", "wildlife", "forest", "postal",
+    "service", "reform", "act", "amendment", "appropriations", "research",
+    "climate", "coal", "oil", "gas", "pipeline", "immigration", "visa",
+]
+
+# Parameters that aren't filters on results.
+RESERVED = {"fields", "order", "per_page", "page", "query", "apikey",
+            "latitude", "longitude"}
+
+BILL_TYPES = ["hr", "s", "hres", "sres", "hjres", "sjres"]
+
+
+def make_bills(count, seed=0, start=datetime.date(2013, 1, 3)):
+    rnd = random.Random(seed)
+    bills = []
+    for i in range(count):
+        day = start + datetime.timedelta(days=i * 730 // max(count, 1))
+        bill_type = rnd.choice(BILL_TYPES)
+        number = i + 1
+        title = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(4, 12)))
+        bills.append({
+            "bill_id": "{}{}-113".format(bill_type, number),
+            "bill_type": bill_type,
+            "number": number,
+            "congress": 113,
+            "introduced_on": day.isoformat(),
+            "last_action_at": "{}T12:00:00Z".format(day.isoformat()),
+            "short_title": title.title(),
+            "official_title": "To provide for {}.".format(title),
+            "popular_title": None,
+            "keywords": rnd.sample(WORDS, 3),
+            "summary_short": None,
+            "sponsor": {"title": "Rep", "first_name": "Pat",
+                        "last_name": "Doe{}".format(i % 50)},
+            "urls": {"congress": "https://www.congress.gov/bill/{}".format(i),
+                     "opencongress": "https://www.opencongress.org/{}".format(i)},
+            "history": {"enacted": i % 10 == 0,
+                        "enacted_at": day.isoformat() if i % 10 == 0 else None},
+        })
+    return bills
+
+
+STATES = ["CA", "TX", "NY", "FL", "IL", "PA", "OH", "SD", "VT", "WY"]
+
+
+def make_legislators(count, seed=0, terms=10):
+
+    # Legislators with a long history of terms, most of them in a seat
+    # other than the current one, like the long-serving members whose
+    # records make the real legislators payload large.
+
+    rnd = random.Random(seed)
+    legislators = []
+    for i in range(count):
+        state = STATES[i % len(STATES)]
+        district = None if i % 5 == 0 else rnd.randint(1, 20)
+        history = []
+        for t in range(terms):
+            year = 2014 - 2 * (terms - t)
+            seat = district if t >= terms // 2 else rnd.randint(1, 20)
+            history.append({
+                "start": "{}-01-03".format(year),
+                "end": "{}-01-03".format(year + 2),
+                "state": state,
+                "district": seat,
+                "party": "D" if i % 2 else "R",
+                "chamber": "senate" if district is None else "house",
+                "office": "{} Longworth House Office Building".format(i),
+                "phone": "202-225-{:04d}".format(i % 10000),
+                "url": "https://example.house.gov/{}".format(i),
+            })
+        legislators.append({
+            "bioguide_id": "B{:06d}".format(i),
+            "title": "Sen" if district is None else "Rep",
+            "first_name": "Pat",
+            "last_name": "Doe{}".format(i),
+            "state": state,
+            "district": district,
+            "party": "D" if i % 2 else "R",
+            "birthday": "19{:02d}-{:02d}-{:02d}".format(
+                40 + i % 50, 1 + i % 12, 1 + i % 28),
+            "twitter_id": "doe{}".format(i),
+            "phone": "202-225-{:04d}".format(i % 10000),
+            "website": "https://doe{}.house.gov".format(i),
+            "in_office": True,
+            "terms": history,
+        })
+    return legislators
+
+
+def make_upcoming(bills, count, seed=0, start=datetime.date(2015, 1, 5)):
+    rnd = random.Random(seed)
+    upcoming = []
+    for i in range(count):
+        bill = bills[i % len(bills)] if bills else None
+        day = start + datetime.timedelta(days=i // 5)
+        upcoming.append({
+            "bill_id": bill["bill_id"] if bill else "hr{}-114".format(i),
+            "chamber": rnd.choice(["house", "senate"]),
+            "legislative_day": day.isoformat(),
+            "range": rnd.choice(["day", "week"]),
+            "url": "https://majorityleader.gov/floor/{}".format(i),
+            "bill": bill,
+            "scheduled_at": "{}T{:02d}:00:00Z".format(
+                day.isoformat(), 9 + i % 8),
+        })
+    return upcoming
+
+
+FIXTURES = ['bills', 'legislators', 'upcoming_bills']
+
+
+def load_fixtures(path):
+
+    # Recorded API responses, one file per endpoint named after it (see
+    # FIXTURES), each either a list of results or a whole response with
+    # a "results" list in it.
+
+    fixtures = {}
+    for name in FIXTURES:
+        filename = os.path.join(path, '{}.json'.format(name))
+        if os.path.exists(filename):
+            with open(filename) as f:
+                data = json.load(f)
+            fixtures[name] = data['results'] if isinstance(data, dict) \
+                else data
+    return fixtures
+
+
+def matches(bill, query):
+
+    # Good enough for benchmarks: every word or phrase must appear in the
+    # bill's titles, with * as a prefix wildcard. Proximity is ignored.
+
+    text = ' '.join([bill['short_title'], bill['official_title']] +
+                    bill['keywords']).lower()
+    for phrase, word in re.findall(r'"([^"]*)"(?:~\d+)?|(\S+)', query.lower()):
+        if phrase and phrase not in text:
+            return False
+        if word and word.endswith('*'):
+            if not re.search(r'\b' + re.escape(word[:-1]), text):
+                return False
+        elif word and not re.search(r'\b' + re.escape(word) + r'\b', text):
+            return False
+    return True
+
+
+def project(doc, fields):
+
+    # Like the API's fields= parameter: dotted fields pick keys out of
+    # embedded documents, or out of every document in an embedded list.
+
+    if not fields:
+        return doc
+    out = {}
+    for field in fields.split(','):
+        head, _, tail = field.partition('.')
+        if head not in doc:
+            continue
+        if not tail:
+            out[head] = doc[head]
+        elif isinstance(doc[head], list):
+            parts = out.setdefault(head, [{} for _ in doc[head]])
+            for part, sub in zip(parts, doc[head]):
+                part[tail] = sub.get(tail)
+        else:
+            out.setdefault(head, {})[tail] = (doc[head] or {}).get(tail)
+    return out
+
+
+class StubAPI(object):
+
+    def __init__(self, bills=1000, latency=0.05, seed=0, legislators=540,
+                 terms=10, upcoming=100, fixtures=None, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.latency = latency
+        fixtures = load_fixtures(fixtures) if fixtures else {}
+        self.bills = fixtures.get('bills') or make_bills(bills, seed)
+        self.legislators = fixtures.get('legislators') or \
+            make_legislators(legislators, seed, terms)
+        self.upcoming = fixtures.get('upcoming_bills') or \
+            make_upcoming(self.bills, upcoming, seed)
+        self.calls = {}
+        self._searches = {}
+        self.app = web.Application(loop=self.loop)
+        self.app.router.add_route('GET', '/bills', self.handle_bills)
+        self.app.router.add_route('GET', '/bills/search', self.handle_search)
+        self.app.router.add_route('GET', '/legislators',
+                                  self.handle_legislators)
+        self.app.router.add_route('GET', '/legislators/locate',
+                                  self.handle_locate)
+        self.app.router.add_route('GET', '/upcoming_bills',
+                                  self.handle_upcoming)
+        self.server = None
+        self.url = None
+
+    @asyncio.coroutine
+    def start(self, host='127.0.0.1', port=0):
+        self.server = yield from self.loop.create_server(
+            self.app.make_handler(), host, port)
+        port = self.server.sockets[0].getsockname()[1]
+        self.url = 'http://{}:{}'.format(host, port)
+        return self.url
+
+    def stop(self):
+        if self.server is not None:
+            self.server.close()
+
+    def add(self, bills=(), upcoming=()):
+
+        # New records, for benchmarks that change the data as they go.
+
+        self.bills.extend(bills)
+        self.upcoming.extend(upcoming)
+        self._searches.clear()
+
+    def count(self, path):
+        self.calls[path] = self.calls.get(path, 0) + 1
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name, results in (('bills', self.bills),
+                              ('legislators', self.legislators),
+                              ('upcoming_bills', self.upcoming)):
+            with open(os.path.join(path, '{}.json'.format(name)), 'w') as f:
+                json.dump({'results': results}, f)
+
+    @asyncio.coroutine
+    def respond(self, request, results):
+
+        params = request.GET
+
+        for key, value in params.items():
+            if key in RESERVED:
+                continue
+            field, _, op = key.partition('__')
+            get = lambda r: lookup(r, field)
+            if op == 'gte':
+                results = [r for r in results if (get(r) or '') >= value]
+            elif op == 'lte':
+                results = [r for r in results if (get(r) or '') <= value]
+            elif op == 'exists':
+                results = [r for r in results
+                           if (get(r) is not None) == (value == 'true')]
+            elif not op:
+                if value in ('true', 'false'):
+                    value = value == 'true'
+                results = [r for r in results if get(r) == value]
+
+        order = params.get('order')
+        if order:
+            field = order.split(',')[0]
+            reverse = not field.endswith('__asc')
+            field = re.sub(r'__(asc|desc)$', '', field)
+            results = sorted(results, key=lambda r: lookup(r, field) or '',
+                             reverse=reverse)
+
+        per_page = params.get('per_page', '20')
+        page = int(params.get('page', '1'))
+        if per_page != 'all':
+            per_page = int(per_page)
+            results = results[(page - 1) * per_page:page * per_page]
+
+        body = {
+            'results': [project(r, params.get('fields')) for r in results],
+            'count': len(results),
+            'page': {'page': page, 'count': len(results)},
+        }
+
+        if self.latency:
+            yield from asyncio.sleep(self.latency, loop=self.loop)
+
+        return web.Response(text=json.dumps(body),
+                            content_type='application/json')
+
+    @asyncio.coroutine
+    def handle_bills(self, request):
+        self.count('bills')
+        return (yield from self.respond(request, self.bills))
+
+    @asyncio.coroutine
+    def handle_search(self, request):
+        self.count('bills/search')
+        query = request.GET.get('query', '')
+        # the stub runs in the benchmark's process, so keep its own work
+        # out of the numbers
+        results = self._searches.get(query)
+        if results is None:
+            results = self._searches[query] = [
+                b for b in self.bills if matches(b, query)]
+        return (yield from self.respond(request, results))
+
+    @asyncio.coroutine
+    def handle_legislators(self, request):
+        self.count('legislators')
+        return (yield from self.respond(request, self.legislators))
+
+    @asyncio.coroutine
+    def handle_locate(self, request):
+
+        # Any point lands in one state, picked from its coordinates, and
+        # one district in it: the state's senators plus that district's
+        # representative.
+
+        self.count('legislators/locate')
+        lat = float(request.GET.get('latitude', 0))
+        lng = float(request.GET.get('longitude', 0))
+        cell = int(abs(lat * 10)) * 7 + int(abs(lng * 10)) * 13
+        state = STATES[cell % len(STATES)]
+        in_state = [l for l in self.legislators if l.get('state') == state]
+        districts = sorted({l['district'] for l in in_state
+                            if l.get('district')})
+        district = districts[cell % len(districts)] if districts else None
+        results = [l for l in in_state
+                   if l.get('district') in (None, district)]
+        return (yield from self.respond(request, results))
+
+    @asyncio.coroutine
+    def handle_upcoming(self, request):
+        self.count('upcoming_bills')
+        return (yield from self.respond(request, self.upcoming))
+
+
+if __name__ == '__main__':
+
+    # python -m bench.stub --dump DIR writes the generated data as
+    # fixtures, to edit or replace with recorded responses.
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dump', required=True)
+    parser.add_argument('--bills', type=int, default=1000)
+    parser.add_argument('--legislators', type=int, default=540)
+    parser.add_argument('--terms', type=int, default=10)
+    parser.add_argument('--upcoming', type=int, default=100)
+    args = parser.parse_args()
+
+    StubAPI(bills=args.bills, legislators=args.legislators,
+            terms=args.terms, upcoming=args.upcoming).save(args.dump)
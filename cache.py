@@ -0,0 +1,242 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+import zlib
+
+import aiomcache
+import aiomcache.pool
+from aiomcache.client import acquire
+
+MEMCACHE_SERVER = os.environ.get('MEMCACHE_SERVER')
+
+# Connections each worker keeps open to memcached.
+MEMCACHE_POOL_SIZE = int(os.environ.get('MEMCACHE_POOL_SIZE', '4'))
+
+KEY_PREFIX = b'sunlighttt:'
+LEASE_PREFIX = b'lease:'
+
+ERRORS = (OSError, asyncio.TimeoutError, aiomcache.ClientException)
+
+
+class MemcachePool(aiomcache.pool.MemcachePool):
+
+    # aiomcache 0.1's acquire() takes an idle connection off the queue and
+    # then opens a new one anyway, dropping the idle one unclosed, so
+    # every command paid for a connect and leaked a socket. This one
+    # reuses idle connections, closing any the server has hung up on.
+
+    @asyncio.coroutine
+    def acquire(self):
+        while not self._pool.empty():
+            reader, writer = self._pool.get_nowait()
+            if reader.at_eof() or reader.exception() is not None:
+                writer.close()
+                continue
+            self._in_use.add((reader, writer))
+            return reader, writer
+
+        conn = yield from asyncio.open_connection(
+            self._host, self._port, loop=self._loop)
+        self._in_use.add(conn)
+        return conn
+
+
+class MemcacheClient(aiomcache.Client):
+
+    # aiomcache 0.1 has no add command, which the fill lease relies on:
+    # add only stores a key that doesn't exist yet, so exactly one worker
+    # gets to hold a lease at a time.
+
+    def __init__(self, host, port=11211, pool_size=MEMCACHE_POOL_SIZE,
+                 loop=None):
+        super().__init__(host, port, pool_size=pool_size, loop=loop)
+        self._pool = MemcachePool(host, port, minsize=pool_size,
+                                  maxsize=pool_size, loop=loop)
+
+    @acquire
+    def add(self, reader, writer, key, val, exptime=0):
+        assert self._validate_key(key)
+
+        writer.write(b''.join((b'add ', key, b' 0 ',
+                               ('%d %d' % (exptime, len(val))).encode('utf-8'),
+                               b'\r\n', val, b'\r\n')))
+
+        resp = yield from reader.readline()
+        if resp == b'STORED\r\n':
+            return True
+        if resp == b'NOT_STORED\r\n':
+            return False
+        raise aiomcache.ClientException('add failed', resp)
+
+    def close(self):
+        # The base class never runs the pool's clear() coroutine, which
+        # would fail on the (reader, writer) pairs anyway.
+        idle = self._pool._pool
+        while not idle.empty():
+            reader, writer = idle.get_nowait()
+            writer.close()
+
+
+class SharedCache(object):
+
+    # Second cache tier shared by every gunicorn worker. Trigger results
+    # are stored as zlib-compressed compact JSON along with the wall-clock
+    # time they stop being fresh, so each worker's CappedCache only keeps
+    # them for whatever freshness is left.
+    #
+    # A worker that misses takes a short-lived lease before going upstream.
+    # Other workers that miss the same key wait for the leaseholder to
+    # store its result instead of fetching it again.
+    #
+    # memcached being slow or down never fails a request: every operation
+    # is bounded by a timeout and errors are treated as a miss.
+
+    def __init__(self, client=None, timeout=0.25, lease_timeout=5,
+                 poll_interval=0.05, loop=None):
+        self._client = client
+        self._timeout = timeout
+        self._lease_timeout = lease_timeout
+        self._poll_interval = poll_interval
+        self._loop = loop
+
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.errors = 0
+
+    @classmethod
+    def from_server(cls, server, loop=None, **kwargs):
+        client = None
+        if server:
+            host, _, port = server.partition(':')
+            client = MemcacheClient(host, int(port or 11211), loop=loop)
+        return cls(client, loop=loop, **kwargs)
+
+    @property
+    def enabled(self):
+        return self._client is not None
+
+    def key(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return KEY_PREFIX + digest.encode('ascii')
+
+    def dumps(self, data, expires, window=None):
+        payload = json.dumps([expires, window, data], separators=(',', ':'))
+        return zlib.compress(payload.encode('utf-8'))
+
+    def loads(self, raw):
+        expires, window, data = json.loads(
+            zlib.decompress(raw).decode('utf-8'))
+        return data, expires, window
+
+    @asyncio.coroutine
+    def _call(self, method, *args):
+        loop = self._loop or asyncio.get_event_loop()
+        try:
+            call = getattr(self._client, method)(*args)
+            return (yield from asyncio.wait_for(call, self._timeout, loop=loop))
+        except ERRORS:
+            self.errors += 1
+            raise
+
+    @asyncio.coroutine
+    def get(self, key):
+
+        # Returns (data, ttl, window) with ttl the seconds of freshness
+        # left and window the limit the data was fetched with, or None on
+        # a miss.
+
+        if not self.enabled:
+            return None
+
+        try:
+            raw = yield from self._call('get', self.key(key))
+        except ERRORS:
+            return None
+
+        if raw is not None:
+            try:
+                data, expires, window = self.loads(raw)
+            except (ValueError, TypeError, zlib.error):
+                # Written by something else, or cut short: a miss, the
+                # same as memcached not answering.
+                self.errors += 1
+                return None
+            ttl = expires - time.time()
+            if ttl > 0:
+                self.hits += 1
+                return data, ttl, window
+
+        self.misses += 1
+        return None
+
+    @asyncio.coroutine
+    def set(self, key, data, timeout, window=None):
+
+        if not self.enabled:
+            return
+
+        raw = self.dumps(data, time.time() + timeout, window)
+        try:
+            yield from self._call('set', self.key(key), raw, int(timeout))
+        except ERRORS:
+            pass
+
+    @asyncio.coroutine
+    def lease(self, key):
+
+        # True if this worker should go upstream for key: either it now
+        # holds the lease or memcached can't be asked.
+
+        if not self.enabled:
+            return True
+
+        try:
+            return (yield from self._call(
+                'add', LEASE_PREFIX + self.key(key), b'1',
+                int(self._lease_timeout)))
+        except ERRORS:
+            return True
+
+    @asyncio.coroutine
+    def release(self, key):
+
+        if not self.enabled:
+            return
+
+        try:
+            yield from self._call('delete', LEASE_PREFIX + self.key(key))
+        except ERRORS:
+            pass
+
+    @asyncio.coroutine
+    def wait(self, key, min_ttl=0):
+
+        # Polls for the value another worker is filling, one fresh for more
+        # than min_ttl seconds. Gives up after the lease would have expired
+        # and returns None.
+
+        loop = self._loop or asyncio.get_event_loop()
+        deadline = loop.time() + self._lease_timeout
+
+        self.waits += 1
+
+        while loop.time() < deadline:
+            yield from asyncio.sleep(self._poll_interval, loop=loop)
+            hit = yield from self.get(key)
+            if hit and hit[1] > min_ttl:
+                return hit
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'waits': self.waits,
+            'errors': self.errors,
+        }
@@ -0,0 +1,191 @@
+import json
+import math
+import os
+import re
+import sys
+
+DISTRICTS_FILE = os.environ.get(
+    'DISTRICTS_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 'districts.geojson'))
+
+# Census state FIPS codes to the postal codes the Congress API uses.
+STATE_FIPS = {
+    '01': 'AL', '02': 'AK', '04': 'AZ', '05': 'AR', '06': 'CA', '08': 'CO',
+    '09': 'CT', '10': 'DE', '11': 'DC', '12': 'FL', '13': 'GA', '15': 'HI',
+    '16': 'ID', '17': 'IL', '18': 'IN', '19': 'IA', '20': 'KS', '21': 'KY',
+    '22': 'LA', '23': 'ME', '24': 'MD', '25': 'MA', '26': 'MI', '27': 'MN',
+    '28': 'MS', '29': 'MO', '30': 'MT', '31': 'NE', '32': 'NV', '33': 'NH',
+    '34': 'NJ', '35': 'NM', '36': 'NY', '37': 'NC', '38': 'ND', '39': 'OH',
+    '40': 'OK', '41': 'OR', '42': 'PA', '44': 'RI', '45': 'SC', '46': 'SD',
+    '47': 'TN', '48': 'TX', '49': 'UT', '50': 'VT', '51': 'VA', '53': 'WA',
+    '54': 'WV', '55': 'WI', '56': 'WY', '60': 'AS', '66': 'GU', '69': 'MP',
+    '72': 'PR', '78': 'VI',
+}
+
+# Decimal places boundary coordinates are kept to; 5 is about a metre.
+PRECISION = 5
+
+
+def ring_contains(ring, x, y):
+
+    # Ray casting: count how many edges a ray going right from (x, y)
+    # crosses. Rings are lists of [lng, lat] pairs as in GeoJSON.
+
+    inside = False
+    xj, yj = ring[-1][0], ring[-1][1]
+    for point in ring:
+        xi, yi = point[0], point[1]
+        if (yi > y) != (yj > y) and x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+            inside = not inside
+        xj, yj = xi, yi
+    return inside
+
+
+class District(object):
+
+    def __init__(self, state, district, polygons):
+        self.state = state
+        self.district = district
+        self.polygons = polygons
+
+        xs = [p[0] for polygon in polygons for p in polygon[0]]
+        ys = [p[1] for polygon in polygons for p in polygon[0]]
+        self.bbox = (min(xs), min(ys), max(xs), max(ys))
+
+    def __repr__(self):
+        return '<District {}>'.format(self.key)
+
+    @property
+    def key(self):
+        return '{}-{}'.format(self.state, self.district)
+
+    def contains(self, x, y):
+        minx, miny, maxx, maxy = self.bbox
+        if not (minx <= x <= maxx and miny <= y <= maxy):
+            return False
+        for polygon in self.polygons:
+            outer, holes = polygon[0], polygon[1:]
+            if ring_contains(outer, x, y) and \
+                    not any(ring_contains(hole, x, y) for hole in holes):
+                return True
+        return False
+
+
+class DistrictIndex(object):
+
+    # Maps a point to the congressional district containing it. Districts
+    # are bucketed on a grid of cell_size degrees by bounding box, so a
+    # lookup only runs point-in-polygon tests against the few districts
+    # whose boxes overlap the point's cell.
+
+    def __init__(self, districts=(), cell_size=0.5):
+        self._cell_size = cell_size
+        self._grid = {}
+        self._count = 0
+        for district in districts:
+            self.add(district)
+
+    def __len__(self):
+        return self._count
+
+    def _cell(self, x, y):
+        return (int(math.floor(x / self._cell_size)),
+                int(math.floor(y / self._cell_size)))
+
+    def add(self, district):
+        minx, miny, maxx, maxy = district.bbox
+        x0, y0 = self._cell(minx, miny)
+        x1, y1 = self._cell(maxx, maxy)
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                self._grid.setdefault((cx, cy), []).append(district)
+        self._count += 1
+
+    def locate(self, lat, lng):
+        for district in self._grid.get(self._cell(lng, lat), ()):
+            if district.contains(lng, lat):
+                return district
+
+    @classmethod
+    def from_geojson(cls, collection, **kwargs):
+
+        # Features need "state" (postal code) and "district" (0 for
+        # at-large) properties and Polygon or MultiPolygon geometry.
+
+        districts = []
+
+        for feature in collection['features']:
+            props = feature['properties']
+            geometry = feature['geometry']
+            if geometry['type'] == 'Polygon':
+                polygons = [geometry['coordinates']]
+            elif geometry['type'] == 'MultiPolygon':
+                polygons = geometry['coordinates']
+            else:
+                continue
+            districts.append(
+                District(props['state'], int(props['district']), polygons))
+
+        return cls(districts, **kwargs)
+
+    @classmethod
+    def load(cls, path=DISTRICTS_FILE, **kwargs):
+
+        # An empty index if there's no boundary file; every lookup then
+        # misses and callers fall back to the API.
+
+        if not path or not os.path.exists(path):
+            return cls(**kwargs)
+
+        with open(path) as f:
+            return cls.from_geojson(json.load(f), **kwargs)
+
+
+def from_census(collection, precision=PRECISION):
+
+    # Converts the Census Bureau's congressional district cartographic
+    # boundaries, as GeoJSON, to the features from_geojson reads. Census
+    # features carry STATEFP and a CDnnnFP for the Congress they're drawn
+    # for: 00 is at-large, 98 a delegate's territory (both district 0
+    # here, as the API has them) and ZZ is water no district covers.
+
+    def rounded(coords):
+        if isinstance(coords[0], (int, float)):
+            return [round(c, precision) for c in coords[:2]]
+        return [rounded(c) for c in coords]
+
+    features = []
+
+    for feature in collection['features']:
+        props = feature['properties']
+        state = STATE_FIPS.get(props.get('STATEFP'))
+        number = next((value for name, value in props.items()
+                       if re.match(r'CD\d+FP$', name)), None)
+        if not state or not number or not number.isdigit():
+            continue
+        district = int(number)
+        if district == 98:
+            district = 0
+        geometry = feature['geometry']
+        features.append({
+            'type': 'Feature',
+            'properties': {'state': state, 'district': district},
+            'geometry': {'type': geometry['type'],
+                         'coordinates': rounded(geometry['coordinates'])},
+        })
+
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+if __name__ == '__main__':
+
+    # python districts.py cd.geojson > districts.geojson, where cd.geojson
+    # is a Census cartographic boundary file converted to GeoJSON; see
+    # the README.
+
+    with open(sys.argv[1]) as f:
+        collection = from_census(json.load(f))
+    json.dump(collection, sys.stdout, separators=(',', ':'))
+    print('{} districts'.format(len(collection['features'])),
+          file=sys.stderr)
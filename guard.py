@@ -0,0 +1,264 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+from upstream import CONN_LIMIT, TIMEOUT, BuildError
+
+# Consecutive failed Congress API calls that open the circuit, and how
+# many seconds it stays open before a single trial call is let through.
+GUARD_FAILURES = int(os.environ.get('GUARD_FAILURES', '5'))
+GUARD_COOLDOWN = float(os.environ.get('GUARD_COOLDOWN', '30'))
+
+# Seconds one call may take, waiting for a slot included.
+GUARD_DEADLINE = float(os.environ.get('GUARD_DEADLINE', str(TIMEOUT)))
+
+# Concurrent calls allowed adapt between GUARD_MIN and GUARD_MAX: they
+# grow while calls take less than GUARD_TARGET seconds and halve when
+# one takes longer or fails. At most GUARD_QUEUE calls wait for a slot.
+GUARD_TARGET = float(os.environ.get('GUARD_TARGET', '1'))
+GUARD_MIN = int(os.environ.get('GUARD_MIN', '2'))
+GUARD_MAX = int(os.environ.get('GUARD_MAX', str(CONN_LIMIT)))
+GUARD_QUEUE = int(os.environ.get('GUARD_QUEUE', '100'))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class Unavailable(Exception):
+
+    # Raised instead of calling upstream, when the circuit is open or too
+    # many calls are waiting already.
+
+    pass
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, failures=GUARD_FAILURES, cooldown=GUARD_COOLDOWN,
+                 clock=time.monotonic):
+        self._threshold = failures
+        self._cooldown = cooldown
+        self._clock = clock
+        self._opened = None
+        self._trial = False
+
+        self.failures = 0
+        self.opens = 0
+
+    @property
+    def state(self):
+        if self._opened is None:
+            return CLOSED
+        if self._clock() - self._opened < self._cooldown:
+            return OPEN
+        return HALF_OPEN
+
+    def allow(self):
+
+        # Whether a call may go ahead. Once the cooldown is over, one call
+        # at a time is let through to see if upstream is back.
+
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def success(self):
+        self.failures = 0
+        self._opened = None
+        self._trial = False
+
+    def failure(self):
+        self.failures += 1
+        if self._trial or self.failures >= self._threshold:
+            if self._opened is None or self._trial:
+                self.opens += 1
+            self._opened = self._clock()
+        self._trial = False
+
+    def release(self):
+
+        # For a call that was allowed but never went out.
+
+        self._trial = False
+
+
+class AdaptiveLimit(object):
+
+    # AIMD: every call that finishes within target adds 1/limit, so the
+    # limit grows by about one per limit calls; a slow or failed call
+    # halves it, at most once per target seconds so a burst of slow
+    # calls that were all in flight together only counts once.
+
+    BACKOFF = 0.5
+
+    def __init__(self, minimum=GUARD_MIN, maximum=GUARD_MAX,
+                 target=GUARD_TARGET, queue=GUARD_QUEUE,
+                 clock=time.monotonic, loop=None):
+        self._min = minimum
+        self._max = maximum
+        self._target = target
+        self._queue = queue
+        self._clock = clock
+        self._loop = loop
+        self._waiters = deque()
+        self._decreased = None
+
+        self.limit = float(maximum)
+        self.in_flight = 0
+
+    def __len__(self):
+        return len(self._waiters)
+
+    @asyncio.coroutine
+    def acquire(self):
+
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+
+        if len(self._waiters) >= self._queue:
+            raise Unavailable('too many Congress API calls waiting')
+
+        waiter = asyncio.Future(loop=self._loop)
+        self._waiters.append(waiter)
+        try:
+            yield from waiter
+        except asyncio.CancelledError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif waiter.done() and not waiter.cancelled():
+                # handed a slot just as it gave up waiting
+                self.in_flight -= 1
+                self._wake()
+            raise
+
+    def release(self, latency, ok=True):
+
+        if ok and latency <= self._target:
+            self.limit = min(self._max, self.limit + 1 / self.limit)
+        else:
+            now = self._clock()
+            if self._decreased is None or \
+                    now - self._decreased >= self._target:
+                self.limit = max(self._min, self.limit * self.BACKOFF)
+                self._decreased = now
+
+        self.in_flight -= 1
+        self._wake()
+
+    def discard(self):
+
+        # For a call whose outcome says nothing about upstream.
+
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+
+class UpstreamGuard(object):
+
+    # Wraps calls to the Congress API, which return (status, body): each
+    # one gets a deadline and a slot from an AdaptiveLimit, and their
+    # outcomes drive a CircuitBreaker. While the circuit is open calls
+    # fail right away with Unavailable, so callers can fall back on what
+    # they have cached instead of piling up behind a slow upstream.
+    # Errors and 5xx responses count as failures; so does running out of
+    # time, which also counts as slow. A BuildError, raised by our own
+    # record building, counts as neither success nor failure.
+
+    def __init__(self, failures=GUARD_FAILURES, cooldown=GUARD_COOLDOWN,
+                 deadline=GUARD_DEADLINE, target=GUARD_TARGET,
+                 minimum=GUARD_MIN, maximum=GUARD_MAX, queue=GUARD_QUEUE,
+                 clock=time.monotonic, loop=None):
+        self._deadline = deadline
+        self._clock = clock
+        self._loop = loop
+        self.breaker = CircuitBreaker(failures, cooldown, clock)
+        self.limiter = AdaptiveLimit(minimum, maximum, target, queue,
+                                     clock, loop)
+        self.rejected = 0
+        self.timeouts = 0
+
+    @property
+    def available(self):
+        return self.breaker.state != OPEN
+
+    @asyncio.coroutine
+    def call(self, func, *args, **kwargs):
+
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise Unavailable('Congress API circuit is open')
+
+        ok = None
+        try:
+            status, body = yield from asyncio.wait_for(
+                self._limited(func, args, kwargs), self._deadline,
+                loop=self._loop)
+        except Unavailable:
+            self.rejected += 1
+            raise
+        except (asyncio.CancelledError, BuildError):
+            raise
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            ok = False
+            raise
+        except Exception:
+            ok = False
+            raise
+        else:
+            ok = status < 500
+            return status, body
+        finally:
+            if ok is None:
+                self.breaker.release()
+            elif ok:
+                self.breaker.success()
+            else:
+                self.breaker.failure()
+
+    @asyncio.coroutine
+    def _limited(self, func, args, kwargs):
+
+        yield from self.limiter.acquire()
+
+        t0 = self._clock()
+        ok = False
+        try:
+            status, body = yield from func(*args, **kwargs)
+            ok = status < 500
+            return status, body
+        except BuildError:
+            ok = None
+            raise
+        finally:
+            if ok is None:
+                self.limiter.discard()
+            else:
+                self.limiter.release(self._clock() - t0, ok)
+
+    def stats(self):
+        return {
+            'state': self.breaker.state,
+            'open': int(self.breaker.state != CLOSED),
+            'failures': self.breaker.failures,
+            'opens': self.breaker.opens,
+            'limit': self.limiter.limit,
+            'in_flight': self.limiter.in_flight,
+            'waiting': len(self.limiter),
+            'rejected': self.rejected,
+            'timeouts': self.timeouts,
+        }
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+import util
+
+# Decimal places coordinates are rounded to in cache keys and locate
+# calls; 3 is a grid of about 100 m.
+KEY_PRECISION = int(os.environ.get('CACHE_KEY_PRECISION', '3'))
+
+# Hex digits of the digest parameterized cache keys end in.
+DIGEST_SIZE = 24
+
+# Words bill searches take as operators rather than search terms.
+OPERATORS = ('AND', 'OR', 'NOT')
+
+
+def canonical_query(query):
+
+    # Spells query the one way every query that searches for the same
+    # thing is spelled: split into terms as util.validate_query does,
+    # lowercased, single spaced. Searches ignore case, except in the
+    # operators. Queries that don't parse are only trimmed.
+
+    query = ' '.join((query or '').split())
+
+    try:
+        terms = util.parse_query(query)
+    except ValueError:
+        return query
+
+    out = []
+    for term in terms:
+        if term.phrase:
+            text = '"{}"'.format(' '.join(term.text.lower().split()))
+            if term.distance is not None:
+                text = '{}~{}'.format(text, term.distance)
+        elif term.text in OPERATORS:
+            text = term.text
+        else:
+            text = term.text.lower()
+        out.append(text)
+
+    return ' '.join(out)
+
+
+def point(loc):
+
+    # (lat, lng) of a location field, which may call the longitude lon
+    # or lng.
+
+    lng = loc.get('lon')
+    if lng is None:
+        lng = loc.get('lng')
+    return float(loc['lat']), float(lng)
+
+
+def snap(lat, lng, precision=KEY_PRECISION):
+    return round(lat, precision), round(lng, precision)
+
+
+def digest(path, parts):
+
+    # A cache key for path with parts, (name, value) pairs, of a fixed
+    # size however long the values are.
+
+    text = json.dumps(parts, separators=(',', ':'), sort_keys=True)
+    hexdigest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+    return '{}#{}'.format(path, hexdigest[:DIGEST_SIZE])
+
+
+class KeyStats(object):
+
+    # Counts how many distinct requests (path and body, less the limit)
+    # map to how many distinct cache keys. Each is remembered by a short
+    # digest, and only the max_size most recent of them, so these are
+    # counts over recent traffic.
+
+    MAX_SIZE = 100000
+
+    def __init__(self, max_size=MAX_SIZE):
+        self._max_size = max_size
+        self._raw = OrderedDict()
+        self._keys = OrderedDict()
+        self.requests = 0
+
+    def add(self, path, data, key):
+        self.requests += 1
+        raw = json.dumps([path, data.get('triggerFields'),
+                          data.get('before'), data.get('after')],
+                         sort_keys=True)
+        self._remember(self._raw, raw)
+        self._remember(self._keys, key)
+
+    def _remember(self, seen, text):
+        short = hashlib.sha1(text.encode('utf-8')).digest()[:8]
+        seen.pop(short, None)
+        seen[short] = True
+        while len(seen) > self._max_size:
+            seen.popitem(last=False)
+
+    def stats(self):
+        raw, keys = len(self._raw), len(self._keys)
+        return {
+            'requests': self.requests,
+            'variants': raw,
+            'keys': keys,
+            'deduplicated': max(raw - keys, 0),
+        }
+
+
+stats = KeyStats()
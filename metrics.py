@@ -0,0 +1,202 @@
+import bisect
+
+# Bucket upper bounds, in seconds and bytes.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+INF = float('inf')
+
+
+def label_order(item):
+    return [str(value) for value in item[0]]
+
+
+def format_value(value):
+    if value == INF:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs))
+
+
+class Metric(object):
+
+    # A family of samples, one per combination of label values. Updates
+    # are a dict lookup and an add, so instruments can stay on in
+    # production. Everything runs on the event loop thread.
+
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def header(self):
+        return ['# HELP {} {}'.format(self.name, self.help),
+                '# TYPE {} {}'.format(self.name, self.kind)]
+
+    def render(self):
+        lines = self.header()
+        for values, value in sorted(self._values.items(), key=label_order):
+            lines.append('{}{} {}'.format(
+                self.name, format_labels(self.labels, values),
+                format_value(value)))
+        return lines
+
+
+class Counter(Metric):
+
+    kind = 'counter'
+
+    def inc(self, *values, amount=1):
+        self._values[values] = self._values.get(values, 0) + amount
+
+    def get(self, *values):
+        return self._values.get(values, 0)
+
+
+class Gauge(Metric):
+
+    kind = 'gauge'
+
+    def inc(self, *values, amount=1):
+        self._values[values] = self._values.get(values, 0) + amount
+
+    def dec(self, *values, amount=1):
+        self.inc(*values, amount=-amount)
+
+    def set(self, *values, value):
+        self._values[values] = value
+
+    def get(self, *values):
+        return self._values.get(values, 0)
+
+
+class Histogram(Metric):
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, *values, value):
+        sample = self._values.get(values)
+        if sample is None:
+            # per-bucket counts, then the sum and the count
+            sample = self._values[values] = [0] * (len(self.buckets) + 1) + \
+                [0.0, 0]
+        sample[bisect.bisect_left(self.buckets, value)] += 1
+        sample[-2] += value
+        sample[-1] += 1
+
+    def count(self, *values):
+        sample = self._values.get(values)
+        return sample[-1] if sample else 0
+
+    def render(self):
+        lines = self.header()
+        bounds = self.buckets + (INF,)
+        for values, sample in sorted(self._values.items(), key=label_order):
+            cumulative = 0
+            for bound, n in zip(bounds, sample):
+                cumulative += n
+                lines.append('{}_bucket{} {}'.format(
+                    self.name,
+                    format_labels(self.labels, values,
+                                  [('le', format_value(float(bound)))]),
+                    cumulative))
+            labels = format_labels(self.labels, values)
+            lines.append('{}_sum{} {}'.format(
+                self.name, labels, format_value(sample[-2])))
+            lines.append('{}_count{} {}'.format(
+                self.name, labels, sample[-1]))
+        return lines
+
+
+class Registry(object):
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def collector(self, prefix, help, func):
+
+        # func returns a dict of numbers, read at scrape time, such as the
+        # stats() of a cache. Each key becomes a gauge named prefix_key.
+
+        self._collectors.append((prefix, help, func))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for prefix, help, func in self._collectors:
+            for key, value in sorted(func().items()):
+                if not isinstance(value, (int, float)):
+                    continue
+                name = '{}_{}'.format(prefix, key)
+                lines.append('# HELP {} {} ({})'.format(name, help, key))
+                lines.append('# TYPE {} gauge'.format(name))
+                lines.append('{} {}'.format(name, format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+requests = registry.counter(
+    'sunlighttt_requests_total', 'HTTP requests handled.',
+    ['handler', 'trigger', 'status'])
+request_latency = registry.histogram(
+    'sunlighttt_request_seconds', 'Time spent handling HTTP requests.',
+    ['handler', 'trigger'])
+response_bytes = registry.histogram(
+    'sunlighttt_response_bytes', 'Size of HTTP response bodies.',
+    ['handler', 'trigger'], buckets=SIZE_BUCKETS)
+in_flight = registry.gauge(
+    'sunlighttt_requests_in_flight', 'HTTP requests being handled.')
+
+cache_lookups = registry.counter(
+    'sunlighttt_cache_lookups_total',
+    'Trigger cache lookups by result (hit, stale, miss).',
+    ['trigger', 'result'])
+
+upstream_latency = registry.histogram(
+    'sunlighttt_upstream_seconds', 'Time spent on Congress API calls.',
+    ['trigger'])
+upstream_responses = registry.counter(
+    'sunlighttt_upstream_responses_total',
+    'Congress API responses by status; 0 for calls that failed.',
+    ['trigger', 'status'])
+upstream_in_flight = registry.gauge(
+    'sunlighttt_upstream_in_flight', 'Congress API calls in progress.')
+
+serialize_latency = registry.histogram(
+    'sunlighttt_serialize_seconds', 'Time spent encoding trigger results.',
+    ['trigger'])
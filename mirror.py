@@ -0,0 +1,387 @@
+import asyncio
+import datetime
+import fcntl
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import util
+
+BILL_MIRROR = os.environ.get('BILL_MIRROR')
+
+# How far back the first sync goes, and how often to sync after that.
+MIRROR_SINCE = os.environ.get('BILL_MIRROR_SINCE')
+SYNC_INTERVAL = int(os.environ.get('BILL_MIRROR_INTERVAL', '300'))
+
+logger = logging.getLogger('sunlighttt.mirror')
+
+BILL_FIELDS = [
+    "bill_id", "bill_type", "number", "congress", "introduced_on",
+    "last_action_at", "short_title", "official_title", "popular_title",
+    "keywords", "summary_short", "sponsor",
+    "urls.congress", "urls.opencongress"]
+
+# Fields kept for building trigger records, and the ones searched.
+DOC_FIELDS = [
+    "bill_id", "bill_type", "number", "congress", "introduced_on",
+    "short_title", "official_title", "sponsor", "urls"]
+TEXT_FIELDS = [
+    "short_title", "official_title", "popular_title", "summary_short"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bills (
+    bill_id TEXT PRIMARY KEY,
+    congress INTEGER,
+    number INTEGER,
+    introduced_on TEXT,
+    last_action_at TEXT,
+    doc TEXT
+);
+CREATE INDEX IF NOT EXISTS bills_order
+    ON bills (congress, introduced_on, number);
+CREATE VIRTUAL TABLE IF NOT EXISTS bills_fts USING fts5(text);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def fts_quote(text):
+    return '"{}"'.format(text.replace('"', '""'))
+
+
+def fts_query(terms):
+
+    # Translates parsed query terms (see util.parse_query) to an FTS5
+    # match expression. Raises ValueError for what FTS5 can't express,
+    # which is a * anywhere but the end of a word.
+
+    out = []
+
+    for term in terms:
+
+        if term.phrase:
+            words = re.findall(r'\w+', term.text)
+            if not words:
+                continue
+            if term.distance is not None:
+                out.append('NEAR({}, {})'.format(
+                    ' '.join(fts_quote(w) for w in words), term.distance))
+            else:
+                out.append(fts_quote(' '.join(words)))
+
+        elif term.text in ('AND', 'OR', 'NOT'):
+            out.append(term.text)
+
+        elif '*' in term.text:
+            stem = term.text[:-1]
+            if '*' in stem or not term.text.endswith('*') or not stem:
+                raise ValueError('unsupported wildcard ({})'.format(term.text))
+            out.append(fts_quote(stem) + '*')
+
+        else:
+            out.append(fts_quote(term.text))
+
+    if not out:
+        raise ValueError('empty query')
+
+    return ' '.join(out)
+
+
+# Columns the API's order fields sort on here.
+ORDER_COLUMNS = {
+    'congress': 'bills.congress',
+    'introduced_on': 'bills.introduced_on',
+    'number': 'bills.number',
+}
+
+
+def sql_order(order):
+
+    # Translates an API order param, comma separated fields that sort
+    # descending unless they end in __asc, to an ORDER BY clause. Raises
+    # ValueError for fields the mirror doesn't have.
+
+    out = []
+
+    for field in order.split(','):
+        field, _, direction = field.partition('__')
+        if field not in ORDER_COLUMNS or direction not in ('', 'asc', 'desc'):
+            raise ValueError('unsupported order ({})'.format(field))
+        out.append('{} {}'.format(
+            ORDER_COLUMNS[field], 'ASC' if direction == 'asc' else 'DESC'))
+
+    return 'ORDER BY {}'.format(', '.join(out))
+
+
+def bill_text(bill):
+    parts = [bill.get(field) or '' for field in TEXT_FIELDS]
+    parts.extend(bill.get('keywords') or [])
+    return '\n'.join(parts)
+
+
+class BillMirror(object):
+
+    # Local copy of bills kept in SQLite with an FTS5 index over their
+    # titles, keywords and summaries, so bill searches don't have to go
+    # upstream. A background task pulls bills introduced or acted on
+    # since the last sync, 50 at a time.
+    #
+    # Searches run on the event loop thread against their own connection.
+    # They are index lookups and take milliseconds. Writes run on a single
+    # worker thread with a second connection. The database uses WAL so
+    # reads never wait for a sync. With several gunicorn workers sharing
+    # the file, a lock file makes sure only one of them syncs at a time.
+
+    PAGE_SIZE = 50
+
+    def __init__(self, path, since=MIRROR_SINCE, interval=SYNC_INTERVAL,
+                 loop=None):
+        self.path = path
+        self._since = since
+        self._interval = interval
+        self._loop = loop
+        self._db = None
+        self._writer = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._task = None
+        self._synced_at = None
+        self._read_at = None
+        self._oldest = None
+
+        self.searches = 0
+        self.synced = 0
+
+    def open(self):
+        if self._db is None:
+            self._db = self._connect()
+        return self._db
+
+    def _connect(self):
+        db = sqlite3.connect(self.path)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.executescript(SCHEMA)
+        return db
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._executor.shutdown(wait=False)
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def meta(self, key):
+        row = self.open().execute(
+            'SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    # Seconds between reads of when the last sync was while it looks too
+    # long ago; another worker may have synced since.
+    READ_INTERVAL = 10
+
+    @property
+    def ready(self):
+
+        # Only answer searches once a sync has completed recently enough.
+        # When the last sync is kept from a sync here or a recent read,
+        # this doesn't touch the database.
+
+        now = time.time()
+        fresh = self._synced_at is not None and \
+            now - self._synced_at < 3 * self._interval
+
+        if not fresh and (self._read_at is None or
+                          now - self._read_at >= self.READ_INTERVAL):
+            self._read_at = now
+            synced_at = self.meta('synced_at')
+            if synced_at is not None:
+                self._synced_at = float(synced_at)
+                fresh = now - self._synced_at < 3 * self._interval
+
+        return fresh
+
+    @property
+    def oldest(self):
+
+        # The introduced_on the first sync started from. Bills introduced
+        # before it may be missing, so searches bounded by an earlier date
+        # have to go to the API. Set once and never moved.
+
+        if self._oldest is None:
+            self._oldest = self.meta('since')
+        return self._oldest
+
+    def search(self, query, limit=20, before=None, after=None,
+               order='congress,introduced_on,number'):
+
+        # Bills matching query, in order as the API's bills/search would
+        # return them for the same order param. before and after are
+        # YYYY-MM-DD bounds on introduced_on. Raises ValueError for
+        # queries that can't be run locally, including ones bounded by a
+        # date before the mirror's oldest.
+
+        match = fts_query(util.parse_query(query))
+
+        oldest = self.oldest
+        for bound in (before, after):
+            if bound and (oldest is None or bound < oldest):
+                raise ValueError(
+                    '{} is before the mirror starts'.format(bound))
+
+        sql = ['SELECT bills.doc FROM bills_fts',
+               'JOIN bills ON bills.rowid = bills_fts.rowid',
+               'WHERE bills_fts MATCH ?']
+        args = [match]
+
+        if before:
+            sql.append('AND bills.introduced_on <= ?')
+            args.append(before)
+        if after:
+            sql.append('AND bills.introduced_on >= ?')
+            args.append(after)
+
+        sql.append(sql_order(order))
+        sql.append('LIMIT ?')
+        args.append(limit)
+
+        try:
+            rows = self.open().execute(' '.join(sql), args).fetchall()
+        except sqlite3.OperationalError as exc:
+            raise ValueError(str(exc))
+
+        self.searches += 1
+        return [json.loads(row[0]) for row in rows]
+
+    def _store(self, bills, cursors):
+
+        # Runs on the writer thread.
+
+        if self._writer is None:
+            self._writer = self._connect()
+
+        db = self._writer
+
+        with db:
+            for bill in bills:
+                doc = json.dumps({f: bill.get(f) for f in DOC_FIELDS})
+                values = (bill.get('congress'), bill.get('number'),
+                          bill.get('introduced_on'),
+                          bill.get('last_action_at'), doc)
+                row = db.execute('SELECT rowid FROM bills WHERE bill_id = ?',
+                                 (bill['bill_id'],)).fetchone()
+                if row:
+                    rowid = row[0]
+                    db.execute(
+                        'UPDATE bills SET congress = ?, number = ?,'
+                        ' introduced_on = ?, last_action_at = ?, doc = ?'
+                        ' WHERE rowid = ?', values + (rowid,))
+                    db.execute('DELETE FROM bills_fts WHERE rowid = ?',
+                               (rowid,))
+                else:
+                    rowid = db.execute(
+                        'INSERT INTO bills (congress, number, introduced_on,'
+                        ' last_action_at, doc, bill_id)'
+                        ' VALUES (?, ?, ?, ?, ?, ?)',
+                        values + (bill['bill_id'],)).lastrowid
+                db.execute('INSERT INTO bills_fts (rowid, text) VALUES (?, ?)',
+                           (rowid, bill_text(bill)))
+
+            for key, value in cursors.items():
+                db.execute('INSERT OR REPLACE INTO meta (key, value)'
+                           ' VALUES (?, ?)', (key, value))
+
+    @asyncio.coroutine
+    def _pull(self, get_json, url, since, cursor, field):
+
+        # Pages through bills with field on or after the stored cursor, or
+        # since for the first time, oldest first, storing each page and
+        # moving the cursor with it.
+
+        loop = self._loop or asyncio.get_event_loop()
+
+        since = self.meta(cursor) or since
+
+        page = 1
+        count = 0
+
+        while True:
+            params = {
+                'fields': ','.join(BILL_FIELDS),
+                '{}__gte'.format(field): since,
+                'order': '{}__asc'.format(field),
+                'page': page,
+            }
+            data = yield from get_json(url, params=params,
+                                       limit=self.PAGE_SIZE)
+            bills = data['results']
+
+            latest = max([b.get(field) or since for b in bills] + [since])
+            yield from loop.run_in_executor(
+                self._executor, self._store, bills, {cursor: latest})
+
+            count += len(bills)
+            if len(bills) < self.PAGE_SIZE:
+                return count
+            page += 1
+
+    @asyncio.coroutine
+    def sync(self, get_json, url):
+
+        # get_json is Trigger.get_json; url the API's bills endpoint.
+
+        loop = self._loop or asyncio.get_event_loop()
+
+        lock = open(self.path + '.lock', 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            return 0  # another worker is syncing
+
+        try:
+            since = self.oldest
+            if since is None:
+                since = self._since or (
+                    datetime.date.today() -
+                    datetime.timedelta(days=730)).isoformat()
+                yield from loop.run_in_executor(
+                    self._executor, self._store, [], {'since': since})
+                self._oldest = since
+            count = yield from self._pull(
+                get_json, url, since, 'introduced_cursor', 'introduced_on')
+            count += yield from self._pull(
+                get_json, url, since, 'modified_cursor', 'last_action_at')
+            synced_at = time.time()
+            yield from loop.run_in_executor(
+                self._executor, self._store, [],
+                {'synced_at': str(synced_at)})
+            self._synced_at = synced_at
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            lock.close()
+
+        self.synced += count
+        return count
+
+    @asyncio.coroutine
+    def run(self, get_json, url):
+        loop = self._loop or asyncio.get_event_loop()
+        while True:
+            try:
+                count = yield from self.sync(get_json, url)
+                logger.info('bill mirror synced %d bills', count)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('bill mirror sync failed')
+            yield from asyncio.sleep(self._interval, loop=loop)
+
+    def start(self, get_json, url):
+        loop = self._loop or asyncio.get_event_loop()
+        self.open()
+        self._task = loop.create_task(self.run(get_json, url))
+        return self._task
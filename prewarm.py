@@ -0,0 +1,210 @@
+import asyncio
+import fcntl
+import logging
+import os
+import tempfile
+import time
+
+# Turns the prewarmer on.
+PREWARM = os.environ.get('PREWARM', '') not in ('', '0')
+
+# How often cached results are looked over, and how many seconds of
+# freshness they may have left before they are refreshed.
+PREWARM_INTERVAL = float(os.environ.get('PREWARM_INTERVAL', '5'))
+PREWARM_LEAD = float(os.environ.get('PREWARM_LEAD', '15'))
+
+# How many of the most requested parameterized keys are kept warm, how
+# many refreshes run at once, and how often hit counts are halved so
+# keys that stop being polled drop out.
+PREWARM_TOP = int(os.environ.get('PREWARM_TOP', '50'))
+PREWARM_CONCURRENCY = int(os.environ.get('PREWARM_CONCURRENCY', '4'))
+PREWARM_DECAY = float(os.environ.get('PREWARM_DECAY', '300'))
+
+# Lock file that picks the one worker that prewarms when workers don't
+# share a cache.
+PREWARM_LOCK = os.environ.get(
+    'PREWARM_LOCK',
+    os.path.join(tempfile.gettempdir(), 'sunlighttt-prewarm.lock'))
+
+logger = logging.getLogger('sunlighttt.prewarm')
+
+
+class Key(object):
+
+    __slots__ = ('handler', 'fields', 'window', 'hits')
+
+    def __init__(self, handler, fields, window):
+        self.handler = handler
+        self.fields = fields
+        self.window = window
+        self.hits = 0
+
+
+class Prewarmer(object):
+
+    # Refreshes cached trigger results shortly before they expire, so
+    # pollers don't have to wait on upstream. That covers the static
+    # keys, triggers without fields whose one result depends only on the
+    # time, and the top most requested of the other keys.
+    #
+    # ttl(cache_key) gives the seconds of freshness a cached result has
+    # left, or None if there is none; refresh(handler, cache_key, fields,
+    # limit) refreshes one. Workers sharing a cache coordinate through
+    # the latter: see web.warm. Without one, pass lock, a lock file path:
+    # only the worker holding it prewarms, and the others keep trying to
+    # take it over.
+
+    MAX_KEYS = 10000
+
+    def __init__(self, refresh, ttl, static=(), interval=PREWARM_INTERVAL,
+                 lead=PREWARM_LEAD, top=PREWARM_TOP,
+                 concurrency=PREWARM_CONCURRENCY, decay=PREWARM_DECAY,
+                 lock=None, clock=time.monotonic, loop=None):
+        self._refresh = refresh
+        self._ttl = ttl
+        self._interval = interval
+        self._lead = lead
+        self._top = top
+        self._concurrency = concurrency
+        self._decay = decay
+        self._clock = clock
+        self._loop = loop
+        self._task = None
+        self._decayed = clock()
+        self._lock_path = lock
+        self._lock = None
+
+        self._static = {}
+        for handler, cache_key in static:
+            self._static[cache_key] = Key(handler, {}, handler.default_limit)
+        self._keys = {}
+
+        self.refreshes = 0
+        self.errors = 0
+
+    def seen(self, handler, cache_key, data):
+
+        # Counts a request for cache_key, with data its body. Results are
+        # refreshed for the largest limit asked for.
+
+        if data.get('before') or data.get('after'):
+            return
+
+        window = handler.window(data.get('limit'))
+        key = self._static.get(cache_key) or self._keys.get(cache_key)
+        if key is None:
+            if len(self._keys) >= self.MAX_KEYS:
+                return
+            key = self._keys[cache_key] = Key(
+                handler, data.get('triggerFields') or {}, window)
+        key.hits += 1
+        key.window = max(key.window, window)
+
+    def hot(self):
+        keys = sorted(self._keys.items(), key=lambda item: -item[1].hits)
+        return keys[:self._top]
+
+    def decay(self):
+        now = self._clock()
+        if now - self._decayed < self._decay:
+            return
+        self._decayed = now
+        for cache_key, key in list(self._keys.items()):
+            key.hits //= 2
+            if not key.hits:
+                del self._keys[cache_key]
+
+    def leading(self):
+
+        # Whether this worker is the one that prewarms.
+
+        if self._lock_path is None or self._lock is not None:
+            return True
+
+        lock = open(self._lock_path, 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            return False
+
+        self._lock = lock
+        return True
+
+    def due(self):
+
+        # (cache_key, Key) pairs to refresh now.
+
+        due = []
+        for cache_key, key in list(self._static.items()) + self.hot():
+            ttl = self._ttl(cache_key)
+            if ttl is None or ttl < self._lead:
+                due.append((cache_key, key))
+        return due
+
+    @asyncio.coroutine
+    def warm(self, cache_key, key, sem):
+        with (yield from sem):
+            yield from self._refresh(key.handler, cache_key, key.fields,
+                                     key.window)
+        self.refreshes += 1
+
+    @asyncio.coroutine
+    def run_once(self):
+
+        loop = self._loop or asyncio.get_event_loop()
+
+        self.decay()
+
+        if not self.leading():
+            return []
+
+        sem = asyncio.Semaphore(self._concurrency, loop=loop)
+        due = self.due()
+
+        results = yield from asyncio.gather(
+            *[self.warm(cache_key, key, sem) for cache_key, key in due],
+            loop=loop, return_exceptions=True)
+
+        for (cache_key, key), result in zip(due, results):
+            if isinstance(result, Exception):
+                self.errors += 1
+                logger.warning('prewarming %s failed: %r', cache_key, result)
+
+        return [cache_key for cache_key, key in due]
+
+    @asyncio.coroutine
+    def run(self):
+        loop = self._loop or asyncio.get_event_loop()
+        while True:
+            try:
+                yield from self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('prewarm run failed')
+            yield from asyncio.sleep(self._interval, loop=loop)
+
+    def start(self):
+        loop = self._loop or asyncio.get_event_loop()
+        self._task = loop.create_task(self.run())
+        return self._task
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._lock is not None:
+            fcntl.flock(self._lock, fcntl.LOCK_UN)
+            self._lock.close()
+            self._lock = None
+
+    def stats(self):
+        return {
+            'leading': int(self._lock_path is None or
+                           self._lock is not None),
+            'static': len(self._static),
+            'tracked': len(self._keys),
+            'refreshes': self.refreshes,
+            'errors': self.errors,
+        }
@@ -0,0 +1,207 @@
+import asyncio
+import cProfile
+import functools
+import io
+import os
+import pstats
+import random
+import time
+from collections import deque
+
+# Fraction of requests to profile, and the latency in seconds above which
+# a request is always kept. Both 0 (the default) turns profiling off.
+PROFILE_RATE = float(os.environ.get('PROFILE_RATE', '0'))
+PROFILE_SLOW = float(os.environ.get('PROFILE_SLOW', '0'))
+
+# Also run cProfile on sampled requests, and how many results to keep.
+PROFILE_CPROFILE = os.environ.get('PROFILE_CPROFILE', '') not in ('', '0')
+PROFILE_BUFFER = int(os.environ.get('PROFILE_BUFFER', '100'))
+
+# Profiles of the requests being handled, by the task handling them.
+_profiles = {}
+
+
+class Profile(object):
+
+    # Time per phase of one request. Phases add up across calls, so
+    # concurrent upstream pages count once each.
+
+    __slots__ = ('phases', 'started')
+
+    def __init__(self):
+        self.phases = {}
+        self.started = time.monotonic()
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0) + seconds
+
+
+class Phase(object):
+
+    __slots__ = ('profile', 'name', 't0')
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.monotonic()
+
+    def __exit__(self, *exc):
+        self.profile.add(self.name, time.monotonic() - self.t0)
+
+
+class NoPhase(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+NO_PHASE = NoPhase()
+
+
+class Timed(object):
+
+    # Wraps a function to add up the time spent in it, for record builds
+    # that run in between reads of an upstream body.
+
+    __slots__ = ('func', 'total')
+
+    def __init__(self, func):
+        self.func = func
+        self.total = 0
+
+    def __call__(self, *args):
+        t0 = time.monotonic()
+        try:
+            return self.func(*args)
+        finally:
+            self.total += time.monotonic() - t0
+
+
+def current():
+    if not _profiles:
+        return None
+    return _profiles.get(asyncio.Task.current_task())
+
+
+def phase(name):
+
+    # with phase('cache'): ... adds to the current request's profile, if
+    # it has one.
+
+    profile = current()
+    return NO_PHASE if profile is None else Phase(profile, name)
+
+
+def carry(func):
+
+    # For work a request hands to another task (see SingleFlight): the
+    # coroutine function returned records into the request's profile.
+
+    profile = current()
+    if profile is None:
+        return func
+
+    @functools.wraps(func)
+    @asyncio.coroutine
+    def wrapper(*args):
+        task = asyncio.Task.current_task()
+        _profiles[task] = profile
+        try:
+            return (yield from func(*args))
+        finally:
+            _profiles.pop(task, None)
+
+    return wrapper
+
+
+class Profiler(object):
+
+    # Keeps the last size profiled requests: a fraction rate of all of
+    # them, plus any that took longer than slow seconds. Requests that
+    # are neither cost a random() call, or a Profile object when slow is
+    # set since there's no telling in advance which ones will be slow.
+
+    def __init__(self, rate=PROFILE_RATE, slow=PROFILE_SLOW,
+                 cprofile=PROFILE_CPROFILE, size=PROFILE_BUFFER):
+        self.rate = rate
+        self.slow = slow
+        self.cprofile = cprofile
+        self.results = deque(maxlen=size)
+        self._profiling = False
+
+    @property
+    def enabled(self):
+        return self.rate > 0 or self.slow > 0
+
+    @asyncio.coroutine
+    def middleware(self, app, handler):
+
+        @asyncio.coroutine
+        def middleware(request):
+
+            sampled = self.rate > 0 and random.random() < self.rate
+            if not sampled and not self.slow:
+                return (yield from handler(request))
+
+            task = asyncio.Task.current_task()
+            profile = _profiles[task] = Profile()
+
+            # cProfile sees everything the loop runs while it's on, so
+            # only one request at a time gets it.
+            prof = None
+            if sampled and self.cprofile and not self._profiling:
+                self._profiling = True
+                prof = cProfile.Profile()
+                prof.enable()
+
+            status = 500
+            try:
+                resp = yield from handler(request)
+                status = resp.status
+                return resp
+            except Exception as exc:
+                status = getattr(exc, 'status', 500)
+                raise
+            finally:
+                if prof is not None:
+                    prof.disable()
+                    self._profiling = False
+                del _profiles[task]
+                total = time.monotonic() - profile.started
+                if sampled or total >= self.slow:
+                    self.record(request, status, profile, total, sampled,
+                                prof)
+
+        return middleware
+
+    def record(self, request, status, profile, total, sampled, prof):
+
+        phases = dict(profile.phases)
+        phases['other'] = max(total - sum(phases.values()), 0)
+
+        result = {
+            'path': request.path,
+            'trigger': request.match_info.get('trigger'),
+            'status': status,
+            'time': time.time(),
+            'total': total,
+            'reason': 'sampled' if sampled else 'slow',
+            'phases': phases,
+        }
+
+        if prof is not None:
+            out = io.StringIO()
+            stats = pstats.Stats(prof, stream=out)
+            stats.sort_stats('cumulative').print_stats(30)
+            result['cprofile'] = out.getvalue()
+
+        self.results.append(result)
+
+    def recent(self, limit=None):
+        results = list(reversed(self.results))
+        return results[:limit] if limit else results
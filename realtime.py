@@ -0,0 +1,265 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+
+# Where to send realtime notifications; unset turns the notifier off.
+# https://realtime.ifttt.com/v1/notifications in production.
+REALTIME_URL = os.environ.get('REALTIME_URL')
+
+# How often watched triggers are checked, how long one is watched after
+# its last poll and how many are watched at most.
+REALTIME_INTERVAL = int(os.environ.get('REALTIME_INTERVAL', '60'))
+REALTIME_IDLE = int(os.environ.get('REALTIME_IDLE', str(24 * 60 * 60)))
+REALTIME_MAX_KEYS = int(os.environ.get('REALTIME_MAX_KEYS', '10000'))
+
+# Lock file that picks the one worker that checks watched triggers.
+REALTIME_LOCK = os.environ.get(
+    'REALTIME_LOCK',
+    os.path.join(tempfile.gettempdir(), 'sunlighttt-realtime.lock'))
+
+logger = logging.getLogger('sunlighttt.realtime')
+
+
+class Watch(object):
+
+    __slots__ = ('handler', 'fields', 'window', 'identities', 'ids', 'seen')
+
+    def __init__(self, handler, fields, window):
+        self.handler = handler
+        self.fields = fields
+        self.window = window
+        self.identities = set()
+        self.ids = None
+        self.seen = 0
+
+
+class Notifier(object):
+
+    # Tells IFTTT which trigger identities have new items so it doesn't
+    # have to keep polling them. Every trigger polled without before or
+    # after is watched by cache key, together with the trigger identities
+    # that asked for it. Each interval the watched keys are checked again
+    # and their meta.id sets compared with the previous ones; identities
+    # of keys with new ids are sent in batches of BATCH_SIZE.
+    #
+    # check(handler, cache_key, fields, limit) runs a trigger and returns
+    # its JSONResponse, or None to skip the key this time; client is an
+    # UpstreamClient and key the channel key. While available() is false
+    # (the Congress API circuit is open) runs are skipped altogether.
+    #
+    # With several workers, only the one holding the lock file checks, so
+    # keys aren't fetched and notified once per worker. The others keep
+    # their watches and try to take the lock over on every run. IFTTT
+    # polls land on every worker, so the one checking gets to see every
+    # identity of the keys it watches soon enough.
+
+    BATCH_SIZE = 1000
+    CONCURRENCY = 10
+
+    def __init__(self, check, client, url=REALTIME_URL, key='',
+                 interval=REALTIME_INTERVAL, idle=REALTIME_IDLE,
+                 max_keys=REALTIME_MAX_KEYS, lock=None, available=None,
+                 clock=time.monotonic, loop=None):
+        self._check = check
+        self._available = available
+        self._client = client
+        self._url = url
+        self._key = key
+        self._interval = interval
+        self._idle = idle
+        self._max_keys = max_keys
+        self._clock = clock
+        self._loop = loop
+        self._watches = OrderedDict()
+        self._task = None
+        self._lock_path = lock
+        self._lock = None
+        self._following = False
+
+        self.checks = 0
+        self.skipped = 0
+        self.notified = 0
+        self.errors = 0
+
+    def __len__(self):
+        return len(self._watches)
+
+    @staticmethod
+    def ids(data):
+        return {record['meta']['id'] for record in data}
+
+    def watch(self, handler, cache_key, data, results):
+
+        # data is the trigger request's body, results what it got back.
+
+        identity = data.get('trigger_identity')
+        if not identity or data.get('before') or data.get('after'):
+            return
+
+        # ids are compared for the same window they were taken for; when
+        # it grows, the next check takes them again without notifying
+        window = handler.window(data.get('limit'))
+        watch = self._watches.pop(cache_key, None)
+        if watch is None:
+            watch = Watch(handler, data.get('triggerFields') or {}, window)
+            watch.ids = self.ids(results)
+        elif window > watch.window:
+            watch.window = window
+            watch.ids = None
+        watch.identities.add(identity)
+        watch.seen = self._clock()
+        self._watches[cache_key] = watch
+
+        while len(self._watches) > self._max_keys:
+            self._watches.popitem(last=False)
+
+    def prune(self):
+        cutoff = self._clock() - self._idle
+        while self._watches:
+            key, watch = next(iter(self._watches.items()))
+            if watch.seen >= cutoff:
+                break
+            del self._watches[key]
+
+    def leading(self):
+
+        # Whether this worker is the one that checks. A worker taking over
+        # from another has ids from when it was polled, possibly long ago,
+        # so it takes them again.
+
+        if self._lock_path is None or self._lock is not None:
+            return True
+
+        lock = open(self._lock_path, 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            self._following = True
+            return False
+
+        self._lock = lock
+        if self._following:
+            for watch in self._watches.values():
+                watch.ids = None
+        return True
+
+    @asyncio.coroutine
+    def changed(self, cache_key, watch, sem):
+
+        # Identities to notify for cache_key, if any.
+
+        with (yield from sem):
+            resp = yield from self._check(watch.handler, cache_key,
+                                          watch.fields, watch.window)
+        if resp is None:
+            return ()
+
+        self.checks += 1
+
+        data = getattr(resp, 'data', None)
+        if data is None:
+            return ()
+
+        ids = self.ids(data)
+        new = ids - watch.ids if watch.ids is not None else ()
+        watch.ids = ids
+
+        return watch.identities if new else ()
+
+    @asyncio.coroutine
+    def run_once(self):
+
+        loop = self._loop or asyncio.get_event_loop()
+
+        self.prune()
+
+        if not self.leading():
+            return []
+
+        if self._available is not None and not self._available():
+            self.skipped += 1
+            return []
+
+        sem = asyncio.Semaphore(self.CONCURRENCY, loop=loop)
+        watches = list(self._watches.items())
+
+        results = yield from asyncio.gather(
+            *[self.changed(key, watch, sem) for key, watch in watches],
+            loop=loop, return_exceptions=True)
+
+        identities = set()
+        for (key, watch), result in zip(watches, results):
+            if isinstance(result, Exception):
+                self.errors += 1
+                logger.warning('realtime check for %s failed: %r',
+                               key, result)
+            else:
+                identities.update(result)
+
+        identities = sorted(identities)
+        for i in range(0, len(identities), self.BATCH_SIZE):
+            yield from self.notify(identities[i:i + self.BATCH_SIZE])
+
+        return identities
+
+    @asyncio.coroutine
+    def notify(self, identities):
+        body = json.dumps({
+            'data': [{'trigger_identity': i} for i in identities],
+        })
+        headers = {
+            'IFTTT-Channel-Key': self._key,
+            'X-Request-ID': uuid.uuid4().hex,
+            'Content-Type': 'application/json',
+        }
+        status, _ = yield from self._client.request(
+            'post', self._url, headers=headers, data=body.encode('utf-8'))
+        if status != 200:
+            self.errors += 1
+            logger.warning('realtime notification got %s', status)
+        else:
+            self.notified += len(identities)
+
+    @asyncio.coroutine
+    def run(self):
+        loop = self._loop or asyncio.get_event_loop()
+        while True:
+            yield from asyncio.sleep(self._interval, loop=loop)
+            try:
+                yield from self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('realtime run failed')
+
+    def start(self):
+        loop = self._loop or asyncio.get_event_loop()
+        self._task = loop.create_task(self.run())
+        return self._task
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._lock is not None:
+            fcntl.flock(self._lock, fcntl.LOCK_UN)
+            self._lock.close()
+            self._lock = None
+
+    def stats(self):
+        return {
+            'leading': int(self._lock_path is None or
+                           self._lock is not None),
+            'watched': len(self._watches),
+            'checks': self.checks,
+            'skipped': self.skipped,
+            'notified': self.notified,
+            'errors': self.errors,
+        }
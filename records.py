@@ -0,0 +1,65 @@
+def lookup(item, path):
+    value = item
+    for part in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+class Source(object):
+
+    # One value in a trigger record, read from one or more upstream field
+    # paths. With a single path, func gets the value found there; with
+    # several, it gets the whole item. default replaces a missing value.
+
+    def __init__(self, *paths, func=None, default=None):
+        self.paths = paths
+        self.func = func
+        self.default = default
+
+    def __call__(self, item):
+        if len(self.paths) == 1:
+            value = lookup(item, self.paths[0])
+        else:
+            value = item
+        if value is not None and self.func is not None:
+            value = self.func(value)
+        return self.default if value is None else value
+
+
+class Record(object):
+
+    # Declarative description of a trigger record: a dict, possibly nested,
+    # of Sources. The same spec gives the fields= parameter to ask upstream
+    # for and builds the record from each result. extra lists any other
+    # fields the trigger reads from results itself.
+
+    def __init__(self, spec, extra=()):
+        self.spec = spec
+        paths = set(extra)
+        self._collect(spec, paths)
+        self.fields = sorted(paths)
+
+    def _collect(self, spec, paths):
+        for source in spec.values():
+            if isinstance(source, dict):
+                self._collect(source, paths)
+            else:
+                paths.update(source.paths)
+
+    @property
+    def param(self):
+        return ','.join(self.fields)
+
+    def build(self, spec, item):
+        record = {}
+        for key, source in spec.items():
+            if isinstance(source, dict):
+                record[key] = self.build(source, item)
+            else:
+                record[key] = source(item)
+        return record
+
+    def __call__(self, item):
+        return self.build(self.spec, item)
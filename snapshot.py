@@ -0,0 +1,203 @@
+import asyncio
+import fcntl
+import json
+import logging
+import mmap
+import os
+import time
+from collections import OrderedDict
+
+from util import Payload
+
+# File the trigger cache is saved to so restarts begin warm; unset turns
+# snapshots off. Seconds between snapshots, besides the one at shutdown.
+CACHE_SNAPSHOT = os.environ.get('CACHE_SNAPSHOT')
+SNAPSHOT_INTERVAL = int(os.environ.get('CACHE_SNAPSHOT_INTERVAL', '60'))
+
+MAGIC = b'sunlighttt-cache 1\n'
+
+logger = logging.getLogger('sunlighttt.snapshot')
+
+
+class CacheSnapshot(object):
+
+    # Saves the live entries of a CappedCache of Payloads to a file. Each
+    # entry is a JSON header line
+    #
+    #   [key, fresh until, stale until, window, etag, length]
+    #
+    # with both times as wall-clock epochs, followed by length bytes of
+    # the payload's encoded body. Loading maps the file and hands bodies
+    # to Payload.from_body as they are, so it costs little more than
+    # reading the file; results are decoded when first served.
+    #
+    # The file is only ever replaced whole, by renaming a new one over it,
+    # so workers can read it while another one writes. Writers take a lock
+    # file and merge in the entries already there that are still live, so
+    # every worker's entries end up in it; for keys several workers hold,
+    # the one fresh the longest wins. At most max_size entries are kept,
+    # the most recently used.
+
+    def __init__(self, path, interval=SNAPSHOT_INTERVAL, max_size=0,
+                 clock=time.time, loop=None):
+        self.path = path
+        self._interval = interval
+        self._max_size = max_size
+        self._clock = clock
+        self._loop = loop
+        self._task = None
+
+        self.loaded = 0
+        self.saved = 0
+
+    def read(self):
+
+        # (key, fresh until, stale until, window, etag, body) tuples, in
+        # the order they were written. A damaged file yields what could
+        # be read of it.
+
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return []
+
+        entries = []
+
+        with f:
+            if not os.fstat(f.fileno()).st_size:
+                return entries
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if mm.readline() != MAGIC:
+                    logger.warning('%s is not a cache snapshot', self.path)
+                    return entries
+                try:
+                    while True:
+                        line = mm.readline()
+                        if not line:
+                            break
+                        key, fresh, stale, window, etag, length = \
+                            json.loads(line.decode('utf-8'))
+                        start = mm.tell()
+                        if start + length > len(mm):
+                            raise ValueError('truncated body')
+                        body = mm[start:start + length]
+                        mm.seek(start + length)
+                        entries.append(
+                            (key, fresh, stale, window, etag, body))
+                except ValueError as exc:
+                    logger.warning('cache snapshot %s is damaged: %s',
+                                   self.path, exc)
+
+        return entries
+
+    def load(self, cache):
+
+        # Puts the entries that are still live into cache, fresh or stale
+        # as they were. Runs at startup, before requests come in.
+
+        now = self._clock()
+        count = 0
+
+        for key, fresh, stale, window, etag, body in self.read():
+            if stale <= now:
+                continue
+            # set() takes a timeout of 0 to mean its default
+            timeout = fresh - now if fresh > now else -1e-6
+            cache.set(key, Payload.from_body(body, window, etag),
+                      timeout=timeout, stale=stale - now - timeout)
+            count += 1
+
+        self.loaded += count
+        return count
+
+    def write(self, entries):
+
+        # entries as read() returns them. Blocks; see save().
+
+        lock = open(self.path + '.lock', 'w')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        try:
+            now = self._clock()
+
+            merged = OrderedDict()
+            for entry in self.read():
+                if entry[2] > now:
+                    merged[entry[0]] = entry
+            for entry in entries:
+                old = merged.pop(entry[0], None)
+                merged[entry[0]] = entry if old is None or \
+                    entry[1] >= old[1] else old
+
+            entries = list(merged.values())
+            if self._max_size:
+                entries = entries[-self._max_size:]
+
+            tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+            with open(tmp, 'wb') as f:
+                f.write(MAGIC)
+                for key, fresh, stale, window, etag, body in entries:
+                    header = [key, fresh, stale, window, etag, len(body)]
+                    f.write(json.dumps(header).encode('utf-8'))
+                    f.write(b'\n')
+                    f.write(body)
+            os.replace(tmp, self.path)
+
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            lock.close()
+
+        return len(entries)
+
+    @asyncio.coroutine
+    def save(self, cache):
+
+        # Takes the entries on the loop, then merges and writes them on a
+        # worker thread.
+
+        loop = self._loop or asyncio.get_event_loop()
+        now = self._clock()
+
+        entries = [(key, now + fresh, now + stale, payload.window,
+                    payload.etag, payload.body)
+                   for key, payload, fresh, stale in cache.entries()]
+
+        count = yield from loop.run_in_executor(None, self.write, entries)
+        self.saved += 1
+        return count
+
+    @asyncio.coroutine
+    def run(self, cache):
+        loop = self._loop or asyncio.get_event_loop()
+        while True:
+            yield from asyncio.sleep(self._interval, loop=loop)
+            try:
+                yield from self.save(cache)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('cache snapshot failed')
+
+    def start(self, cache):
+        loop = self._loop or asyncio.get_event_loop()
+        self._task = loop.create_task(self.run(cache))
+        return self._task
+
+    @asyncio.coroutine
+    def close(self, cache):
+
+        # Stops the periodic snapshots and takes a last one.
+
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        try:
+            yield from self.save(cache)
+        except Exception:
+            logger.exception('cache snapshot failed')
+
+    def stats(self):
+        return {
+            'loaded': self.loaded,
+            'saved': self.saved,
+        }
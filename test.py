@@ -1,6 +1,30 @@
+import asyncio
+import datetime
+import json
+import os
+import tempfile
 import time
 import unittest
-from util import CappedCache
+import zlib
+from cache import MemcacheClient, SharedCache
+from districts import DistrictIndex, from_census
+from guard import UpstreamGuard, Unavailable, CLOSED, OPEN, HALF_OPEN
+from keys import KeyStats, canonical_query, point, snap
+from mirror import BillMirror, fts_query
+from metrics import Registry
+import profiling
+import triggers
+from realtime import Notifier
+from prewarm import Prewarmer
+from records import Record, Source
+from snapshot import CacheSnapshot
+from triggers import BirthdayIndex, NewBillsQuery, Trigger
+from ttl import TTLPolicy
+from upstream import BuildError, ResultStream
+from util import CappedCache, JSONResponse, Payload, SingleFlight
+from util import accept_encoding, etag_matches
+from util import parse_query, date_to_epoch, time_to_epoch, readable_date
+import web
 
 
 class TestCappedCache(unittest.TestCase):
@@ -37,8 +61,1437 @@ class TestCappedCache(unittest.TestCase):
         self.assertFalse('a' in cc)
         self.assertIsNone(cc['a'])
 
+    def test_stale(self):
 
+        cc = CappedCache()
+        cc.set('a', 'x', timeout=1, stale=2)
+
+        self.assertEqual(cc.peek('a'), ('x', True))
+
+        time.sleep(1.5)
+
+        self.assertFalse('a' in cc)
+        self.assertEqual(cc.peek('a'), ('x', False))
+
+        time.sleep(2)
+
+        self.assertEqual(cc.peek('a'), (None, False))
+        self.assertEqual(len(cc), 0)
+
+    def test_lru(self):
+
+        cc = CappedCache(max_size=3)
+
+        cc['a'] = 'x'
+        cc['b'] = 'x'
+        cc['c'] = 'x'
+
+        cc.get('a')
+        cc['d'] = 'x'
+
+        self.assertTrue('a' in cc)
+        self.assertFalse('b' in cc)
+        self.assertEqual(cc.evictions, 1)
+
+    def test_counters(self):
+
+        now = [0]
+        cc = CappedCache(clock=lambda: now[0])
+
+        cc.set('a', 'x', timeout=10, stale=10)
+        cc.set('b', 'x', timeout=10)
+
+        cc.get('a')
+        cc.get('z')
+        now[0] = 15
+        cc.peek('a')
+        cc.set('c', 'x', timeout=10)
+
+        self.assertEqual(cc.stats(), {
+            'size': 2, 'hits': 1, 'stale': 1, 'misses': 1,
+            'evictions': 0, 'expirations': 1,
+        })
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.sf = SingleFlight(loop=self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_coalesce(self):
+
+        calls = []
+
+        @asyncio.coroutine
+        def work(val):
+            calls.append(val)
+            yield from asyncio.sleep(0.01, loop=self.loop)
+            return val
+
+        tasks = [self.sf.do('k', work, i) for i in range(5)]
+        results = self.loop.run_until_complete(
+            asyncio.gather(*tasks, loop=self.loop))
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, calls * 5)
+        self.assertEqual(self.sf.calls, 1)
+        self.assertEqual(self.sf.coalesced, 4)
+        self.assertFalse('k' in self.sf)
+
+    def test_errors_not_kept(self):
+
+        @asyncio.coroutine
+        def fail():
+            yield from asyncio.sleep(0.01, loop=self.loop)
+            raise ValueError('upstream')
+
+        tasks = [self.sf.do('k', fail) for i in range(3)]
+        results = self.loop.run_until_complete(
+            asyncio.gather(*tasks, loop=self.loop, return_exceptions=True))
+
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+        self.assertEqual(len(self.sf), 0)
+
+        @asyncio.coroutine
+        def ok():
+            return 'x'
+
+        result = self.loop.run_until_complete(self.sf.do('k', ok))
+        self.assertEqual(result, 'x')
+        self.assertEqual(self.sf.calls, 2)
+
+
+
+
+
+class TestJSONResponse(unittest.TestCase):
+
+    def test_copy_shares_payload(self):
+
+        resp = JSONResponse([{'meta': {'id': 'hr1-114'}}])
+        copy = resp.copy()
+
+        self.assertIs(copy.body, resp.body)
+        self.assertEqual(copy.headers['ETag'], resp.payload.etag)
+        self.assertEqual(copy.content_length, resp.payload.length)
+        self.assertEqual(JSONResponse(resp.data).payload.etag,
+                         resp.payload.etag)
+
+    def test_slice(self):
+
+        payload = Payload(list(range(20)), window=20)
+
+        self.assertTrue(payload.covers(5))
+        self.assertFalse(payload.covers(50))
+        self.assertEqual(payload.slice(5).data, [0, 1, 2, 3, 4])
+        self.assertIs(payload.slice(5), payload.slice(5))
+        self.assertIs(payload.slice(20), payload)
+
+        # fewer records than asked for means there are no more to get
+        short = Payload(list(range(3)), window=20)
+        self.assertTrue(short.covers(50))
+
+    def test_compressed(self):
+
+        resp = JSONResponse([{'title': 'Common Core'}] * 100)
+        gzipped = JSONResponse(resp.data, payload=resp.payload,
+                               encoding='gzip')
+
+        self.assertEqual(gzipped.headers['Content-Encoding'], 'gzip')
+        self.assertNotEqual(gzipped.headers['ETag'], resp.headers['ETag'])
+        self.assertIs(gzipped.body, resp.payload.compressed('gzip'))
+        self.assertEqual(zlib.decompress(gzipped.body, 31), resp.body)
+        self.assertEqual(zlib.decompress(resp.payload.compressed('deflate')),
+                         resp.body)
+
+    def test_negotiation(self):
+
+        self.assertEqual(accept_encoding('gzip, deflate'), 'gzip')
+        self.assertEqual(accept_encoding('deflate, gzip;q=0'), 'deflate')
+        self.assertEqual(accept_encoding('*;q=0.5'), 'gzip')
+        self.assertIsNone(accept_encoding('identity'))
+        self.assertIsNone(accept_encoding(''))
+
+        self.assertTrue(etag_matches('"a", W/"b"', ['"b"']))
+        self.assertTrue(etag_matches('*', ['"b"']))
+        self.assertFalse(etag_matches('"a"', ['"b"']))
+
+
+class FakeMemcache(object):
+
+    def __init__(self):
+        self.data = {}
+        self.down = False
+
+    @asyncio.coroutine
+    def get(self, key):
+        if self.down:
+            raise ConnectionRefusedError()
+        return self.data.get(key)
+
+    @asyncio.coroutine
+    def set(self, key, val, exptime=0):
+        self.data[key] = val
+
+    @asyncio.coroutine
+    def add(self, key, val, exptime=0):
+        if key in self.data:
+            return False
+        self.data[key] = val
+        return True
+
+    @asyncio.coroutine
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+class MemcacheServer(object):
+
+    # Just enough of memcached's text protocol for SharedCache, counting
+    # the connections clients open.
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.data = {}
+        self.connections = 0
+
+    @asyncio.coroutine
+    def start(self):
+        self.server = yield from asyncio.start_server(
+            self.handle, '127.0.0.1', 0, loop=self.loop)
+        return self.server.sockets[0].getsockname()[1]
+
+    def stop(self):
+        self.server.close()
+
+    @asyncio.coroutine
+    def handle(self, reader, writer):
+        self.connections += 1
+        while True:
+            line = yield from reader.readline()
+            if not line:
+                break
+            command, key, *rest = line.split()
+            if command == b'get':
+                if key in self.data:
+                    val = self.data[key]
+                    writer.write(b'VALUE ' + key + b' 0 ' +
+                                 str(len(val)).encode('ascii') + b'\r\n' +
+                                 val + b'\r\n')
+                writer.write(b'END\r\n')
+            elif command in (b'set', b'add'):
+                val = yield from reader.readexactly(int(rest[2]) + 2)
+                if command == b'add' and key in self.data:
+                    writer.write(b'NOT_STORED\r\n')
+                else:
+                    self.data[key] = val[:-2]
+                    writer.write(b'STORED\r\n')
+            elif command == b'delete':
+                self.data.pop(key, None)
+                writer.write(b'DELETED\r\n')
+        writer.close()
+
+
+class TestSharedCache(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.mc = FakeMemcache()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def worker(self):
+        return SharedCache(self.mc, poll_interval=0.01, loop=self.loop)
+
+    def test_roundtrip(self):
+
+        sc = self.worker()
+        data = [{'meta': {'id': 'hr1-114'}, 'title': 'x'}]
+
+        self.loop.run_until_complete(sc.set('/k', data, 60, 20))
+        hit = self.loop.run_until_complete(sc.get('/k'))
+
+        self.assertEqual(hit[0], data)
+        self.assertTrue(0 < hit[1] <= 60)
+        self.assertEqual(hit[2], 20)
+
+        self.mc.down = True
+        self.assertIsNone(self.loop.run_until_complete(sc.get('/k')))
+        self.assertEqual(sc.errors, 1)
+
+        self.mc.down = False
+        for raw in (b'junk', zlib.compress(b'{"x": 1}'), zlib.compress(b'[')):
+            self.mc.data[sc.key('/k')] = raw
+            self.assertIsNone(self.loop.run_until_complete(sc.get('/k')))
+        self.assertEqual(sc.errors, 4)
+
+    def test_lease(self):
+
+        fetches = []
+
+        @asyncio.coroutine
+        def fill(sc):
+            if (yield from sc.lease('/k')):
+                fetches.append(sc)
+                yield from asyncio.sleep(0.05, loop=self.loop)
+                yield from sc.set('/k', ['x'], 60)
+                yield from sc.release('/k')
+                return ['x']
+            hit = yield from sc.wait('/k')
+            return hit[0]
+
+        workers = [self.worker() for i in range(3)]
+        results = self.loop.run_until_complete(asyncio.gather(
+            *[fill(sc) for sc in workers], loop=self.loop))
+
+        self.assertEqual(results, [['x']] * 3)
+        self.assertEqual(len(fetches), 1)
+        self.assertEqual(len(self.mc.data), 1)
+
+
+    def test_connections(self):
+
+        server = MemcacheServer(self.loop)
+        port = self.loop.run_until_complete(server.start())
+        client = MemcacheClient('127.0.0.1', port, pool_size=2,
+                                loop=self.loop)
+        sc = SharedCache(client, timeout=1, loop=self.loop)
+
+        for i in range(10):
+            self.loop.run_until_complete(sc.set('/k', ['x'], 60))
+            self.assertEqual(
+                self.loop.run_until_complete(sc.get('/k'))[0], ['x'])
+        self.assertEqual(server.connections, 1)
+
+        # Concurrent commands past the pool size open connections of
+        # their own, but only pool_size of them are kept afterwards.
+        self.loop.run_until_complete(asyncio.gather(
+            *[sc.get('/k') for i in range(5)], loop=self.loop))
+        self.assertEqual(server.connections, 5)
+        for i in range(10):
+            self.loop.run_until_complete(sc.get('/k'))
+        self.assertEqual(server.connections, 5)
+        self.assertEqual(sc.errors, 0)
+
+        client.close()
+        server.stop()
+        self.loop.run_until_complete(asyncio.sleep(0, loop=self.loop))
+
+
+class TestBirthdayIndex(unittest.TestCase):
+
+    def legislator(self, last_name, birthday):
+        return {
+            'title': 'Sen', 'first_name': 'A', 'last_name': last_name,
+            'state': 'SD', 'party': 'R', 'district': None,
+            'birthday': birthday, 'bioguide_id': last_name,
+        }
+
+    def setUp(self):
+        legislators = [
+            self.legislator('Carter', '1950-03-02'),
+            self.legislator('Adams', '1960-03-02'),
+            self.legislator('Baker', '1955-01-15'),
+            self.legislator('Leap', '1964-02-29'),
+            self.legislator('Later', '1970-12-25'),
+        ]
+        self.index = BirthdayIndex(datetime.date(2015, 3, 2), legislators)
+
+    def epoch(self, *ymd):
+        return datetime.datetime(*ymd, hour=12).timestamp()
+
+    def test_order(self):
+
+        names = [r['meta']['id'] for r in self.index.query()]
+        self.assertEqual(names, ['2015/Adams', '2015/Carter',
+                                 '2015/Leap', '2015/Baker'])
+
+        leap = self.index.query()[2]
+        self.assertEqual(leap['date'], '2015-02-28')
+        self.assertEqual(leap['age'], 51)
+
+    def test_before_after(self):
+
+        ids = lambda records: [r['meta']['id'] for r in records]
+
+        before = self.index.query(before=self.epoch(2015, 3, 1))
+        self.assertEqual(ids(before), ['2015/Leap', '2015/Baker'])
+
+        after = self.index.query(after=self.epoch(2015, 2, 28))
+        self.assertEqual(ids(after), ['2015/Adams', '2015/Carter'])
+
+        self.assertEqual(len(self.index.query(limit=1)), 1)
+
+
+class TestDistrictIndex(unittest.TestCase):
+
+    def square(self, x0, y0, x1, y1):
+        return [[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]
+
+    def setUp(self):
+        collection = {'features': [
+            {
+                'properties': {'state': 'SD', 'district': 0},
+                'geometry': {
+                    'type': 'Polygon',
+                    'coordinates': [self.square(-104, 42.5, -96.5, 46),
+                                    self.square(-100, 44, -99, 45)],
+                },
+            },
+            {
+                'properties': {'state': 'HI', 'district': '2'},
+                'geometry': {
+                    'type': 'MultiPolygon',
+                    'coordinates': [[self.square(-156, 19, -155, 20)],
+                                    [self.square(-158, 21, -157.5, 21.5)]],
+                },
+            },
+        ]}
+        self.index = DistrictIndex.from_geojson(collection)
+
+    def test_locate(self):
+
+        self.assertEqual(len(self.index), 2)
+        self.assertEqual(self.index.locate(44.967586, -103.772234).key, 'SD-0')
+        self.assertEqual(self.index.locate(21.3, -157.8).key, 'HI-2')
+        self.assertEqual(self.index.locate(19.5, -155.5).key, 'HI-2')
+
+    def test_outside(self):
+
+        # in the hole, and outside every district
+        self.assertIsNone(self.index.locate(44.5, -99.5))
+        self.assertIsNone(self.index.locate(38.9, -77.0))
+        self.assertEqual(len(DistrictIndex.load(None)), 0)
+
+    def test_from_census(self):
+
+        def feature(statefp, cd, coordinates):
+            return {
+                'properties': {'STATEFP': statefp, 'CD116FP': cd,
+                               'GEOID': statefp + cd},
+                'geometry': {'type': 'Polygon', 'coordinates': coordinates},
+            }
+
+        collection = from_census({'features': [
+            feature('46', '00', [self.square(-104, 42.5, -96.5, 46)]),
+            feature('11', '98', [self.square(-77.12, 38.8, -76.9, 39)]),
+            feature('15', '02', [[[-156.0000012, 19.0], [-155, 19],
+                                  [-155, 20], [-156, 20], [-156, 19]]]),
+            feature('06', 'ZZ', [self.square(-125, 32, -124, 33)]),
+        ]})
+
+        self.assertEqual(
+            [f['properties'] for f in collection['features']],
+            [{'state': 'SD', 'district': 0}, {'state': 'DC', 'district': 0},
+             {'state': 'HI', 'district': 2}])
+        self.assertEqual(
+            collection['features'][2]['geometry']['coordinates'][0][0],
+            [-156.0, 19.0])
+
+        index = DistrictIndex.from_geojson(collection)
+        self.assertEqual(index.locate(38.9, -77.0).key, 'DC-0')
+
+
+class TestBillMirror(unittest.TestCase):
+
+    def bill(self, number, title, introduced_on):
+        return {
+            'bill_id': 'hr{}-114'.format(number), 'bill_type': 'hr',
+            'number': number, 'congress': 114,
+            'introduced_on': introduced_on, 'official_title': title,
+            'keywords': ['education'],
+        }
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.mirror = BillMirror(os.path.join(self.tmp.name, 'bills.db'))
+        self.mirror._store([
+            self.bill(1, 'Common Core State Standards Act', '2015-01-06'),
+            self.bill(2, 'Core standards for common schools', '2015-02-01'),
+            self.bill(3, 'Standardized testing relief', '2015-03-01'),
+        ], {'synced_at': str(time.time()), 'since': '2015-01-01'})
+
+    def tearDown(self):
+        self.mirror.close()
+        self.tmp.cleanup()
+
+    def ids(self, query, **kwargs):
+        return [b['bill_id'] for b in self.mirror.search(query, **kwargs)]
+
+    def test_fts_query(self):
+
+        self.assertEqual(fts_query(parse_query('"Common Core"~3 tax*')),
+                         'NEAR("Common" "Core", 3) "tax"*')
+        with self.assertRaises(ValueError):
+            fts_query(parse_query('t*x'))
+
+    def test_search(self):
+
+        self.assertTrue(self.mirror.ready)
+        self.assertEqual(self.ids('"common core"'), ['hr1-114'])
+        self.assertEqual(self.ids('"common core"~3'), ['hr2-114', 'hr1-114'])
+        self.assertEqual(self.ids('standard*'),
+                         ['hr3-114', 'hr2-114', 'hr1-114'])
+        self.assertEqual(self.ids('education', limit=1), ['hr3-114'])
+        self.assertEqual(self.ids('standard*', before='2015-02-15'),
+                         ['hr2-114', 'hr1-114'])
+
+        # after comes oldest first, as Trigger.bound asks the API for
+        self.assertEqual(self.ids('standard*', limit=2, after='2015-01-10',
+                                  order='introduced_on__asc'),
+                         ['hr2-114', 'hr3-114'])
+        self.assertEqual(self.ids('education', limit=1,
+                                  order='introduced_on__asc'), ['hr1-114'])
+        with self.assertRaises(ValueError):
+            self.ids('education', order='bill_id')
+
+    def test_ready(self):
+
+        reads = []
+        meta = self.mirror.meta
+        self.mirror.meta = lambda key: reads.append(key) or meta(key)
+
+        self.assertTrue(self.mirror.ready)
+        self.assertTrue(self.mirror.ready)
+        self.assertEqual(reads, ['synced_at'])
+
+        # a sync long ago is read again, but not on every check
+        self.mirror._synced_at -= 3600
+        self.mirror._store([], {'synced_at': str(time.time() - 3600)})
+        self.mirror._read_at = None
+        self.assertFalse(self.mirror.ready)
+        self.assertFalse(self.mirror.ready)
+        self.assertEqual(len(reads), 2)
+
+    def test_oldest(self):
+
+        # bounds before the first sync's start are left to the API
+        self.assertEqual(self.ids('standard*', before='2015-01-06'),
+                         ['hr1-114'])
+        with self.assertRaises(ValueError):
+            self.ids('standard*', before='2014-12-01')
+        with self.assertRaises(ValueError):
+            self.ids('standard*', after='2014-12-01')
+
+    def test_sync(self):
+
+        calls = []
+
+        @asyncio.coroutine
+        def get_json(url, params=None, limit=None):
+            calls.append(params)
+            return {'results': [self.bill(4, 'Farm bill', '2016-02-01')]}
+
+        mirror = BillMirror(os.path.join(self.tmp.name, 'new.db'),
+                            since='2016-01-01')
+        loop = asyncio.get_event_loop()
+        self.assertEqual(loop.run_until_complete(
+            mirror.sync(get_json, 'stub')), 2)
+        self.assertEqual(calls[0]['introduced_on__gte'], '2016-01-01')
+        self.assertEqual(mirror.oldest, '2016-01-01')
+        self.assertEqual(mirror.meta('introduced_cursor'), '2016-02-01')
+        mirror.close()
+
+    def test_update(self):
+
+        self.mirror._store([self.bill(3, 'Common Core repeal', '2015-03-01')],
+                           {})
+        self.assertEqual(self.ids('repeal'), ['hr3-114'])
+        self.assertEqual(self.ids('testing'), [])
+
+
+class TestCacheSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'cache.snapshot')
+        self.now = [0]
+        self.wall = [1000]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def cache(self):
+        return CappedCache(max_size=10, clock=lambda: self.now[0])
+
+    def snapshot(self, **kwargs):
+        return CacheSnapshot(self.path, clock=lambda: self.wall[0], **kwargs)
+
+    def save(self, snapshot, cache):
+        loop = asyncio.get_event_loop()
+        return loop.run_until_complete(snapshot.save(cache))
+
+    def test_roundtrip(self):
+
+        cache = self.cache()
+        cache.set('fresh', Payload([1, 2], window=20), timeout=60, stale=600)
+        cache.set('stale', Payload([3], window=20), timeout=10, stale=600)
+        cache.set('gone', Payload([4]), timeout=10, stale=5)
+        self.now[0] = 30
+        self.assertEqual(self.save(self.snapshot(), cache), 2)
+
+        # a restart 20 seconds later
+        self.wall[0] += 20
+        self.now[0] = 5000
+        restored = self.cache()
+        self.assertEqual(self.snapshot().load(restored), 2)
+
+        payload, fresh = restored.peek('fresh')
+        self.assertTrue(fresh)
+        self.assertEqual(payload.data, [1, 2])
+        self.assertEqual(payload.etag, Payload([1, 2]).etag)
+        self.assertEqual(payload.window, 20)
+
+        payload, fresh = restored.peek('stale')
+        self.assertFalse(fresh)
+        self.assertEqual(payload.data, [3])
+
+        self.now[0] += 11
+        self.assertFalse(restored.peek('fresh')[1])
+        self.now[0] += 600
+        self.assertEqual(restored.peek('fresh'), (None, False))
+
+    def test_merge(self):
+
+        one = self.cache()
+        one.set('a', Payload(['one']), timeout=60)
+        one.set('b', Payload(['one']), timeout=60)
+        two = self.cache()
+        two.set('b', Payload(['two']), timeout=30)
+        two.set('c', Payload(['two']), timeout=30)
+
+        self.save(self.snapshot(), one)
+        self.assertEqual(self.save(self.snapshot(max_size=2), two), 2)
+
+        restored = self.cache()
+        self.snapshot().load(restored)
+        self.assertIsNone(restored.get('a'))
+        self.assertEqual(restored.get('b').data, ['one'])
+        self.assertEqual(restored.get('c').data, ['two'])
+
+    def test_damaged(self):
+
+        cache = self.cache()
+        cache.set('a', Payload(['a']), timeout=60)
+        cache.set('b', Payload(['b']), timeout=60)
+        self.save(self.snapshot(), cache)
+
+        with open(self.path, 'rb+') as f:
+            f.truncate(os.path.getsize(self.path) - 3)
+
+        restored = self.cache()
+        self.assertEqual(self.snapshot().load(restored), 1)
+        self.assertEqual(restored.get('a').data, ['a'])
+
+        os.remove(self.path)
+        self.assertEqual(self.snapshot().load(restored), 0)
+
+
+class TestDates(unittest.TestCase):
+
+    def test_date_to_epoch(self):
+        self.assertEqual(date_to_epoch('2014-01-24'), 1390539600)
+        self.assertEqual(date_to_epoch('2014-07-24'), 1406174400)
+        self.assertEqual(date_to_epoch('Jan 24 2014'), 1390539600)
+
+    def test_time_to_epoch(self):
+        self.assertEqual(time_to_epoch('2015-02-01T10:00:00Z'), 1422784800)
+        self.assertEqual(time_to_epoch('2015-02-01T10:00:00.5-05:00'),
+                         1422802800)
+        self.assertEqual(time_to_epoch('2015-02-01T10:00:00+0130'),
+                         1422779400)
+
+    def test_readable_date(self):
+        self.assertEqual(readable_date('2015-03-22'), 'March 22nd, 2015')
+        self.assertEqual(readable_date('2015-01-11'), 'January 11th, 2015')
+        self.assertEqual(readable_date('March 1, 2015'), 'March 1st, 2015')
+
+
+class TestResultStream(unittest.TestCase):
+
+    body = ('{"results": [{"id": 1, "name": "caf\u00e9"}, {"id": 2},'
+            ' {"id": 3, "nested": {"a": [1, 2]}}],'
+            ' "count": 3, "page": {"page": 1}}').encode('utf-8')
+
+    def test_chunks(self):
+
+        for size in (1, 2, 7, len(self.body)):
+            stream = ResultStream(lambda r: r['id'])
+            for i in range(0, len(self.body), size):
+                stream.feed(self.body[i:i + size])
+            self.assertEqual(stream.close(), [1, 2, 3])
+
+        stream = ResultStream(lambda r: r.get('name'))
+        for i in range(len(self.body)):
+            stream.feed(self.body[i:i + 1])
+        self.assertEqual(stream.close(), ['caf\u00e9'])
+
+    def test_incomplete(self):
+
+        stream = ResultStream(lambda r: r)
+        stream.feed(self.body[:30])
+        self.assertRaises(ValueError, stream.close)
+
+        stream = ResultStream(lambda r: r)
+        stream.feed(b'{"error": "bad key"}')
+        self.assertRaises(ValueError, stream.close)
+
+    def test_build_error(self):
+        stream = ResultStream(lambda r: r['name'])
+        self.assertRaises(BuildError, stream.feed, self.body)
+
+
+class TestRecord(unittest.TestCase):
+
+    record = Record({
+        'meta': {
+            'id': Source('bill_id'),
+        },
+        'code': Source('bill_type', 'number',
+                       func=lambda b: '{bill_type}{number}'.format(**b)),
+        'url': Source('urls.congress', default=''),
+        'sponsor': Source('sponsor.last_name', func=str.upper),
+    }, extra=['introduced_on'])
+
+    def test_fields(self):
+        self.assertEqual(self.record.param, 'bill_id,bill_type,'
+                         'introduced_on,number,sponsor.last_name,'
+                         'urls.congress')
+
+    def test_build(self):
+        bill = {'bill_id': 'hr1-114', 'bill_type': 'hr', 'number': 1,
+                'sponsor': {'last_name': 'Doe'}}
+        self.assertEqual(self.record(bill), {
+            'meta': {'id': 'hr1-114'},
+            'code': 'hr1',
+            'url': '',
+            'sponsor': 'DOE',
+        })
+
+
+class PagedTrigger(Trigger):
+
+    cursor = 'introduced_on'
+    order = 'introduced_on'
+
+    def __init__(self, total, fail=None):
+        self.total = total
+        self.fail = fail
+        self.requests = []
+        self.finished = []
+
+    @asyncio.coroutine
+    def get_json(self, url, params=None, headers=None, limit=None, each=None):
+        page = params.get('page', 1)
+        self.requests.append((page, limit))
+        if self.fail is not None:
+            yield from asyncio.sleep(0 if page == self.fail else 0.05)
+            if page == self.fail:
+                raise ValueError('page failed')
+            self.finished.append(page)
+        start = (params.get('page', 1) - 1) * limit
+        return [each(i) for i in range(start, min(start + limit, self.total))]
+
+
+class TestTrigger(unittest.TestCase):
+
+    def results(self, trigger, limit):
+        loop = asyncio.get_event_loop()
+        return loop.run_until_complete(
+            trigger.get_results('url', {}, limit, lambda i: i))
+
+    def test_pages(self):
+
+        trigger = PagedTrigger(total=1000)
+        self.assertEqual(self.results(trigger, 120), list(range(120)))
+        self.assertEqual(sorted(trigger.requests), [(1, 50), (2, 50), (3, 50)])
+
+        trigger = PagedTrigger(total=1000)
+        self.assertEqual(self.results(trigger, None), list(range(20)))
+        self.assertEqual(trigger.requests, [(1, 20)])
+
+        trigger = PagedTrigger(total=60)
+        self.assertEqual(self.results(trigger, 200), list(range(60)))
+
+        # limits are cut down to a few pages
+        trigger = PagedTrigger(total=100000)
+        self.assertEqual(len(self.results(trigger, 20000)), 200)
+        self.assertEqual(len(trigger.requests), 4)
+
+    def test_page_failure(self):
+
+        trigger = PagedTrigger(total=1000, fail=1)
+        self.assertRaises(ValueError, self.results, trigger, 150)
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(asyncio.sleep(0.1))
+        self.assertEqual(trigger.finished, [])
+
+    def test_registry(self):
+        self.assertEqual(sorted(triggers.registry), [
+            'congress-birthdays', 'new-bills-query', 'new-laws',
+            'new-legislators', 'upcoming-bills'])
+        for name, handler in triggers.registry.items():
+            self.assertIsInstance(handler, Trigger)
+            self.assertEqual(handler.name, name)
+        self.assertNotIn('Trigger', triggers.registry)
+
+    def test_bound(self):
+
+        trigger = PagedTrigger(total=0)
+        self.assertEqual(trigger.bound({}, None, None),
+                         {'order': 'introduced_on'})
+        self.assertEqual(trigger.bound({}, 1390582799, None), {
+            'introduced_on__lte': '2014-01-24',
+            'order': 'introduced_on__desc'})
+        self.assertEqual(trigger.bound({}, None, 1390539600), {
+            'introduced_on__gte': '2014-01-24',
+            'order': 'introduced_on__asc'})
+
+
+class FakeRealtime(object):
+
+    def __init__(self):
+        self.results = {}
+        self.sent = []
+
+    @asyncio.coroutine
+    def check(self, handler, cache_key, fields, limit):
+        return JSONResponse(self.results[cache_key][:limit])
+
+    @asyncio.coroutine
+    def request(self, method, url, headers=None, data=None):
+        self.sent.append(json.loads(data.decode('utf-8'))['data'])
+        return 200, b'{}'
+
+
+class TestNotifier(unittest.TestCase):
+
+    def records(self, *ids):
+        return [{'meta': {'id': i}} for i in ids]
+
+    def setUp(self):
+        self.fake = FakeRealtime()
+        self.notifier = Notifier(self.fake.check, self.fake, url='stub')
+        self.handler = Trigger()
+
+    def run_once(self):
+        loop = asyncio.get_event_loop()
+        return loop.run_until_complete(self.notifier.run_once())
+
+    def poll(self, cache_key, identity, ids, **data):
+        data['trigger_identity'] = identity
+        self.notifier.watch(self.handler, cache_key, data, self.records(*ids))
+
+    def test_diff(self):
+
+        self.poll('a', 'a1', ['x', 'y'])
+        self.poll('a', 'a2', ['x', 'y'])
+        self.poll('b', 'b1', ['z'])
+        self.poll('c', 'c1', ['w'], after=1422784800)
+        self.assertEqual(len(self.notifier), 2)
+
+        self.fake.results = {'a': self.records('x', 'y'),
+                             'b': self.records('z')}
+        self.assertEqual(self.run_once(), [])
+
+        self.fake.results['a'] = self.records('v', 'x')
+        self.assertEqual(self.run_once(), ['a1', 'a2'])
+        self.assertEqual(self.fake.sent, [[{'trigger_identity': 'a1'},
+                                           {'trigger_identity': 'a2'}]])
+
+        self.assertEqual(self.run_once(), [])
+        self.assertEqual(self.notifier.stats()['notified'], 2)
+
+    def test_window(self):
+
+        ids = [str(i) for i in range(30)]
+        self.fake.results = {'a': self.records(*ids)}
+
+        # a first poll for fewer records than the default isn't news
+        self.poll('a', 'a1', ids[:3], limit=3)
+        self.assertEqual(self.run_once(), [])
+
+        # neither is a poll for more
+        self.poll('a', 'a2', ids[:25], limit=25)
+        self.assertEqual(self.run_once(), [])
+
+        self.fake.results['a'] = self.records('new', *ids)
+        self.assertEqual(self.run_once(), ['a1', 'a2'])
+
+    def test_lock(self):
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'realtime.lock')
+            first = Notifier(self.fake.check, self.fake, url='stub',
+                             lock=path)
+            second = Notifier(self.fake.check, self.fake, url='stub',
+                              lock=path)
+            loop = asyncio.get_event_loop()
+
+            for notifier in (first, second):
+                self.notifier = notifier
+                self.poll('a', 'a1', ['x'])
+            self.fake.results = {'a': self.records('y')}
+
+            self.assertEqual(loop.run_until_complete(first.run_once()),
+                             ['a1'])
+            self.assertEqual(loop.run_until_complete(second.run_once()), [])
+            self.assertEqual(first.stats()['checks'] +
+                             second.stats()['checks'], 1)
+
+            # taking over starts from fresh ids
+            first.close()
+            self.assertEqual(loop.run_until_complete(second.run_once()), [])
+            self.assertEqual(second.stats()['leading'], 1)
+            second.close()
+
+    def test_unavailable(self):
+
+        available = [False]
+        self.notifier = Notifier(self.fake.check, self.fake, url='stub',
+                                 available=lambda: available[0])
+        self.poll('a', 'a1', ['x'])
+        self.fake.results = {'a': self.records('y')}
+
+        # nothing is checked while the circuit is open
+        self.assertEqual(self.run_once(), [])
+        self.assertEqual(self.notifier.stats()['checks'], 0)
+        self.assertEqual(self.notifier.stats()['skipped'], 1)
+
+        available[0] = True
+        self.assertEqual(self.run_once(), ['a1'])
+
+    def test_idle(self):
+
+        now = [0]
+        self.notifier = Notifier(self.fake.check, self.fake, url='stub',
+                                 idle=10, clock=lambda: now[0])
+        self.poll('a', 'a1', ['x'])
+        now[0] = 5
+        self.poll('b', 'b1', ['x'])
+        now[0] = 12
+        self.notifier.prune()
+        self.assertEqual(len(self.notifier), 1)
+
+
+class TestUpstreamGuard(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.now = [0]
+        self.guard = UpstreamGuard(failures=2, cooldown=10, deadline=0.05,
+                                   target=1, minimum=1, maximum=4, queue=1,
+                                   clock=lambda: self.now[0], loop=self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def call(self, status=200, wait=0):
+
+        @asyncio.coroutine
+        def upstream():
+            yield from asyncio.sleep(wait, loop=self.loop)
+            return status, b'{}'
+
+        return self.loop.run_until_complete(self.guard.call(upstream))
+
+    def test_breaker(self):
+
+        self.call(500)
+        self.assertEqual(self.guard.breaker.state, CLOSED)
+        self.assertRaises(asyncio.TimeoutError, self.call, wait=1)
+        self.assertEqual(self.guard.breaker.state, OPEN)
+        self.assertRaises(Unavailable, self.call)
+
+        # one trial call once the cooldown is over; failing it reopens
+        self.now[0] = 10
+        self.assertEqual(self.guard.breaker.state, HALF_OPEN)
+        self.call(503)
+        self.assertEqual(self.guard.breaker.state, OPEN)
+
+        self.now[0] = 20
+        self.assertEqual(self.call(), (200, b'{}'))
+        self.assertEqual(self.guard.breaker.state, CLOSED)
+        self.assertEqual(self.guard.stats()['opens'], 2)
+
+    def test_limit(self):
+
+        limiter = self.guard.limiter
+        self.call(500)
+        self.assertEqual(limiter.limit, 2)
+        self.call()
+        self.assertEqual(limiter.limit, 2.5)
+
+        # another failure right after doesn't halve it again
+        self.now[0] = 0.5
+        self.call(500)
+        self.assertEqual(limiter.limit, 2.5)
+
+        self.now[0] = 2
+        self.call()
+        self.call(500)
+        self.assertEqual(limiter.limit, 1.45)
+        for i in range(10):
+            self.call()
+        self.assertEqual(limiter.limit, 4)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_queue(self):
+
+        self.guard.limiter.limit = 1
+        gate = asyncio.Future(loop=self.loop)
+
+        @asyncio.coroutine
+        def upstream():
+            yield from gate
+            return 200, b''
+
+        calls = [self.loop.create_task(self.guard.call(upstream))
+                 for i in range(3)]
+        self.loop.call_later(0.01, gate.set_result, None)
+        results = self.loop.run_until_complete(
+            asyncio.gather(*calls, loop=self.loop, return_exceptions=True))
+
+        self.assertEqual(results[:2], [(200, b''), (200, b'')])
+        self.assertIsInstance(results[2], Unavailable)
+        self.assertEqual(self.guard.breaker.state, CLOSED)
+        self.assertEqual(self.guard.stats()['rejected'], 1)
+
+    def test_build_error(self):
+
+        @asyncio.coroutine
+        def upstream():
+            raise BuildError('bad record')
+
+        self.now[0] = 2
+        for i in range(3):
+            self.assertRaises(BuildError, self.loop.run_until_complete,
+                              self.guard.call(upstream))
+
+        # neither the breaker nor the limit hear about it
+        self.assertEqual(self.guard.breaker.state, CLOSED)
+        self.assertEqual(self.guard.breaker.failures, 0)
+        self.assertEqual(self.guard.limiter.limit, 4)
+        self.assertEqual(self.guard.limiter.in_flight, 0)
+
+
+class TestPrewarmer(unittest.TestCase):
+
+    def setUp(self):
+        self.now = [0]
+        self.ttls = {}
+        self.refreshed = []
+        self.handler = Trigger()
+        self.prewarmer = Prewarmer(
+            self.refresh, self.ttls.get, [(self.handler, 'static')],
+            lead=10, top=2, decay=60, clock=lambda: self.now[0])
+
+    @asyncio.coroutine
+    def refresh(self, handler, cache_key, fields, limit):
+        self.refreshed.append((cache_key, fields, limit))
+        self.ttls[cache_key] = 60
+
+    def run_once(self):
+        loop = asyncio.get_event_loop()
+        del self.refreshed[:]
+        loop.run_until_complete(self.prewarmer.run_once())
+        return sorted(self.refreshed)
+
+    def poll(self, cache_key, times=1, **data):
+        for i in range(times):
+            self.prewarmer.seen(self.handler, cache_key, data)
+
+    def test_lock(self):
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'prewarm.lock')
+            self.prewarmer._lock_path = path
+            other = Prewarmer(self.refresh, self.ttls.get,
+                              [(self.handler, 'static')], lock=path)
+
+            self.assertEqual(self.run_once(), [('static', {}, 20)])
+            del self.ttls['static']
+            loop = asyncio.get_event_loop()
+            self.assertEqual(loop.run_until_complete(other.run_once()), [])
+            self.assertEqual(other.stats()['leading'], 0)
+
+            # another worker takes over once the holder goes away
+            self.prewarmer.close()
+            self.assertEqual(loop.run_until_complete(other.run_once()),
+                             ['static'])
+            other.close()
+
+    def test_static(self):
+
+        self.assertEqual(self.run_once(), [('static', {}, 20)])
+        self.assertEqual(self.run_once(), [])
+
+        self.poll('static', limit=50)
+        self.ttls['static'] = 5
+        self.assertEqual(self.run_once(), [('static', {}, 50)])
+
+    def test_hot(self):
+
+        self.ttls['static'] = 60
+        self.poll('a', 3, triggerFields={'query': 'a'})
+        self.poll('b', 2)
+        self.poll('c', 1)
+        self.poll('d', 5, after=1422784800)
+        self.assertEqual(self.run_once(),
+                         [('a', {'query': 'a'}, 20), ('b', {}, 20)])
+
+        # hits halve every decay interval; keys left with none are dropped
+        self.now[0] = 60
+        self.ttls['a'] = self.ttls['b'] = 0
+        self.poll('c', 3)
+        self.assertEqual(self.run_once(), [('a', {'query': 'a'}, 20),
+                                           ('c', {}, 20)])
+        self.assertEqual(self.prewarmer.stats()['tracked'], 3)
+
+
+class TestTTLPolicy(unittest.TestCase):
+
+    def records(self, *ids):
+        return [{'meta': {'id': i}} for i in ids]
+
+    def test_stretch(self):
+
+        policy = TTLPolicy(60, 300)
+        self.assertEqual(policy('a', self.records('x', 'y')), 60)
+        self.assertEqual(policy('a', self.records('x', 'y')), 120)
+        self.assertEqual(policy('a', self.records('x', 'y')), 240)
+        self.assertEqual(policy('a', self.records('x', 'y')), 300)
+
+        # a smaller window, or one going back to its full size, is no
+        # change; a new id is
+        self.assertEqual(policy('a', self.records('x')), 300)
+        self.assertEqual(policy('a', self.records('x', 'y')), 300)
+        self.assertEqual(policy('a', self.records('z', 'x')), 60)
+        self.assertEqual(policy('b', []), 60)
+
+        self.assertEqual(policy.stats()['changes'], 1)
+        self.assertEqual(len(policy), 2)
+
+
+class TestCacheKeys(unittest.TestCase):
+
+    def key(self, trigger, **data):
+        path = '/ifttt/v1/triggers/{}'.format(trigger.name)
+        return trigger.cache_key(FakeRequest(path, data))
+
+    def test_query(self):
+
+        self.assertEqual(canonical_query(' Common  Core '), 'common core')
+        self.assertEqual(canonical_query('"Common  Core" ~ 3 OR tax*'),
+                         '"common core"~3 OR tax*')
+        self.assertEqual(canonical_query('"a *" b'), '"a *" b')
+
+        trigger = NewBillsQuery()
+        keys = {self.key(trigger, triggerFields={'query': query})
+                for query in ('Common Core', 'common core', ' Common  Core ')}
+        self.assertEqual(len(keys), 1)
+        self.assertNotEqual(
+            keys.pop(), self.key(trigger, triggerFields={'query': 'core'}))
+
+        long = self.key(trigger, triggerFields={'query': 'x' * 1000})
+        self.assertLess(len(long), 100)
+        self.assertNotEqual(
+            long, self.key(trigger, triggerFields={'query': 'x' * 1000},
+                           before=1390582799))
+        self.assertEqual(self.key(trigger), '/ifttt/v1/triggers/new-bills-query')
+
+    def test_point(self):
+        self.assertEqual(point({'lat': '38.9', 'lon': 0}), (38.9, 0.0))
+        self.assertEqual(point({'lat': '38.9', 'lng': '-77.03'}),
+                         (38.9, -77.03))
+        self.assertEqual(snap(38.89768, -77.036533), (38.898, -77.037))
+
+    def test_stats(self):
+        stats = KeyStats()
+        for query in ('a', 'A', 'a'):
+            stats.add('/p', {'triggerFields': {'query': query}}, 'k')
+        stats.add('/p', {}, '/p')
+        self.assertEqual(stats.stats(), {
+            'requests': 4, 'variants': 3, 'keys': 2, 'deduplicated': 1})
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_render(self):
+
+        registry = Registry()
+        hits = registry.counter('hits_total', 'Hits.', ['trigger'])
+        latency = registry.histogram('latency_seconds', 'Latency.',
+                                     ['trigger'], buckets=(0.1, 1))
+        registry.collector('cache', 'Cache', lambda: {'size': 3})
+
+        hits.inc('new-laws')
+        hits.inc('new-laws', amount=2)
+        latency.observe('new-laws', value=0.05)
+        latency.observe('new-laws', value=0.1)
+        latency.observe('new-laws', value=5)
+
+        lines = registry.render().splitlines()
+        self.assertIn('# TYPE hits_total counter', lines)
+        self.assertIn('hits_total{trigger="new-laws"} 3', lines)
+        self.assertIn('latency_seconds_bucket{trigger="new-laws",le="0.1"} 2',
+                      lines)
+        self.assertIn('latency_seconds_bucket{trigger="new-laws",le="1"} 2',
+                      lines)
+        self.assertIn(
+            'latency_seconds_bucket{trigger="new-laws",le="+Inf"} 3', lines)
+        self.assertIn('latency_seconds_sum{trigger="new-laws"} 5.15', lines)
+        self.assertIn('latency_seconds_count{trigger="new-laws"} 3', lines)
+        self.assertIn('cache_size 3', lines)
+
+
+class FakeRequest(object):
+
+    def __init__(self, path, data=None):
+        self.path = path
+        self.data = data
+        self.match_info = {}
+
+
+class FakeResponse(object):
+    status = 200
+
+
+class TestProfiler(unittest.TestCase):
+
+    @asyncio.coroutine
+    def handler(self, request):
+
+        @asyncio.coroutine
+        def upstream():
+            with profiling.phase('upstream'):
+                yield from asyncio.sleep(float(request.path[1:]))
+
+        with profiling.phase('cache'):
+            pass
+        loop = asyncio.get_event_loop()
+        yield from loop.create_task(profiling.carry(upstream)())
+        return FakeResponse()
+
+    def run_request(self, profiler, path):
+        loop = asyncio.get_event_loop()
+        middleware = loop.run_until_complete(
+            profiler.middleware(None, self.handler))
+        return loop.run_until_complete(middleware(FakeRequest(path)))
+
+    def test_slow(self):
+
+        profiler = profiling.Profiler(rate=0, slow=0.05)
+        self.run_request(profiler, '/0')
+        self.run_request(profiler, '/0.1')
+
+        results = profiler.recent()
+        self.assertEqual([r['path'] for r in results], ['/0.1'])
+        self.assertEqual(results[0]['reason'], 'slow')
+        self.assertGreaterEqual(results[0]['phases']['upstream'], 0.1)
+        self.assertIn('cache', results[0]['phases'])
+        self.assertIsNone(profiling.current())
+
+    def test_sampled(self):
+
+        profiler = profiling.Profiler(rate=1, cprofile=True, size=2)
+        for i in range(3):
+            self.run_request(profiler, '/0')
+
+        results = profiler.recent()
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0]['reason'], 'sampled')
+        self.assertIn('function calls', results[0]['cprofile'])
+
+
+
+class FakeBills(NewBillsQuery):
+
+    name = 'fake-bills'
+
+    def __init__(self):
+        self.checks = []
+
+    @asyncio.coroutine
+    def check(self, fields, before, after, limit):
+        self.checks.append((fields['query'], limit))
+        return JSONResponse([
+            {'meta': {'id': '{}/{}'.format(fields['query'], i)},
+             'title': 'x' * 100}
+            for i in range(self.window(limit))])
+
+
+class WebRequest(object):
+
+    def __init__(self, trigger, body, headers=None):
+        self.app = web.app
+        self.path = '/ifttt/v1/batch/triggers/{}'.format(trigger)
+        self.match_info = {'trigger': trigger}
+        self.headers = headers or {}
+        self.body = json.dumps(body).encode('utf-8')
+
+    @asyncio.coroutine
+    def read(self):
+        return self.body
+
+
+class TestWeb(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.get_event_loop()
+        self.cache = web.cache
+        web.cache = CappedCache(max_size=100)
+        self.handler = triggers.registry['fake-bills'] = FakeBills()
+
+    def tearDown(self):
+        web.cache = self.cache
+        del triggers.registry['fake-bills']
+
+    def evaluate(self, query, **data):
+        data['triggerFields'] = {'query': query}
+        cache_key = self.handler.cache_key(
+            web.TriggerRequest('/fake-bills', data))
+        return self.loop.run_until_complete(
+            web.evaluate(web.app, self.handler, cache_key, data))
+
+    def test_batch(self):
+
+        request = WebRequest('fake-bills', {'requests': [
+            {'trigger_identity': 'a', 'triggerFields': {'query': 'Tax'},
+             'limit': 2},
+            {'trigger_identity': 'b', 'triggerFields': {'query': 'tax'},
+             'limit': 5},
+            {'trigger_identity': 'c', 'triggerFields': {'query': 'farm'},
+             'limit': 1},
+            {'trigger_identity': 'd', 'triggerFields': {'query': 5}},
+            {'trigger_identity': 'e', 'triggerFields': {'query': 'tax '},
+             'limit': 0},
+            {'trigger_identity': 'f'},
+        ]})
+        resp = self.loop.run_until_complete(web.batch(request))
+        results, errors = resp.data['results'], resp.data['errors']
+
+        # one check per key, for the biggest window among its requests
+        self.assertEqual(sorted(self.handler.checks),
+                         [('Tax', 20), ('farm', 20)])
+        self.assertEqual([len(results[i]) for i in 'abce'], [2, 5, 1, 0])
+        self.assertEqual(sorted(errors), ['d', 'f'])
+        self.assertEqual({r['query'] for r in results['a']}, {'Tax'})
+        self.assertEqual({r['query'] for r in results['b']}, {'tax'})
+        self.assertEqual(errors['f'],
+                         [{'message': 'triggerFields is required'}])
+
+    def test_evaluate(self):
+
+        self.assertEqual(self.evaluate('tax', limit=0).data, [])
+        self.assertEqual(self.evaluate('tax', limit='0').data, [])
+        self.assertEqual(self.handler.checks, [])
+
+        self.assertEqual(len(self.evaluate('tax', limit=3).data), 3)
+        self.assertEqual(len(self.evaluate('Tax', limit=7).data), 7)
+        self.assertEqual(len(self.handler.checks), 1)
+
+        # a bigger window than what's cached goes upstream again
+        self.assertEqual(len(self.evaluate('tax', limit=40).data), 40)
+        self.assertEqual(self.handler.checks[-1], ('tax', 40))
+
+        # limits may come as strings; nonsense ones ask for the default
+        self.assertEqual(len(self.evaluate('tax', limit='5').data), 5)
+        self.assertEqual(len(self.evaluate('tax', limit='x').data), 20)
+        self.assertEqual(len(self.evaluate('tax', limit=-1).data), 20)
+        self.assertEqual(len(self.handler.checks), 2)
+
+    def test_refresh(self):
+
+        now = [0]
+        web.cache = CappedCache(max_size=100, clock=lambda: now[0])
+        self.evaluate('tax', limit=3)
+        cache_key = self.handler.cache_key(web.TriggerRequest(
+            '/fake-bills', {'triggerFields': {'query': 'tax'}}))
+
+        # still fresh, so the realtime check leaves it be
+        resp = self.loop.run_until_complete(
+            web.refresh(self.handler, cache_key, {'query': 'tax'}, 20))
+        self.assertIsNone(resp)
+        self.assertEqual(len(self.handler.checks), 1)
+
+        now[0] = web.cache.ttl(cache_key) + 1
+        resp = self.loop.run_until_complete(
+            web.refresh(self.handler, cache_key, {'query': 'tax'}, 20))
+        self.assertEqual(len(resp.data), 20)
+        self.assertEqual(len(self.handler.checks), 2)
+
+    def test_metrics_auth(self):
+
+        def get(headers):
+            request = WebRequest('fake-bills', {}, headers)
+            request.path = '/metrics'
+            middleware = self.loop.run_until_complete(
+                web.auth_middleware(web.app, web.metrics_page))
+            try:
+                return self.loop.run_until_complete(middleware(request))
+            except web.web.HTTPUnauthorized as exc:
+                return exc
+
+        secrets = web.CLIENT_SECRET, web.METRICS_KEY
+        try:
+            # without a metrics key it takes the channel key
+            web.CLIENT_SECRET, web.METRICS_KEY = 'channel', ''
+            self.assertEqual(get({}).status, 401)
+            self.assertEqual(get({'IFTTT-Channel-Key': 'channel'}).status,
+                             200)
+
+            web.METRICS_KEY = 'scrape'
+            self.assertEqual(get({'IFTTT-Channel-Key': 'channel'}).status,
+                             401)
+            self.assertEqual(get({'Authorization': 'Bearer scrape'}).status,
+                             200)
+        finally:
+            web.CLIENT_SECRET, web.METRICS_KEY = secrets
+
+    def test_profiles(self):
+
+        for limit in ('2', 'x', '-1', None):
+            request = WebRequest('fake-bills', {})
+            request.GET = {'limit': limit} if limit else {}
+            resp = self.loop.run_until_complete(web.profiles(request))
+            self.assertEqual(resp.status, 200)
+
+    def test_spelling(self):
+
+        # one cached result, each requester's own query in its records
+        first = self.evaluate('Clean Air', limit=3)
+        second = self.evaluate('clean AIR', limit=3)
+        self.assertEqual(len(self.handler.checks), 1)
+        self.assertEqual({r['query'] for r in first.data}, {'Clean Air'})
+        self.assertEqual({r['query'] for r in second.data}, {'clean AIR'})
+        self.assertNotEqual(first.headers['ETag'], second.headers['ETag'])
+
+        [(key, payload, fresh, stale)] = web.cache.entries()
+        self.assertNotIn('query', payload.data[0])
+
+    def test_negotiate(self):
+
+        resp = self.evaluate('tax')
+        plain = web.negotiate(WebRequest('fake-bills', {}), resp)
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertEqual(plain.headers['Vary'], 'Accept-Encoding')
+
+        gzipped = web.negotiate(WebRequest(
+            'fake-bills', {}, {'Accept-Encoding': 'gzip'}), resp)
+        self.assertEqual(gzipped.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(zlib.decompress(gzipped.body, 16 + zlib.MAX_WBITS),
+                         plain.body)
 
+        for etag in (plain.headers['ETag'], gzipped.headers['ETag']):
+            matched = web.negotiate(WebRequest(
+                'fake-bills', {}, {'If-None-Match': etag}), resp)
+            self.assertEqual(matched.status, 304)
 
 
 if __name__ == '__main__':
@@ -1,40 +1,136 @@
 import asyncio
+import bisect
+import calendar
 import datetime
+import functools
 import json
+import math
 import os
-import aiohttp
+import time
 from aiohttp import web
-from dateutil.parser import parse
 from operator import itemgetter
 
+import keys
+import metrics
+import profiling
 import util
+from districts import DistrictIndex
 from fields import PointField, QueryField
+from records import Record, Source
+from ttl import TTLPolicy
+from upstream import ResultStream
 
 SUNLIGHT_KEY = os.environ.get('SUNLIGHT_KEY')
-SUNLIGHT_URL = 'https://congress.api.sunlightfoundation.com'
+SUNLIGHT_URL = os.environ.get(
+    'SUNLIGHT_URL', 'https://congress.api.sunlightfoundation.com')
+
+# Most pages one request may fetch; bigger limits are cut down to fit.
+MAX_PAGES = int(os.environ.get('UPSTREAM_MAX_PAGES', '4'))
 
 
 class Trigger(object):
 
     fields = None
 
+    # Name in URLs and metrics.
+    name = None
+
+    # Shared UpstreamClient and the UpstreamGuard its Congress API calls
+    # go through, bound by the application at startup.
+    client = None
+    guard = None
+
+    # Number of records returned when a request doesn't ask for a limit.
+    default_limit = 20
+
+    # The most results the API returns per page.
+    page_size = 50
+
+    # Upstream date field that before and after bound, and the order
+    # results come in when neither is given.
+    cursor = None
+    order = None
+
+    # Bounds in seconds on how long a result is cached; see TTLPolicy.
+    min_ttl = 60
+    max_ttl = 600
+
+    _ttls = None
+
     @property
     def fields(self):
         return {}
 
     def cache_key(self, request):
-        key = request.path
-        limit = request.data.get('limit')
-        if limit is not None:
-            key = '{}:limit={}'.format(key, limit)
+
+        # The limit isn't part of the key: one cached result answers any
+        # request for as many records as it holds; see window(). before
+        # and after are, since they change which records come back, and
+        # so are the trigger fields, spelled canonically (key_parts) so
+        # requests that get the same records share a key. Keys with any
+        # of these end in a digest of them; see keys.digest.
+
+        parts = self.key_parts(request.data.get('triggerFields') or {})
+        for bound in ('before', 'after'):
+            value = request.data.get(bound)
+            if value:
+                parts.append([bound, str(value)])
+
+        key = keys.digest(request.path, parts) if parts else request.path
+        keys.stats.add(request.path, request.data, key)
         return key
 
+    def key_parts(self, fields):
+
+        # [name, value] pairs of what the result depends on in fields.
+
+        return []
+
+    def extra(self, fields):
+
+        # Fields added to every record of a response, that depend on the
+        # request's trigger fields but not on the cached result.
+
+        return None
+
+    def window(self, limit):
+        limit = util.parse_limit(limit)
+        return min(limit or self.default_limit, self.page_size * MAX_PAGES)
+
+    def ttl(self, cache_key, data):
+
+        # Seconds to cache data, a new result for cache_key, for.
+
+        if self._ttls is None:
+            self._ttls = TTLPolicy(self.min_ttl, self.max_ttl)
+        return self._ttls(cache_key, data)
+
+    def ttl_stats(self):
+        return self._ttls.stats() if self._ttls is not None else {}
+
+    def bound(self, params, before, after):
+
+        # Adds before and after to params as filters on cursor, newest
+        # first up to before or oldest first from after.
+
+        params['order'] = self.order
+        if before:
+            params['{}__lte'.format(self.cursor)] = util.epoch_to_date(before)
+            params['order'] = '{}__desc'.format(self.cursor)
+        if after:
+            params['{}__gte'.format(self.cursor)] = util.epoch_to_date(after)
+            params['order'] = '{}__asc'.format(self.cursor)
+        return params
+
     @asyncio.coroutine
     def check(self, fields, before, after, limit):
         raise NotImplemented()
 
     @asyncio.coroutine
-    def get_json(self, url, params=None, headers=None, limit=None):
+    def get_json(self, url, params=None, headers=None, limit=None, each=None):
+
+        # With each, results are streamed: the list of what each returns
+        # for every result is returned instead of the decoded body.
 
         if not params:
             params = {}
@@ -46,315 +142,577 @@ class Trigger(object):
             headers = {}
         headers.update({'X-APIKEY': SUNLIGHT_KEY})
 
-        resp = yield from aiohttp.request(
-            'get', url, params=params, headers=headers)
-        data = yield from resp.json()
-        return data
+        # Records are built while the body is read; when profiling, time
+        # spent building is told apart from time spent waiting on I/O.
+        profile = profiling.current()
+        if profile is not None and each is not None:
+            each = profiling.Timed(each)
+
+        stream = ResultStream(each) if each is not None else None
+        status = 0
+
+        get = self.client.get
+        if self.guard is not None:
+            get = functools.partial(self.guard.call, get)
+
+        metrics.upstream_in_flight.inc()
+        t0 = time.monotonic()
+
+        try:
+            status, body = yield from get(
+                url, params=params, headers=headers,
+                feed=stream and stream.feed)
+        finally:
+            elapsed = time.monotonic() - t0
+            metrics.upstream_in_flight.dec()
+            metrics.upstream_latency.observe(self.name, value=elapsed)
+            metrics.upstream_responses.inc(self.name, str(status))
+            if profile is not None:
+                built = each.total if stream is not None else 0
+                profile.add('upstream', elapsed - built)
+                profile.add('build', built)
+
+        if stream is not None:
+            return stream.close()
+
+        return json.loads(body.decode('utf-8'))
 
+    @asyncio.coroutine
+    def get_results(self, url, params, limit, each):
 
-class CongressBirthdays(Trigger):
+        # Up to limit results streamed through each. Limits bigger than a
+        # page are fetched as consecutive pages, all at once; if one of
+        # them fails the rest are called off.
 
-    @asyncio.coroutine
-    def check(self, fields, before, after, limit):
+        limit = self.window(limit)
 
-        today = datetime.datetime.utcnow() - datetime.timedelta(hours=13)
-        # today = today.replace(hour=0, minute=0, second=0)
-        today = today.date()
+        if limit <= self.page_size:
+            return (yield from self.get_json(
+                url, params=params, limit=limit, each=each))
 
-        url = '{}/{}'.format(SUNLIGHT_URL, 'legislators')
-        params = {
-            'fields': ','.join(
-                ["title", "first_name", "last_name", "state", "party",
-                 "district", "birthday", "bioguide_id", "twitter_id"]),
-            'per_page': 'all',
-        }
+        loop = asyncio.get_event_loop()
+        pages = []
+        for page in range(1, math.ceil(limit / self.page_size) + 1):
+            pages.append(loop.create_task(self.get_json(
+                url, params=dict(params, page=page), limit=self.page_size,
+                each=each)))
 
-        data = yield from self.get_json(url, params=params)
+        try:
+            pages = yield from asyncio.gather(*pages)
+        except Exception:
+            for page in pages:
+                page.cancel()
+            raise
 
-        legislators = []
+        results = []
+        for page in pages:
+            results.extend(page)
+            if len(page) < self.page_size:
+                break
 
-        for legislator in data['results']:
+        return results[:limit]
 
-            bday = parse(legislator['birthday'])
-            bday = bday.replace(year=today.year, hour=0, minute=0, second=0)
 
-            legislator['current_birthday'] = bday
+def legislator_name(legislator):
+    return '{title}. {first_name} {last_name}'.format(**legislator)
 
-            bday = bday.date()
 
-            is_good = bday <= today
+def legislator_state(legislator):
+    if legislator.get('district'):
+        return '{state}-{district}'.format(**legislator)
+    return legislator['state']
 
-            if is_good and before:
-                is_good = is_good and bday <= util.epoch_to_date(before)
 
-            if is_good and after:
-                is_good = is_good and bday > util.epoch_to_date(after)
+def legislator_district(legislator):
+    return '{}{}'.format(legislator['state'], legislator.get('district') or '')
 
-            if is_good:
-                legislators.append(legislator)
 
-        legislators = sorted(legislators, key=itemgetter('last_name'))
-        legislators = sorted(legislators,
-                             key=itemgetter('current_birthday'),
-                             reverse=True)
+def term_start(legislator):
 
-        ifttt = []
+    # Start of the first term served in the legislator's current seat.
 
-        for legislator in legislators:
+    district = legislator_district(legislator)
+    for t in legislator['terms']:
+        if '{}{}'.format(t['state'], t.get('district') or '') == district:
+            return t['start']
 
-            birth_year = parse(legislator['birthday']).year
 
-            record = {
-                'meta': {
-                    'id': '{}/{}'.format(today.year, legislator['bioguide_id']),
-                    'timestamp': int(legislator['current_birthday'].timestamp()),
-                },
-                'name': '{title}. {first_name} {last_name}'.format(**legislator),
-                'state': '{state}-{district}'.format(**legislator) \
-                    if legislator.get('district') else legislator['state'],
-                'party': legislator['party'],
-                'twitter_username': legislator.get('twitter_id') or '',
-                'birthday_date': util.readable_date(legislator['birthday']),
-                'numerical_birthday_date': legislator['birthday'],
-                'birth_year': birth_year,
-                'age': today.year - birth_year,
-                'date': legislator['current_birthday'].date().isoformat(),
-            }
-            ifttt.append(record)
+def term_timestamp(legislator):
+    return util.time_to_epoch(term_start(legislator))
 
-        return util.JSONResponse(ifttt[:limit or 20])
 
+def legislator_id(legislator):
+    return '{}/{}'.format(
+        legislator['bioguide_id'], legislator_district(legislator))
 
-class NewBillsQuery(Trigger):
 
-    fields = {
-        'query': QueryField()
-    }
+class BirthdayIndex(object):
 
-    def cache_key(self, request):
-        key = super(NewBillsQuery, self).cache_key(request)
-        fields = request.data.get('triggerFields')
-        if fields:
-            query = fields.get('query')
-            key = '{}:query={}'.format(key, query)
-        return key
+    # Everyone whose birthday this year falls on or before day, newest
+    # birthday first and by last name within a day. Records are built once,
+    # so a request is just two bisects over the negated day ordinals.
+
+    record = Record({
+        'name': Source('title', 'first_name', 'last_name',
+                       func=legislator_name),
+        'state': Source('state', 'district', func=legislator_state),
+        'party': Source('party'),
+        'twitter_username': Source('twitter_id', default=''),
+        'birthday_date': Source('birthday', func=util.readable_date),
+        'numerical_birthday_date': Source('birthday'),
+    }, extra=['bioguide_id'])
+
+    def __init__(self, day, legislators=(), entries=()):
+
+        # entries are what entry() returns, for building an index while
+        # the legislators are streamed in.
+
+        self.day = day
+
+        entries = [e for e in entries if e] + \
+            [e for e in (self.entry(day, l) for l in legislators) if e]
+        entries.sort(key=itemgetter(0, 1))
+
+        self._keys = [entry[0] for entry in entries]
+        self._records = [entry[2] for entry in entries]
+
+    @classmethod
+    def entry(cls, day, legislator):
+
+        year, month, dom = map(int, legislator['birthday'].split('-'))
+
+        if month == 2 and dom == 29 and not calendar.isleap(day.year):
+            dom = 28
+
+        bday = datetime.date(day.year, month, dom)
+
+        if bday > day:
+            return None
+
+        current_birthday = datetime.datetime(day.year, month, dom)
+
+        record = cls.record(legislator)
+        record.update({
+            'meta': {
+                'id': '{}/{}'.format(day.year, legislator['bioguide_id']),
+                'timestamp': int(current_birthday.timestamp()),
+            },
+            'birth_year': year,
+            'age': day.year - year,
+            'date': bday.isoformat(),
+        })
+
+        return (-bday.toordinal(), legislator['last_name'], record)
+
+    def __len__(self):
+        return len(self._records)
+
+    def query(self, before=None, after=None, limit=None):
+
+        # before and after are epoch times; keep birthdays on or before the
+        # day of before and strictly after the day of after.
+
+        lo, hi = 0, len(self._keys)
+
+        if before:
+            day = datetime.date.fromtimestamp(before).toordinal()
+            lo = bisect.bisect_left(self._keys, -day)
+
+        if after:
+            day = datetime.date.fromtimestamp(after).toordinal()
+            hi = bisect.bisect_left(self._keys, -day)
+
+        if limit:
+            hi = min(hi, lo + limit)
+
+        return self._records[lo:hi]
+
+
+class CongressBirthdays(Trigger):
+
+    # Birthdays only change when the day does, so the legislator list is
+    # fetched and indexed once per day. The index is rebuilt in the
+    # background right after each day boundary.
+
+    name = 'congress-birthdays'
+
+    def __init__(self):
+        self._index = None
+        self._builds = util.SingleFlight()
+        self._timer = None
+
+    def today(self):
+        today = datetime.datetime.utcnow() - datetime.timedelta(hours=13)
+        return today.date()
+
+    def until_tomorrow(self, day):
+
+        # Seconds until the day after day starts; days start at 00:00
+        # UTC-13, i.e. 13:00 UTC.
+
+        tomorrow = day + datetime.timedelta(days=1)
+        boundary = datetime.datetime.combine(tomorrow, datetime.time(13))
+        return (boundary - datetime.datetime.utcnow()).total_seconds()
+
+    def ttl(self, cache_key, data):
+
+        # Results stay the same until the next day's index is built,
+        # which happens a second after the day boundary.
+
+        return max(self.until_tomorrow(self.today()), 0) + 2
 
     @asyncio.coroutine
-    def check(self, fields, before, after, limit):
+    def index(self):
+        day = self.today()
+        if self._index is None or self._index.day != day:
+            yield from self._builds.do(day, self.build, day)
+        return self._index
 
-        url = '{}/{}'.format(SUNLIGHT_URL, 'bills/search')
+    @asyncio.coroutine
+    def build(self, day):
+
+        url = '{}/{}'.format(SUNLIGHT_URL, 'legislators')
         params = {
-            'fields': ','.join(
-                ["bill_id", "bill_type", "number", "introduced_on",
-                 "short_title", "official_title", "sponsor",
-                 "urls.congress", "urls.opencongress"]),
-            'query': fields.get('query'),
-            'order': 'congress,introduced_on,number',
+            'fields': BirthdayIndex.record.param,
+            'per_page': 'all',
         }
 
-        data = yield from self.get_json(url, params=params, limit=limit)
+        entries = yield from self.get_json(
+            url, params=params,
+            each=functools.partial(BirthdayIndex.entry, day))
 
-        if before:
-            params['introduced_on__lte'] = util.epoch_to_date(before)
-            params['order'] = 'introduced_on__desc'
+        self._index = BirthdayIndex(day, entries=entries)
+        self.schedule(day)
 
-        if after:
-            params['introduced_on__gte'] = util.epoch_to_date(after)
-            params['order'] = 'introduced_on__asc'
-
-        ifttt = []
-
-        for bill in data['results']:
-
-            timestamp = util.date_to_epoch(bill['introduced_on'])
-
-            record = {
-                'meta': {
-                    'id': bill['bill_id'],
-                    'timestamp': timestamp,
-                },
-                'query': fields.get('query'),
-                'sponsor_name': util.name(bill['sponsor']),
-                'code': util.bill_code(bill),
-                'title': util.bill_title(bill),
-                'introduced_on': util.readable_date(bill['introduced_on']),
-                'official_url': bill['urls']['congress'],
-                'open_congress_url': bill['urls']['opencongress'],
-                'date': bill['introduced_on'],
-            }
-            ifttt.append(record)
+    def schedule(self, day):
 
+        tomorrow = day + datetime.timedelta(days=1)
+        delay = self.until_tomorrow(day)
+
+        if self._timer is not None:
+            self._timer.cancel()
+
+        loop = asyncio.get_event_loop()
+        self._timer = loop.call_later(max(delay, 0) + 1, self._builds.spawn,
+                                      tomorrow, self.build, tomorrow)
+
+    @asyncio.coroutine
+    def check(self, fields, before, after, limit):
+        index = yield from self.index()
+        ifttt = index.query(before, after, self.window(limit))
         return util.JSONResponse(ifttt)
 
 
-class NewLawsTrigger(Trigger):
+class NewBillsQuery(Trigger):
+
+    name = 'new-bills-query'
+
+    fields = {
+        'query': QueryField()
+    }
+
+    record = Record({
+        'meta': {
+            'id': Source('bill_id'),
+            'timestamp': Source('introduced_on', func=util.date_to_epoch),
+        },
+        'sponsor_name': Source('sponsor', func=util.name),
+        'code': Source('bill_type', 'number', func=util.bill_code),
+        'title': Source('short_title', 'official_title',
+                        func=util.bill_title),
+        'introduced_on': Source('introduced_on', func=util.readable_date),
+        'official_url': Source('urls.congress'),
+        'open_congress_url': Source('urls.opencongress'),
+        'date': Source('introduced_on'),
+    })
+
+    cursor = 'introduced_on'
+    order = 'congress,introduced_on,number'
+
+    # Searches for rare terms can go days without a new bill.
+    max_ttl = 60 * 60
+
+    # Local BillMirror, searched instead of the API when it's in sync.
+    mirror = None
+
+    def key_parts(self, fields):
+        if 'query' not in fields:
+            return []
+        return [['query', keys.canonical_query(fields['query'])]]
+
+    def extra(self, fields):
+
+        # Every spelling of a query shares the result of searching for
+        # the canonical one; records show each requester their own.
+
+        return {'query': fields.get('query')}
 
     @asyncio.coroutine
     def check(self, fields, before, after, limit):
 
-        url = '{}/{}'.format(SUNLIGHT_URL, 'bills')
-        params = {
-            'fields': ','.join(
-                ["bill_id", "bill_type", "number", "history.enacted_at",
-                 "short_title", "official_title", "sponsor",
-                 "urls.congress", "urls.opencongress"]),
-            'history.enacted': 'true',
-            'order': 'history.enacted_at',
-        }
+        query = keys.canonical_query(fields.get('query'))
+        build = self.record
 
-        if before:
-            params['history.enacted_at__lte'] = util.epoch_to_date(before)
-            params['order'] = 'history.enacted_at__desc'
+        url = '{}/{}'.format(SUNLIGHT_URL, 'bills/search')
+        params = self.bound({
+            'fields': self.record.param,
+            'query': query,
+        }, before, after)
+
+        if self.mirror is not None and self.mirror.ready:
+            try:
+                bills = self.mirror.search(
+                    query, self.window(limit),
+                    before=before and util.epoch_to_date(before),
+                    after=after and util.epoch_to_date(after),
+                    order=params['order'])
+                with profiling.phase('build'):
+                    ifttt = [build(bill) for bill in bills]
+                return util.JSONResponse(ifttt)
+            except ValueError:
+                pass  # not something FTS can run, ask the API
+
+        ifttt = yield from self.get_results(url, params, limit, build)
 
-        if after:
-            params['history.enacted_at__gte'] = util.epoch_to_date(after)
-            params['order'] = 'history.enacted_at__asc'
+        return util.JSONResponse(ifttt)
 
-        data = yield from self.get_json(url, params=params, limit=limit)
 
-        ifttt = []
+class NewLawsTrigger(Trigger):
+
+    name = 'new-laws'
+
+    record = Record({
+        'meta': {
+            'id': Source('bill_id'),
+            'timestamp': Source('history.enacted_at',
+                                func=util.date_to_epoch),
+        },
+        'SponsorName': Source('sponsor', func=util.name),
+        'Code': Source('bill_type', 'number', func=util.bill_code),
+        'Title': Source('short_title', 'official_title',
+                        func=util.bill_title),
+        'BecameLawOn': Source('history.enacted_at',
+                              func=util.readable_date),
+        'OfficialURL': Source('urls.congress'),
+        'OpenCongressURL': Source('urls.congress'),
+        'date': Source('history.enacted_at'),
+    })
+
+    cursor = 'history.enacted_at'
+    order = 'history.enacted_at'
+
+    # Nothing is enacted on weekends or during a recess.
+    max_ttl = 60 * 60
 
-        for bill in data['results']:
+    @asyncio.coroutine
+    def check(self, fields, before, after, limit):
 
-            timestamp = util.date_to_epoch(bill['history']['enacted_at'])
+        url = '{}/{}'.format(SUNLIGHT_URL, 'bills')
+        params = self.bound({
+            'fields': self.record.param,
+            'history.enacted': 'true',
+        }, before, after)
 
-            record = {
-                'meta': {
-                    'id': bill['bill_id'],
-                    'timestamp': timestamp,
-                },
-                'SponsorName': util.name(bill['sponsor']),
-                'Code': util.bill_code(bill),
-                'Title': util.bill_title(bill),
-                'BecameLawOn': util.readable_date(bill['history']['enacted_at']),
-                'OfficialURL': bill['urls']['congress'],
-                'OpenCongressURL': bill['urls']['congress'],
-                'date': bill['history']['enacted_at'],
-            }
-            ifttt.append(record)
+        ifttt = yield from self.get_results(url, params, limit, self.record)
 
         return util.JSONResponse(ifttt)
 
 
 class NewLegislatorsTrigger(Trigger):
 
+    # Points inside a known district boundary are answered from a cached
+    # roster of the state's current legislators: its senators plus the
+    # district's representative. Anything else goes to legislators/locate.
+
+    name = 'new-legislators'
+
     fields = {
         'location': PointField()
     }
 
-    def cache_key(self, request):
-        key = super(NewLegislatorsTrigger, self).cache_key(request)
-        fields = request.data.get('triggerFields')
-        if fields:
-            loc = fields.get('location')
-            if loc:
-                key = '{}:ll={},{}'.format(
-                    key, loc['lat'], loc.get('lon') or loc.get('lng'))
-        return key
+    default_limit = 10
+
+    # Membership changes a few times a year.
+    max_ttl = 6 * 60 * 60
+
+    record = Record({
+        'meta': {
+            'id': Source('bioguide_id', 'state', 'district',
+                         func=legislator_id),
+            'timestamp': Source('state', 'district', 'terms.start',
+                                'terms.state', 'terms.district',
+                                func=term_timestamp),
+        },
+        'name': Source('title', 'first_name', 'last_name',
+                       func=legislator_name),
+        'state': Source('state', 'district', func=legislator_state),
+        'party': Source('party'),
+        'phone': Source('phone', default=''),
+        'website': Source('website', default=''),
+        'twitter_username': Source('twitter_id', default=''),
+        'date': Source('state', 'district', 'terms.start', 'terms.state',
+                       'terms.district', func=term_start),
+    })
+
+    ROSTER_TIMEOUT = 60 * 60
+
+    def __init__(self):
+        # Empty until web.py loads the boundary file at startup.
+        self.districts = DistrictIndex()
+        self._rosters = util.CappedCache(max_size=100)
+        self._roster_builds = util.SingleFlight()
+
+    def district(self, loc):
+        return self.districts.locate(*keys.point(loc))
+
+    def key_parts(self, fields):
+
+        # Points in a district share its key; others are snapped to a
+        # grid, and locate is asked about the grid point.
+
+        loc = fields.get('location')
+        if not loc:
+            return []
+        district = self.district(loc)
+        if district:
+            return [['district', district.key]]
+        return [['ll', list(keys.snap(*keys.point(loc)))]]
 
     @asyncio.coroutine
-    def check(self, fields, before, after, limit):
+    def roster(self, state):
+        roster = self._rosters.get(state)
+        if roster is None:
+            roster = yield from self._roster_builds.do(
+                state, self.fetch_roster, state)
+        return roster
 
-        limit = limit or 10
+    def roster_entry(self, legislator):
+        return legislator.get('district'), self.record(legislator)
 
-        loc = fields['location']
+    @asyncio.coroutine
+    def fetch_roster(self, state):
+
+        # The roster holds (district, record) pairs; records don't depend
+        # on where the request came from.
 
-        url = '{}/{}'.format(SUNLIGHT_URL, 'legislators/locate')
+        url = '{}/{}'.format(SUNLIGHT_URL, 'legislators')
         params = {
-            'fields': ','.join(
-                ["title", "first_name", "last_name", "bioguide_id",
-                 "state", "party", "district", "terms",
-                 "twitter_id", "phone", "website"]),
-            'latitude': loc['lat'],
-            'longitude': loc.get('lon') or loc.get('lng'),
+            'fields': self.record.param,
+            'state': state,
+            'in_office': 'true',
+            'per_page': 'all',
         }
 
-        data = yield from self.get_json(url, params=params)
+        roster = yield from self.get_json(
+            url, params=params, each=self.roster_entry)
 
-        ifttt = []
+        self._rosters.set(state, roster, timeout=self.ROSTER_TIMEOUT)
+        return roster
 
-        for legislator in data['results']:
+    @asyncio.coroutine
+    def check(self, fields, before, after, limit):
 
-            district = '{}{}'.format(
-                legislator['state'], legislator.get('district') or '')
+        limit = self.window(limit)
 
-            terms = []
-            for t in legislator['terms']:
-                term_district = '{}{}'.format(
-                    t['state'], t.get('district') or '')
-                if term_district == district:
-                    terms.append(t)
+        loc = fields['location']
+        located = self.district(loc)
 
-            term_start = terms[0]['start'];
+        if located:
 
-            timestamp = util.time_to_epoch(term_start)
+            roster = yield from self.roster(located.state)
+            ifttt = [record for district, record in roster
+                     if district in (None, located.district)]
 
-            record = {
-                'meta': {
-                    'id': '{}/{}'.format(legislator['bioguide_id'], district),
-                    'timestamp': timestamp,
-                },
-                'name': '{title}. {first_name} {last_name}'.format(**legislator),
-                'state': '{state}-{district}'.format(**legislator) \
-                    if legislator.get('district') else legislator['state'],
-                'party': legislator['party'],
-                'phone': legislator.get('phone') or '',
-                'website': legislator.get('website') or '',
-                'twitter_username': legislator.get('twitter_id') or '',
-                'date': term_start,
+        else:
+
+            lat, lng = keys.snap(*keys.point(loc))
+            url = '{}/{}'.format(SUNLIGHT_URL, 'legislators/locate')
+            params = {
+                'fields': self.record.param,
+                'latitude': lat,
+                'longitude': lng,
             }
-            ifttt.append(record)
 
-        ifttt = sorted(ifttt, key=lambda x: x['date'], reverse=True)
+            ifttt = yield from self.get_json(
+                url, params=params, each=self.record)
+
+        # Legislators can't be filtered upstream by when their term
+        # started, and there are only ever a handful per location.
+
+        with profiling.phase('build'):
+
+            if before:
+                before = util.epoch_to_date(before)
+                ifttt = [r for r in ifttt if r['date'][:10] <= before]
+
+            if after:
+                after = util.epoch_to_date(after)
+                ifttt = [r for r in ifttt if r['date'][:10] >= after]
+
+            ifttt = sorted(ifttt, key=lambda x: x['date'], reverse=True)
 
         return util.JSONResponse(ifttt[:limit])
 
 
-class UpcomingBillsTrigger(Trigger):
+def upcoming_id(upcoming):
+    return '{range}/{legislative_day}/{bill_id}'.format(**upcoming)
 
-    @asyncio.coroutine
-    def check(self, fields, before, after, limit):
 
-        url = '{}/{}'.format(SUNLIGHT_URL, 'upcoming_bills')
-        params = {
-            'fields': ','.join(
-                ["bill_id", "chamber", "legislative_day",
-                 "range", "url", "bill", "scheduled_at"]),
-            'range__exists': 'true',
-            'order': 'scheduled_at',
-        }
+def upcoming_code(bill_id):
+    parts = util.parse_bill_id(bill_id)
+    return util.bill_code(parts) if parts else bill_id.strip()
 
-        data = yield from self.get_json(url, params=params, limit=limit)
 
-        ifttt = []
+def upcoming_title(upcoming):
+    bill = upcoming.get('bill')
+    return util.bill_title(bill) if bill else None
 
-        for upcoming in data['results']:
 
-            timestamp = util.time_to_epoch(upcoming['scheduled_at'])
+def upcoming_date(upcoming):
+    display_date = util.readable_date(upcoming['legislative_day'])
+    if upcoming['range'] == 'week':
+        display_date = "the week of " + display_date
+    return display_date
 
-            display_date = util.readable_date(upcoming['legislative_day'])
-            if upcoming['range'] == 'week':
-                display_date = "the week of " + display_date;
 
-            bill = upcoming.get('bill')
+class UpcomingBillsTrigger(Trigger):
 
-            parts = util.parse_bill_id(upcoming['bill_id'])
-            code = util.bill_code(parts) if parts else upcoming['bill_id'].strip()
+    name = 'upcoming-bills'
+
+    record = Record({
+        'meta': {
+            'id': Source('range', 'legislative_day', 'bill_id',
+                         func=upcoming_id),
+            'timestamp': Source('scheduled_at', func=util.time_to_epoch),
+        },
+        'Code': Source('bill_id', func=upcoming_code),
+        'Title': Source('bill.short_title', 'bill.official_title',
+                        func=upcoming_title, default="(Not yet known)"),
+        'SponsorName': Source('bill.sponsor', func=util.name,
+                              default="(Not yet known)"),
+        'LegislativeDate': Source('legislative_day', 'range',
+                                  func=upcoming_date),
+        'Chamber': Source('chamber', func=util.chamber_name, default=''),
+        'SourceURL': Source('url'),
+        'date': Source('legislative_day'),
+    })
+
+    cursor = 'legislative_day'
+    order = 'scheduled_at'
+
+    # Floor schedules are updated a few times a day.
+    max_ttl = 30 * 60
 
-            record = {
-                'meta': {
-                    'id': '{range}/{legislative_day}/{bill_id}'.format(**upcoming),
-                    'timestamp': timestamp,
-                },
-                'Code': code,
-                'Title': util.bill_title(bill) if bill else "(Not yet known)",
-                'SponsorName': util.name(bill['sponsor']) if bill else "(Not yet known)",
-                'LegislativeDate': display_date,
-                'Chamber': util.chamber_name(upcoming['chamber']),
-                'SourceURL': upcoming['url'],
-                'date': upcoming['legislative_day'],
-            }
-            ifttt.append(record)
+    @asyncio.coroutine
+    def check(self, fields, before, after, limit):
+
+        url = '{}/{}'.format(SUNLIGHT_URL, 'upcoming_bills')
+        params = self.bound({
+            'fields': self.record.param,
+            'range__exists': 'true',
+        }, before, after)
+
+        ifttt = yield from self.get_results(url, params, limit, self.record)
 
         return util.JSONResponse(ifttt)
 
@@ -364,3 +722,8 @@ new_bills_query = NewBillsQuery()
 new_laws = NewLawsTrigger()
 new_legislators = NewLegislatorsTrigger()
 upcoming_bills = UpcomingBillsTrigger()
+
+# Triggers by the name in their URLs.
+registry = {handler.name: handler for handler in (
+    congress_birthdays, new_bills_query, new_laws, new_legislators,
+    upcoming_bills)}
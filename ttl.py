@@ -0,0 +1,70 @@
+import os
+from collections import OrderedDict
+
+# How much each refresh that brings nothing new stretches a TTL.
+TTL_GROWTH = float(os.environ.get('CACHE_TTL_GROWTH', '2'))
+
+
+class TTLPolicy(object):
+
+    # Learns how long each cache key's result may be cached from how often
+    # it actually changes. A refresh that brings no meta.id the key hasn't
+    # had before stretches its TTL by growth, up to maximum; one that does
+    # brings it back down to minimum. Losing records, as when a smaller
+    # limit was asked for or bills drop off the upcoming list, isn't a
+    # change: IFTTT only acts on new items.
+    #
+    # Quiet spells such as weekends and recesses get long TTLs this way,
+    # and the first new item after one shortens them again.
+
+    MAX_KEYS = 10000
+
+    def __init__(self, minimum, maximum, growth=TTL_GROWTH,
+                 max_keys=MAX_KEYS):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.growth = growth
+        self._max_keys = max_keys
+        self._keys = OrderedDict()
+
+        self.changes = 0
+        self.stretches = 0
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __call__(self, cache_key, data):
+
+        # Seconds to cache data, the new result for cache_key, for.
+
+        ids = frozenset(record['meta']['id'] for record in data)
+        last = self._keys.pop(cache_key, None)
+
+        if last is None:
+            ttl = self.minimum
+        elif ids - last[0]:
+            ttl = self.minimum
+            self.changes += 1
+        else:
+            ttl = min(self.maximum, last[1] * self.growth)
+            self.stretches += 1
+
+        # ids seen lately, so a bigger window coming back with ones that
+        # a smaller one had left out isn't taken for a change
+        if last is not None and len(last[0]) < max(2 * len(ids), 100):
+            ids = ids | last[0]
+
+        self._keys[cache_key] = (ids, ttl)
+        while len(self._keys) > self._max_keys:
+            self._keys.popitem(last=False)
+
+        return ttl
+
+    def stats(self):
+        ttls = [ttl for ids, ttl in self._keys.values()]
+        return {
+            'keys': len(ttls),
+            'mean': sum(ttls) / len(ttls) if ttls else 0,
+            'changes': self.changes,
+            'stretches': self.stretches,
+        }
@@ -0,0 +1,186 @@
+import asyncio
+import codecs
+import json
+import os
+import re
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+# Tunables for the shared upstream client, all overridable from the
+# environment so they can be adjusted per dyno without a deploy.
+
+CONN_LIMIT = int(os.environ.get('UPSTREAM_CONN_LIMIT', '20'))
+TIMEOUT = float(os.environ.get('UPSTREAM_TIMEOUT', '10'))
+CONN_TIMEOUT = float(os.environ.get('UPSTREAM_CONN_TIMEOUT', '3'))
+KEEPALIVE_TIMEOUT = float(os.environ.get('UPSTREAM_KEEPALIVE', '30'))
+DNS_TTL = float(os.environ.get('UPSTREAM_DNS_TTL', '300'))
+
+
+class UpstreamClient(object):
+
+    # One long-lived session per application. Connections to the Congress
+    # API are kept alive and reused, DNS lookups are cached for DNS_TTL
+    # seconds and every request is bounded by a per-host semaphore and
+    # an overall timeout. Response bodies are always read in full so the
+    # connection goes back to the pool, either at once or chunk by chunk
+    # into a feed function.
+
+    def __init__(self, limit=CONN_LIMIT, timeout=TIMEOUT,
+                 conn_timeout=CONN_TIMEOUT,
+                 keepalive_timeout=KEEPALIVE_TIMEOUT,
+                 dns_ttl=DNS_TTL, loop=None):
+        self._loop = loop or asyncio.get_event_loop()
+        self._limit = limit
+        self._timeout = timeout
+        self._conn_timeout = conn_timeout
+        self._keepalive_timeout = keepalive_timeout
+        self._dns_ttl = dns_ttl
+        self._dns_cleared = time.monotonic()
+        self._semaphores = {}
+        self._connector = None
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._connector = aiohttp.TCPConnector(
+                resolve=True,
+                conn_timeout=self._conn_timeout,
+                keepalive_timeout=self._keepalive_timeout,
+                loop=self._loop)
+            self._session = aiohttp.ClientSession(
+                connector=self._connector, loop=self._loop)
+        return self._session
+
+    def _semaphore(self, url):
+        host = urlsplit(url).netloc
+        sem = self._semaphores.get(host)
+        if sem is None:
+            sem = asyncio.Semaphore(self._limit, loop=self._loop)
+            self._semaphores[host] = sem
+        return sem
+
+    def _expire_dns(self):
+        now = time.monotonic()
+        if self._connector and now - self._dns_cleared > self._dns_ttl:
+            self._connector.clear_resolved_hosts()
+            self._dns_cleared = now
+
+    @asyncio.coroutine
+    def _fetch(self, method, url, params, headers, feed, data=None):
+        resp = yield from self.session.request(
+            method, url, params=params, headers=headers, data=data)
+        try:
+            if feed is None:
+                body = yield from resp.read()
+            else:
+                body = None
+                while True:
+                    chunk = yield from resp.content.readany()
+                    if not chunk:
+                        break
+                    feed(chunk)
+                resp.close()
+        except:
+            resp.close(force=True)
+            raise
+        return resp.status, body
+
+    @asyncio.coroutine
+    def request(self, method, url, params=None, headers=None, timeout=None,
+                feed=None, data=None):
+
+        # Returns a (status, body) pair with the body fully read, or with
+        # None for the body when it was passed to feed as it arrived.
+
+        self._expire_dns()
+
+        with (yield from self._semaphore(url)):
+            return (yield from asyncio.wait_for(
+                self._fetch(method, url, params, headers, feed, data),
+                timeout or self._timeout, loop=self._loop))
+
+    @asyncio.coroutine
+    def get(self, url, params=None, headers=None, timeout=None, feed=None):
+        return (yield from self.request(
+            'get', url, params=params, headers=headers, timeout=timeout,
+            feed=feed))
+
+    def close(self):
+        if self._connector is not None:
+            self._connector.close()
+        self._connector = None
+        self._session = None
+
+
+class BuildError(Exception):
+
+    # Raised out of a ResultStream when each fails on a result, so a bug
+    # of ours or one malformed result isn't taken for upstream failing.
+
+    pass
+
+
+class ResultStream(object):
+
+    # Incremental decoder for API bodies of the form {"results": [...], ...}.
+    # Each result is decoded as soon as it has arrived in full and handed
+    # to each; only what each returns is kept (None drops the result), so
+    # neither the body nor the raw dicts stay around. Anything after the
+    # results list is ignored.
+
+    RESULTS_RE = re.compile(r'"results"\s*:\s*\[')
+    SKIP_RE = re.compile(r'[\s,]*')
+
+    def __init__(self, each):
+        self._each = each
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._buf = ''
+        self._started = False
+        self._done = False
+        self.results = []
+
+    def feed(self, chunk):
+
+        if self._done:
+            return
+
+        buf = self._buf + self._decoder.decode(chunk)
+        pos = 0
+
+        if not self._started:
+            match = self.RESULTS_RE.search(buf)
+            if match is None:
+                self._buf = buf
+                return
+            self._started = True
+            pos = match.end()
+
+        while True:
+            pos = self.SKIP_RE.match(buf, pos).end()
+            if pos == len(buf):
+                break
+            if buf[pos] == ']':
+                self._done = True
+                break
+            try:
+                item, pos = self._json.raw_decode(buf, pos)
+            except ValueError:
+                break  # not all here yet
+            try:
+                value = self._each(item)
+            except Exception as exc:
+                raise BuildError(
+                    'building a result failed: {!r}'.format(exc)) from exc
+            if value is not None:
+                self.results.append(value)
+
+        self._buf = '' if self._done else buf[pos:]
+
+    def close(self):
+        if not self._done:
+            raise ValueError('incomplete or invalid results')
+        return self.results
@@ -1,8 +1,14 @@
+import asyncio
+import calendar
 import datetime
+import functools
+import hashlib
+import heapq
 import json
-import random
 import re
-from collections import namedtuple
+import time
+import zlib
+from collections import namedtuple, OrderedDict
 
 import pytz
 from aiohttp import web
@@ -10,16 +16,85 @@ from dateutil.parser import parse
 
 EASTERN = pytz.timezone('US/Eastern')
 
+# ujson is optional; it encodes trigger results several times faster than
+# the standard library when it's installed.
+try:
+    import ujson
 
-Entry = namedtuple('Entry', ['expires', 'value'])
+    def json_dumps(obj):
+        return ujson.dumps(obj, escape_forward_slashes=False)
+
+except ImportError:
+    json_dumps = json.dumps
+
+
+# zlib window bits for each content coding a body can be sent in.
+ENCODINGS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
+
+def accept_encoding(header):
+
+    # The coding from ENCODINGS to send a body in, given the request's
+    # Accept-Encoding, preferring gzip; None for none of them.
+
+    accepted = {}
+    for part in header.split(','):
+        coding, _, params = part.strip().lower().partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0
+        accepted[coding.strip()] = q
+
+    for coding in ('gzip', 'deflate'):
+        if accepted.get(coding, accepted.get('*', 0)) > 0:
+            return coding
+
+
+def etag_matches(header, etags):
+
+    # Whether an If-None-Match header names any of etags. The comparison
+    # is weak, as RFC 7232 has it for If-None-Match.
+
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag in etags:
+            return True
+    return False
+
+
+Entry = namedtuple('Entry', ['expires', 'value', 'stale_expires'])
 
 
 class CappedCache(object):
+
+    # LRU cache with per-entry expiry. Entries live in an OrderedDict kept
+    # in least- to most-recently-used order, so get and set are O(1) and
+    # eviction pops from the front. Expiry times are monotonic clock
+    # readings; a heap ordered by hard expiry lets set() drop dead entries
+    # without scanning the whole cache.
+
     DEFAULT_TIMEOUT = 60
 
-    def __init__(self, max_size=0):
-        self._dict = {}
+    def __init__(self, max_size=0, clock=time.monotonic):
+        self._dict = OrderedDict()
+        self._heap = []
         self._max_size = max_size
+        self._clock = clock
+
+        self.hits = 0
+        self.stale = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
 
     def __len__(self):
         return len(self._dict)
@@ -35,77 +110,358 @@ class CappedCache(object):
         return self.get(key)
 
     def get(self, key):
+        value, fresh = self.peek(key)
+        if fresh:
+            return value
+
+    def peek(self, key):
+
+        # Returns a (value, fresh) pair. Once an entry's timeout has passed
+        # it is still returned, marked as not fresh, until its stale window
+        # runs out as well; after that it is removed.
+
         entry = self._dict.get(key)
+
         if entry:
-            now = datetime.datetime.utcnow()
-            if now < entry.expires:
-                return entry.value
+            now = self._clock()
+            if now < entry.stale_expires:
+                self._dict.move_to_end(key)
+                if now < entry.expires:
+                    self.hits += 1
+                    return entry.value, True
+                self.stale += 1
+                return entry.value, False
             del self._dict[key]
+            self.expirations += 1
+
+        self.misses += 1
+        return None, False
 
-    def set(self, key, value, timeout=None):
+    def set(self, key, value, timeout=None, stale=0):
 
         if not timeout:
             timeout = CappedCache.DEFAULT_TIMEOUT
 
-        now = datetime.datetime.utcnow()
-        expires = now + datetime.timedelta(seconds=timeout)
+        now = self._clock()
+        expires = now + timeout
+        stale_expires = expires + stale
 
-        self._dict[key] = Entry(expires, value)
+        self._dict.pop(key, None)
+        self._dict[key] = Entry(expires, value, stale_expires)
+        heapq.heappush(self._heap, (stale_expires, key))
 
+        self.expire(now)
         self.prune(ignore=key)
 
-    def prune(self, ignore=None):
-        if self._max_size and len(self._dict) > self._max_size:
-            over = len(self._dict) - self._max_size
-            keys = list(self._dict.keys())
-            if ignore:
-                keys.remove(ignore)
-            for i in range(over):
-                key = random.choice(keys)
-                keys.remove(key)
+    def expire(self, now=None):
+
+        # Pops heap items that are due. Items left behind by an overwrite or
+        # an eviction no longer match the live entry and are just dropped.
+
+        if now is None:
+            now = self._clock()
+
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            stale_expires, key = heapq.heappop(heap)
+            entry = self._dict.get(key)
+            if entry and entry.stale_expires == stale_expires:
                 del self._dict[key]
+                self.expirations += 1
+
+        if len(heap) > 2 * len(self._dict) + 64:
+            self._compact()
+
+    def _compact(self):
+        self._heap = [(entry.stale_expires, key)
+                      for key, entry in self._dict.items()]
+        heapq.heapify(self._heap)
+
+    def prune(self, ignore=None):
+
+        # The most recently set key is always at the end of the order, so
+        # ignore is only kept for compatibility.
+
+        while self._max_size and len(self._dict) > self._max_size:
+            self._dict.popitem(last=False)
+            self.evictions += 1
+
+    def ttl(self, key):
+
+        # Seconds of freshness key has left, negative once it's stale, or
+        # None when it isn't cached. Not counted as a lookup.
+
+        entry = self._dict.get(key)
+        if entry:
+            now = self._clock()
+            if now < entry.stale_expires:
+                return entry.expires - now
+
+    def entries(self):
+
+        # Live entries, least recently used first, as (key, value, fresh,
+        # stale) tuples: seconds until each stops being fresh (negative
+        # once it has) and until it goes altogether.
+
+        now = self._clock()
+        return [(key, entry.value, entry.expires - now,
+                 entry.stale_expires - now)
+                for key, entry in self._dict.items()
+                if entry.stale_expires > now]
+
+    def stats(self):
+        return {
+            'size': len(self._dict),
+            'hits': self.hits,
+            'stale': self.stale,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+class SingleFlight(object):
+
+    # Coalesces concurrent calls that share a key: the first caller starts
+    # the work as a task and everyone else awaits that same task until it
+    # finishes. Results and errors go to every waiter; nothing is kept
+    # once the task is done, so failures are never cached here.
+
+    def __init__(self, loop=None):
+        self._loop = loop
+        self._inflight = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._inflight)
+
+    def __contains__(self, key):
+        return key in self._inflight
+
+    @asyncio.coroutine
+    def do(self, key, func, *args):
+
+        if key in self._inflight:
+            self.coalesced += 1
+
+        loop = self._loop or asyncio.get_event_loop()
+        task = self.spawn(key, func, *args)
+
+        # shield so a disconnecting client doesn't cancel the work
+        # for everybody else waiting on it
+        return (yield from asyncio.shield(task, loop=loop))
+
+    def spawn(self, key, func, *args):
+
+        # Starts func in the background unless a call for key is already
+        # running, without waiting for it. Returns the running task.
+
+        task = self._inflight.get(key)
+
+        if task is None:
+            loop = self._loop or asyncio.get_event_loop()
+            task = loop.create_task(func(*args))
+            task.add_done_callback(functools.partial(self._done, key))
+            self._inflight[key] = task
+            self.calls += 1
+
+        return task
+
+    def _done(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # mark as retrieved if every waiter went away
+
+
+class Payload(object):
+
+    # The encoded body of a JSONResponse along with its ETag and length.
+    # Built once per result and shared by every response made from it,
+    # so cache hits don't encode anything.
+    #
+    # window is the limit the result was fetched with. A payload can answer
+    # any smaller limit with slice(), which keeps each slice it encodes.
+    # Compressed bodies are kept the same way; see compressed(), and so
+    # are bodies with fields added to every record; see extended().
+
+    __slots__ = ('_data', 'body', 'etag', 'length', 'window', 'encode_time',
+                 '_slices', '_compressed', '_extended')
+
+    COMPRESS_LEVEL = 6
+
+    # Most extended() bodies kept per payload.
+    MAX_EXTENDED = 16
+
+    def __init__(self, data, window=None):
+        t0 = time.perf_counter()
+        self._data = data
+        self.body = json_dumps({'data': data}).encode('utf-8')
+        self.encode_time = time.perf_counter() - t0
+        self.etag = '"{}"'.format(hashlib.sha1(self.body).hexdigest())
+        self.length = len(self.body)
+        self.window = window
+        self._slices = {}
+        self._compressed = {}
+        self._extended = {}
+
+    @classmethod
+    def from_body(cls, body, window, etag):
+
+        # A payload for a body encoded earlier, such as one read back from
+        # a snapshot. Its data is only decoded when first needed.
+
+        payload = cls.__new__(cls)
+        payload._data = None
+        payload.body = body
+        payload.encode_time = 0
+        payload.etag = etag
+        payload.length = len(body)
+        payload.window = window
+        payload._slices = {}
+        payload._compressed = {}
+        payload._extended = {}
+        return payload
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = json.loads(self.body.decode('utf-8'))['data']
+        return self._data
+
+    def covers(self, limit):
+        if self.window is None or len(self.data) < self.window:
+            return True
+        return limit <= self.window
+
+    def compressed(self, encoding):
+
+        # The body in one of ENCODINGS, compressed the first time it's
+        # asked for.
+
+        body = self._compressed.get(encoding)
+        if body is None:
+            compressor = zlib.compressobj(
+                self.COMPRESS_LEVEL, zlib.DEFLATED, ENCODINGS[encoding])
+            body = compressor.compress(self.body) + compressor.flush()
+            self._compressed[encoding] = body
+        return body
+
+    def etag_for(self, encoding):
+
+        # Each coding of the body is a different representation, so it
+        # gets its own strong ETag.
+
+        if encoding is None:
+            return self.etag
+        return '{}-{}"'.format(self.etag[:-1], encoding)
+
+    def slice(self, limit):
+        if limit >= len(self.data):
+            return self
+        payload = self._slices.get(limit)
+        if payload is None:
+            payload = self._slices[limit] = Payload(self.data[:limit], limit)
+        return payload
+
+    def extended(self, extra):
+
+        # A payload with extra's items added to every record, for parts of
+        # a response that differ between requests sharing this result.
+
+        key = tuple(sorted(extra.items()))
+        payload = self._extended.get(key)
+        if payload is None:
+            if len(self._extended) >= self.MAX_EXTENDED:
+                self._extended.clear()
+            payload = self._extended[key] = Payload(
+                [dict(record, **extra) for record in self.data], self.window)
+        return payload
 
 
 class JSONResponse(web.Response):
-    def __init__(self, data, **kwargs):
+    def __init__(self, data, payload=None, encoding=None, **kwargs):
+        if payload is None:
+            payload = Payload(data)
         self.data = data
-        super(JSONResponse, self).__init__(text=json.dumps({'data': data}),
-                                           content_type='application/json',
+        self.payload = payload
+        headers = {
+            'Content-Type': 'application/json; charset=utf-8',
+            'ETag': payload.etag_for(encoding),
+        }
+        body = payload.body
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+            body = payload.compressed(encoding)
+        super(JSONResponse, self).__init__(body=body,
+                                           headers=headers,
                                            **kwargs)
     def copy(self):
-        return JSONResponse(self.data)
+        return JSONResponse(self.data, payload=self.payload)
 
 
 class ErrorResponse(web.HTTPBadRequest):
     def __init__(self, message, *args, **kwargs):
         payload = {'errors': [{'message': message}]}
+        self.errors = payload['errors']
         super(ErrorResponse, self).__init__(text=json.dumps(payload),
                                             content_type='application/json',
                                             **kwargs)
 
 
-def validate_query(query):
+class UnavailableResponse(web.HTTPServiceUnavailable):
+    def __init__(self, message, *args, **kwargs):
+        payload = {'errors': [{'message': message}]}
+        self.errors = payload['errors']
+        super(UnavailableResponse, self).__init__(
+            text=json.dumps(payload), content_type='application/json',
+            **kwargs)
+
+
+Term = namedtuple('Term', ['text', 'phrase', 'distance'])
+
+
+def parse_query(query):
+
+    # Splits a bill search query into words and "quoted phrases". A phrase
+    # may be followed by ~N to match its words within N positions of each
+    # other; * is only allowed outside of phrases.
 
     query = re.sub(r'" *~', '"~', query)
     query = re.sub(r'~ *', '~', query)
 
-    parts = query.split('"')
+    terms = []
 
-    if parts[0] == '':
-        parts = parts[1:]
+    for i, part in enumerate(query.split('"')):
 
-    in_phrase = False
+        if i % 2:
+            if '*' in part:
+                raise ValueError(
+                    '* is not allowed in a phrase ({})'.format(part))
+            terms.append(Term(part, True, None))
+            continue
 
-    for part in parts:
+        for word in part.split():
+            if word[0] != '~':
+                terms.append(Term(word, False, None))
+                continue
+            match = re.match(r'~([0-9]+)$', word)
+            if not match or not terms or not terms[-1].phrase \
+                    or terms[-1].distance is not None:
+                raise ValueError(
+                    '~ must be followed by a number after a phrase ({})'.format(word))
+            terms[-1] = terms[-1]._replace(distance=int(match.group(1)))
 
-        in_phrase = not in_phrase
+    return terms
 
-        if '*' in part and in_phrase:
-            raise ValueError(
-                '* is not allowed in a phrase ({})'.format(part))
-        elif part[0] == '~' and re.replace(r'^~[0-9]+', '', part) == part:
-            raise ValueError(
-                '~ must be followed by a number after a phrase ({})'.format(part))
+
+def validate_query(query):
+
+    query = re.sub(r'" *~', '"~', query)
+    query = re.sub(r'~ *', '~', query)
+
+    parse_query(query)
 
     return query
 
@@ -153,6 +509,30 @@ def parse_bill_id(bill_id):
         }
 
 
+# The Congress API sends dates as YYYY-MM-DD and times as ISO 8601, so
+# those are parsed directly; dateutil is only used for anything else. The
+# same few hundred legislative days come up over and over, so results are
+# memoized as well.
+
+DATE_RE = re.compile(r'(\d{4})-(\d{2})-(\d{2})$')
+TIME_RE = re.compile(r'(\d{4})-(\d{2})-(\d{2})'
+                     r'(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.\d+)?)?)?'
+                     r'(Z|[+-]\d{2}:?\d{2})?$')
+
+MONTHS = ["January", "February", "March", "April", "May",
+          "June", "July", "August", "September", "October",
+          "November", "December"]
+
+
+def parse_ymd(dstr):
+    match = DATE_RE.match(dstr)
+    if match:
+        return tuple(int(part) for part in match.groups())
+    dt = parse(dstr)
+    return dt.year, dt.month, dt.day
+
+
+@functools.lru_cache(maxsize=4096)
 def date_to_epoch(dstr):
 
     # Format a date stamp (YYYY-MM-DD) into a Unix epoch time.
@@ -163,24 +543,41 @@ def date_to_epoch(dstr):
     #
     # IFTTT epochs need to be in seconds, JS uses milliseconds.
 
-    dt = parse(dstr).replace(hour=0, minute=0, second=0, tzinfo=EASTERN)
+    dt = EASTERN.localize(datetime.datetime(*parse_ymd(dstr)))
     return int(dt.timestamp())
 
 
+@functools.lru_cache(maxsize=4096)
 def time_to_epoch(tstr):
-    dt = parse(tstr)
-    return int(dt.timestamp())
 
+    match = TIME_RE.match(tstr)
 
-def readable_date(ymd):
+    if not match:
+        dt = parse(tstr)
+        return int(dt.timestamp())
+
+    parts = match.groups()
+    dt = datetime.datetime(*[int(part or 0) for part in parts[:6]])
+    zone = parts[6]
+
+    if zone is None:
+        # no offset: local time, as dateutil would have it
+        return int(dt.timestamp())
+
+    offset = 0
+    if zone != 'Z':
+        zone = zone.replace(':', '')
+        offset = int(zone[1:3]) * 3600 + int(zone[3:5]) * 60
+        if zone[0] == '-':
+            offset = -offset
+
+    return calendar.timegm(dt.timetuple()) - offset
 
-    months = ["January", "February", "March", "April", "May",
-              "June", "July", "August", "September", "October",
-              "November", "December"]
 
-    dt = parse(ymd)
-    mon = dt.month
-    dom = dt.day
+@functools.lru_cache(maxsize=4096)
+def readable_date(ymd):
+
+    year, mon, dom = parse_ymd(ymd)
 
     if dom == 1 or dom == 21 or dom == 31:
         suffix = 'st'
@@ -191,7 +588,19 @@ def readable_date(ymd):
     else:
         suffix = 'th'
 
-    return '{} {}{}, {}'.format(months[mon - 1], dom, suffix, dt.year)
+    return '{} {}{}, {}'.format(MONTHS[mon - 1], dom, suffix, year)
+
+
+def parse_limit(limit):
+
+    # A request's limit as a number of records, or None if it asks for
+    # no particular number. Clients send it as a number or a string.
+
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return None
+    return limit if limit >= 0 else None
 
 
 def epoch_to_date(epoch):
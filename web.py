@@ -3,30 +3,154 @@ import datetime
 import json
 import os
 import re
-import aiohttp
+import sqlite3
+import time
 from aiohttp import web
+import functools
+from collections import namedtuple
 from functools import wraps
 
+import keys
+import metrics
+import profiling
 import triggers
-from util import JSONResponse, ErrorResponse, CappedCache
+from cache import SharedCache, MEMCACHE_SERVER
+from districts import DistrictIndex
+from guard import UpstreamGuard, Unavailable, CLOSED
+from mirror import BillMirror, BILL_MIRROR
+from prewarm import Prewarmer, PREWARM, PREWARM_LEAD, PREWARM_LOCK
+from realtime import Notifier, REALTIME_URL, REALTIME_LOCK
+from snapshot import CacheSnapshot, CACHE_SNAPSHOT
+from upstream import UpstreamClient
+from util import JSONResponse, ErrorResponse, UnavailableResponse, Payload
+from util import CappedCache, SingleFlight, parse_limit
+from util import ENCODINGS, accept_encoding, etag_matches
 
 CLIENT_SECRET = os.environ.get('CLIENT_SECRET', '')
 
-STATUS_URL = 'https://congress.api.sunlightfoundation.com'
+# Bearer token /metrics asks for instead of the channel key, so the
+# scraper doesn't have to hold the channel's secret.
+METRICS_KEY = os.environ.get('METRICS_KEY', '')
 
+# Seconds a cached trigger result may still be served (stale) once it's
+# no longer fresh, while a background refresh replaces it. How long it
+# stays fresh depends on the trigger; see Trigger.ttl.
+CACHE_STALE = int(os.environ.get('CACHE_STALE', '600'))
 
-cache = CappedCache(max_size=1000)
+# Most trigger results each worker keeps.
+CACHE_SIZE = int(os.environ.get('CACHE_SIZE', '1000'))
+
+# Trigger results at least this many bytes long are compressed for
+# clients that accept it.
+COMPRESS_MIN = int(os.environ.get('COMPRESS_MIN', '1024'))
+
+# Most distinct trigger request bodies whose cache key is remembered,
+# and for how many seconds; see parse_trigger.
+BODY_CACHE_SIZE = int(os.environ.get('BODY_CACHE_SIZE', '10000'))
+BODY_CACHE_TIMEOUT = 60 * 60
+
+# Most requests a batch may hold, and how many of them run at once.
+BATCH_MAX = int(os.environ.get('BATCH_MAX', '500'))
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', '10'))
+
+# What Trigger.cache_key needs of a request: its path and decoded body.
+TriggerRequest = namedtuple('TriggerRequest', ['path', 'data'])
+
+cache = CappedCache(max_size=CACHE_SIZE)
+shared = SharedCache.from_server(MEMCACHE_SERVER)
+inflight = SingleFlight()
+bodies = CappedCache(max_size=BODY_CACHE_SIZE)
+
+
+def decode(body):
+
+    # A request body as the dict it holds, or {} if it isn't one.
+
+    with profiling.phase('parse'):
+        try:
+            data = json.loads(body.decode('utf-8'))
+        except ValueError:
+            data = {}
+    return data if isinstance(data, dict) else {}
+
+
+@asyncio.coroutine
+def request_data(request):
+
+    # The decoded body of request. Bodies are only read and decoded by
+    # the handlers that use them, once per request.
+
+    data = getattr(request, 'data', None)
+    if data is None:
+        body = yield from request.read()
+        data = request.data = decode(body)
+    return data
 
 
 @asyncio.coroutine
-def data_middleware(app, handler):
+def parse_trigger(request, handler):
+
+    # (cache key, decoded body) of a request to handler. Pollers send
+    # the same body every time, so both are remembered by path and body:
+    # a repeat goes straight to the cache without decoding anything.
+
+    body = yield from request.read()
+    parsed = bodies.get((request.path, body))
+
+    if parsed is None:
+        data = decode(body)
+        parsed = (handler.cache_key(TriggerRequest(request.path, data)), data)
+        bodies.set((request.path, body), parsed, timeout=BODY_CACHE_TIMEOUT)
+
+    return parsed
+
+
+def lookup(request):
+    name = request.match_info['trigger']
+    handler = triggers.registry.get(name)
+    if handler is None:
+        msg = 'No such trigger: {}'.format(name)
+        raise web.HTTPInternalServerError(text=msg)
+    return handler
+
+
+@asyncio.coroutine
+def metrics_middleware(app, handler):
+
+    # Outermost, so it times the whole request including the other
+    # middlewares and sees the status of errors they raise.
+
     @asyncio.coroutine
     def middleware(request):
+
+        route = request.match_info.route
+        name = getattr(route.handler, '__name__', 'other')
+
+        trigger = request.match_info.get('trigger', '')
+        if trigger not in triggers.registry:
+            trigger = ''
+
+        metrics.in_flight.inc()
+        t0 = time.monotonic()
+        status = 500
+        size = 0
+
         try:
-            request.data = yield from request.json()
-        except ValueError:
-            request.data = {}
-        return (yield from handler(request))
+            resp = yield from handler(request)
+            status = resp.status
+            size = len(resp.body or b'')
+            return resp
+        except web.HTTPException as exc:
+            status = exc.status
+            size = len(exc.body or b'')
+            raise
+        finally:
+            metrics.in_flight.dec()
+            metrics.requests.inc(name, trigger, str(status))
+            metrics.request_latency.observe(
+                name, trigger, value=time.monotonic() - t0)
+            metrics.response_bytes.observe(name, trigger, value=size)
+
     return middleware
 
 
@@ -35,8 +159,14 @@ def auth_middleware(app, handler):
     @asyncio.coroutine
     def middleware(request):
 
-        key = request.headers.get('IFTTT-Channel-Key', '')
-        if key == CLIENT_SECRET or not CLIENT_SECRET:
+        if request.path == '/metrics' and METRICS_KEY:
+            return (yield from handler(request))
+
+        with profiling.phase('auth'):
+            key = request.headers.get('IFTTT-Channel-Key', '')
+            authorized = key == CLIENT_SECRET or not CLIENT_SECRET
+
+        if authorized:
             return (yield from handler(request))
 
         msg = {
@@ -52,17 +182,22 @@ def auth_middleware(app, handler):
 
 @asyncio.coroutine
 def status(request):
-    resp = yield from aiohttp.request('get', STATUS_URL)
 
-    if resp.status == 200:
-        msg = "We just checked our Congress API's status and it's fine."
+    # Reports what the trigger requests have seen of the Congress API,
+    # rather than asking it again on every status check.
+
+    state = request.app['guard'].breaker.state
+
+    if state == CLOSED:
+        msg = "Our calls to the Congress API are going through fine."
     else:
         msg = "Our API seems unavailable right now."
 
     data = {
-        "status": "OK" if resp.status == 200 else  "UNAVAILABLE",
+        "status": "OK" if state == CLOSED else "UNAVAILABLE",
         "time": datetime.date.today().isoformat(),
         "message": msg,
+        "upstream": request.app['guard'].stats(),
     }
     return JSONResponse(data)
 
@@ -92,31 +227,60 @@ def test_setup(request):
 @asyncio.coroutine
 def trigger(request):
 
-    name = request.match_info['trigger'].replace('-', '_')
-    handler = getattr(triggers, name, None)
+    handler = lookup(request)
 
-    if not handler:
-        msg = 'No such trigger: {}'.format(name)
-        raise web.HTTPInternalServerError(text=msg)
+    cache_key, data = yield from parse_trigger(request, handler)
+    resp = yield from evaluate(request.app, handler, cache_key, data)
 
-    cache_key = handler.cache_key(request)
+    if isinstance(resp, JSONResponse):
+        notifier = request.app.get('notifier')
+        if notifier is not None:
+            notifier.watch(handler, cache_key, data, resp.data)
+        prewarmer = request.app.get('prewarmer')
+        if prewarmer is not None:
+            prewarmer.seen(handler, cache_key, data)
+        resp = negotiate(request, resp)
 
-    resp = cache.get(cache_key)
+    return resp
 
-    if resp:
 
-        resp = resp.copy()
+@asyncio.coroutine
+def evaluate(app, handler, cache_key, data):
 
-    else:
+    # Answers one trigger request, with data its decoded body, from the
+    # cache or by running the trigger.
+
+    limit = data.get('limit')
+
+    if parse_limit(limit) == 0:
+        return JSONResponse([])
+
+    window = handler.window(limit)
+    guard = app['guard']
+
+    with profiling.phase('cache'):
+        payload, fresh = cache.peek(cache_key)
 
-        before = request.data.get('before')
-        after = request.data.get('after')
-        limit = request.data.get('limit')
+    if payload and not payload.covers(window) and guard.available:
+        # cached for a smaller limit, go get the bigger window; while the
+        # circuit is open, fewer records beat none
+        payload = None
 
-        if limit == 0:
-            return JSONResponse([])
+    metrics.cache_lookups.inc(
+        handler.name, 'miss' if not payload else 'hit' if fresh else 'stale')
 
-        trigger_fields = request.data.get('triggerFields') or {}
+    extra = handler.extra(data.get('triggerFields') or {})
+
+    if payload and fresh:
+
+        resp = respond(payload, window, extra)
+
+    else:
+
+        before = data.get('before')
+        after = data.get('after')
+
+        trigger_fields = data.get('triggerFields') or {}
 
         if handler.fields:
             if not trigger_fields:
@@ -130,14 +294,265 @@ def trigger(request):
         # dstr = re.sub(r'[^a-zA-Z0-9]', '', dstr)
         # key = '{}:{}'.format(name, dstr)
 
+        if payload:
+            # stale: answer right away and refresh in the background,
+            # unless the circuit is open; either way the stale entry keeps
+            # being served until its stale window runs out. Past that it's
+            # gone, and while the circuit is open requests get a 503
+            if cache_key not in inflight and guard.available:
+                args = (handler, cache_key, trigger_fields, before, after,
+                        max(window, payload.window))
+                task = inflight.spawn(cache_key, fetch, *args)
+                task.add_done_callback(
+                    functools.partial(log_refresh, app))
+            resp = respond(payload, window, extra)
+        else:
+            # fetch at least the default window so small limits don't
+            # lead to a refetch as soon as a bigger one comes along
+            args = (handler, cache_key, trigger_fields, before, after,
+                    max(window, handler.default_limit))
+            while True:
+                try:
+                    resp = yield from inflight.do(
+                        cache_key, profiling.carry(fetch), *args)
+                except Unavailable as exc:
+                    return UnavailableResponse(str(exc))
+                except asyncio.TimeoutError:
+                    return UnavailableResponse(
+                        'The Congress API took too long to answer')
+                if not isinstance(resp, JSONResponse):
+                    return resp
+                # a call already in flight may have been for a smaller
+                # window; if so, go again
+                if resp.payload.covers(window):
+                    break
+            resp = respond(resp.payload, window, extra)
+
+    return resp
+
+
+@asyncio.coroutine
+def batch(request):
+
+    # Evaluates many requests for one trigger, given as
+    #
+    #   {"requests": [{"trigger_identity": ..., "triggerFields": ...,
+    #                  "limit": ..., "before": ..., "after": ...}, ...]}
+    #
+    # Requests that share a cache key are evaluated once, for the largest
+    # limit asked for among them. Results and errors come back keyed by
+    # trigger_identity (or by position when there isn't one).
+
+    handler = lookup(request)
+    data = yield from request_data(request)
+
+    items = data.get('requests')
+
+    if not isinstance(items, list) or not items:
+        return ErrorResponse('requests is required')
+
+    if len(items) > BATCH_MAX:
+        return ErrorResponse(
+            'at most {} requests per batch'.format(BATCH_MAX))
+
+    path = '/ifttt/v1/triggers/{}'.format(request.match_info['trigger'])
+    groups = {}
+    results = {}
+    errors = {}
+
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            item = {}
+        identity = item.get('trigger_identity') or str(i)
+        try:
+            cache_key = handler.cache_key(TriggerRequest(path, item))
+        except Exception as exc:
+            # fields too malformed to even make a key of
+            errors[identity] = [{'message': 'invalid request: {!r}'.format(
+                exc)}]
+            continue
+        groups.setdefault(cache_key, []).append((identity, item))
+
+    sem = asyncio.Semaphore(BATCH_CONCURRENCY, loop=request.app.loop)
+
+    @asyncio.coroutine
+    def run(cache_key, group):
+
+        windows = [handler.window(item.get('limit')) for _, item in group]
+        data = dict(group[0][1], limit=max(windows))
+
+        with (yield from sem):
+            try:
+                resp = yield from evaluate(
+                    request.app, handler, cache_key, data)
+            except Exception as exc:
+                request.app.logger.exception('batch request failed')
+                resp = ErrorResponse(str(exc))
+
+        prewarmer = request.app.get('prewarmer')
+        if prewarmer is not None and isinstance(resp, JSONResponse):
+            prewarmer.seen(handler, cache_key, data)
+
+        for (identity, item), window in zip(group, windows):
+            if isinstance(resp, JSONResponse):
+                limit = parse_limit(item.get('limit'))
+                records = [] if limit == 0 else \
+                    resp.payload.slice(window).data
+                extra = handler.extra(item.get('triggerFields') or {})
+                if extra:
+                    records = [dict(record, **extra) for record in records]
+                results[identity] = records
+            else:
+                errors[identity] = getattr(resp, 'errors', [])
+
+    yield from asyncio.gather(
+        *[run(key, group) for key, group in groups.items()],
+        loop=request.app.loop)
+
+    return JSONResponse({'results': results, 'errors': errors})
+
+
+def negotiate(request, resp):
+
+    # A 304 if the client already has this result, else resp, compressed
+    # if it's big enough and the client takes it. Compressed bodies are
+    # kept on the cached payload, so each is compressed once.
+
+    payload = resp.payload
+    encoding = None
+    vary = payload.length >= COMPRESS_MIN
+
+    if vary:
+        encoding = accept_encoding(
+            request.headers.get('Accept-Encoding', ''))
+
+    match = request.headers.get('If-None-Match')
+    if match and etag_matches(
+            match, [payload.etag] + [payload.etag_for(e) for e in ENCODINGS]):
+        resp = web.Response(status=304)
+        resp.headers['ETag'] = payload.etag_for(encoding)
+    elif encoding is not None:
+        resp = JSONResponse(resp.data, payload=payload, encoding=encoding)
+
+    if vary:
+        resp.headers['Vary'] = 'Accept-Encoding'
+
+    return resp
+
+
+def respond(payload, window, extra=None):
+
+    # Cached payloads hold what's the same for every request; extra, from
+    # Trigger.extra, is added to the records of this one.
+
+    payload = payload.slice(window)
+    if extra:
+        payload = payload.extended(extra)
+    return JSONResponse(payload.data, payload=payload)
+
+
+@asyncio.coroutine
+def fetch(handler, cache_key, trigger_fields, before, after, limit,
+          min_ttl=0):
+
+    # Runs once per cache key at a time; see SingleFlight. Every waiter
+    # gets its own response built on the encoded payload that is cached
+    # here.
+    #
+    # Before going upstream, try the cache shared between workers for a
+    # result fresh for more than min_ttl seconds. If it misses, only the
+    # worker holding the fill lease calls check; the others wait for its
+    # result to show up.
+
+    hit = yield from from_shared(cache_key, limit, min_ttl=min_ttl)
+    leased = False
+
+    if not hit:
+        leased = yield from shared.lease(cache_key)
+        if not leased:
+            hit = yield from from_shared(cache_key, limit, wait=True,
+                                         min_ttl=min_ttl)
+
+    if hit:
+        payload, ttl = hit
+        cache.set(cache_key, payload, timeout=ttl, stale=CACHE_STALE)
+        return JSONResponse(payload.data, payload=payload)
+
+    try:
         resp = yield from handler.check(trigger_fields, before, after, limit)
 
         if isinstance(resp, JSONResponse):
-            cache.set(cache_key, resp, timeout=60)
+            metrics.serialize_latency.observe(
+                handler.name, value=resp.payload.encode_time)
+            profile = profiling.current()
+            if profile is not None:
+                profile.add('serialize', resp.payload.encode_time)
+            resp.payload.window = limit
+            ttl = handler.ttl(cache_key, resp.data)
+            cache.set(cache_key, resp.payload, timeout=ttl, stale=CACHE_STALE)
+            yield from shared.set(cache_key, resp.data, ttl, limit)
+
+    finally:
+        if leased:
+            yield from shared.release(cache_key)
 
     return resp
 
 
+@asyncio.coroutine
+def from_shared(cache_key, limit, wait=False, min_ttl=0):
+
+    # Returns (payload, ttl) from the shared cache if it holds at least
+    # limit records for cache_key, fresh for more than min_ttl seconds.
+
+    if wait:
+        hit = yield from shared.wait(cache_key, min_ttl)
+    else:
+        hit = yield from shared.get(cache_key)
+
+    if hit:
+        data, ttl, window = hit
+        if ttl <= min_ttl:
+            return None
+        payload = Payload(data, window)
+        if payload.covers(limit):
+            return payload, ttl
+
+
+@asyncio.coroutine
+def refresh(handler, cache_key, trigger_fields, limit):
+
+    # Realtime checks go through fetch, so they also keep the cache warm
+    # for the polls they lead to. Keys still fresh in the cache are
+    # skipped: that's what polls get, so there's nothing new to tell yet.
+
+    ttl = cache.ttl(cache_key)
+    if ttl is not None and ttl > 0:
+        return None
+    return (yield from inflight.do(
+        cache_key, fetch, handler, cache_key, trigger_fields, None, None,
+        limit))
+
+
+@asyncio.coroutine
+def warm(handler, cache_key, trigger_fields, limit):
+
+    # Prewarmer refreshes. The fill lease makes sure only one worker goes
+    # upstream for a key; the others pick its result up from the shared
+    # cache, as long as it's newer than what they would be replacing.
+
+    if cache_key in inflight or not app['guard'].available:
+        return
+    return (yield from inflight.do(
+        cache_key, fetch, handler, cache_key, trigger_fields, None, None,
+        limit, PREWARM_LEAD))
+
+
+def log_refresh(app, task):
+    if not task.cancelled() and task.exception():
+        app.logger.warning('background refresh failed: %r', task.exception())
+
+
 @asyncio.coroutine
 def options(request):
     return web.Response(body=b"Hello, world")
@@ -146,18 +561,13 @@ def options(request):
 @asyncio.coroutine
 def validate(request):
 
-    name = request.match_info['trigger'].replace('-', '_')
     field = request.match_info['field']
-
-    handler = getattr(triggers, name, None)
-
-    if not handler:
-        msg = 'No such trigger: {}'.format(name)
-        raise web.HTTPInternalServerError(text=msg)
+    handler = lookup(request)
 
     if handler.fields and field in handler.fields:
 
-        val = request.data.get('value')
+        data = yield from request_data(request)
+        val = data.get('value')
         result = handler.fields[field].validate(val)
 
         data = {'valid': result == True}
@@ -174,13 +584,156 @@ def validate(request):
                         content_type='application/json')
 
 
-app = web.Application(middlewares=[auth_middleware, data_middleware])
+@asyncio.coroutine
+def metrics_page(request):
+
+    # Without METRICS_KEY, auth_middleware has checked the channel key.
+    if METRICS_KEY and request.headers.get('Authorization') != \
+            'Bearer {}'.format(METRICS_KEY):
+        raise web.HTTPUnauthorized()
+
+    return web.Response(
+        body=metrics.registry.render().encode('utf-8'),
+        content_type='text/plain; version=0.0.4')
+
+
+@asyncio.coroutine
+def profiles(request):
+
+    results = profiler.recent(parse_limit(request.GET.get('limit')))
+
+    return web.Response(text=json.dumps({'data': results}),
+                        content_type='application/json')
+
+
+def close_upstream(app):
+    app['upstream'].close()
+
+
+def close_shared(app):
+    app['shared'].close()
+
+
+def close_mirror(app):
+    app['mirror'].close()
+
+
+def close_notifier(app):
+    app['notifier'].close()
+
+
+def close_prewarmer(app):
+    app['prewarmer'].close()
+
+
+def close_snapshot(app):
+    return app['snapshot'].close(cache)
+
+
+profiler = profiling.Profiler()
+
+middlewares = [metrics_middleware, auth_middleware]
+if profiler.enabled:
+    middlewares.insert(1, profiler.middleware)
+
+app = web.Application(middlewares=middlewares)
+app['upstream'] = triggers.Trigger.client = UpstreamClient(loop=app.loop)
+app['guard'] = triggers.Trigger.guard = UpstreamGuard(loop=app.loop)
+app['shared'] = shared
+app.register_on_finish(close_upstream)
+app.register_on_finish(close_shared)
+
+if BILL_MIRROR:
+    mirror = BillMirror(BILL_MIRROR, loop=app.loop)
+    try:
+        mirror.open()
+    except sqlite3.Error as exc:
+        # e.g. Python 3.4's SQLite, which has no FTS5; searches keep
+        # going to the API
+        app.logger.error('bill mirror disabled: %s', exc)
+        mirror.close()
+    else:
+        app['mirror'] = triggers.new_bills_query.mirror = mirror
+        mirror.start(triggers.new_bills_query.get_json,
+                     '{}/bills'.format(triggers.SUNLIGHT_URL))
+        app.register_on_finish(close_mirror)
+
+# parsing the boundary file takes a while, so it happens here, before
+# the worker starts taking requests, not on the event loop
+triggers.new_legislators.districts = DistrictIndex.load()
+
+if CACHE_SNAPSHOT:
+    # loaded here, before the worker starts taking requests
+    app['snapshot'] = CacheSnapshot(CACHE_SNAPSHOT, max_size=CACHE_SIZE,
+                                    loop=app.loop)
+    app['snapshot'].load(cache)
+    app['snapshot'].start(cache)
+    app.register_on_finish(close_snapshot)
+
+handlers = [triggers.registry[name] for name in sorted(triggers.registry)]
+
+if PREWARM:
+    static = [(handler, '/ifttt/v1/triggers/{}'.format(handler.name))
+              for handler in handlers if not handler.fields]
+    # without a shared cache every worker would refresh every key
+    app['prewarmer'] = Prewarmer(
+        warm, lambda key: cache.ttl(key), static,
+        lock=None if shared.enabled else PREWARM_LOCK, loop=app.loop)
+    app['prewarmer'].start()
+    app.register_on_finish(close_prewarmer)
+
+if REALTIME_URL:
+    app['notifier'] = Notifier(
+        refresh, app['upstream'], key=CLIENT_SECRET, lock=REALTIME_LOCK,
+        available=lambda: app['guard'].available, loop=app.loop)
+    app['notifier'].start()
+    app.register_on_finish(close_notifier)
+
+metrics.registry.collector(
+    'sunlighttt_cache', 'Local trigger cache', cache.stats)
+metrics.registry.collector(
+    'sunlighttt_shared_cache', 'Shared trigger cache', shared.stats)
+metrics.registry.collector(
+    'sunlighttt_body_cache', 'Cache keys remembered by request body',
+    bodies.stats)
+metrics.registry.collector(
+    'sunlighttt_singleflight', 'Coalesced trigger fetches',
+    lambda: {'calls': inflight.calls, 'coalesced': inflight.coalesced,
+             'in_flight': len(inflight)})
+metrics.registry.collector(
+    'sunlighttt_cache_keys', 'Trigger requests per canonical cache key',
+    keys.stats.stats)
+metrics.registry.collector(
+    'sunlighttt_upstream_guard', 'Congress API circuit breaker and limit',
+    app['guard'].stats)
+for handler in handlers:
+    metrics.registry.collector(
+        'sunlighttt_ttl_{}'.format(handler.name.replace('-', '_')),
+        'Learned cache TTLs for {}'.format(handler.name),
+        handler.ttl_stats)
+if 'snapshot' in app:
+    metrics.registry.collector(
+        'sunlighttt_cache_snapshot', 'Trigger cache snapshots',
+        app['snapshot'].stats)
+if 'prewarmer' in app:
+    metrics.registry.collector(
+        'sunlighttt_prewarm', 'Cache prewarmer', app['prewarmer'].stats)
+if 'notifier' in app:
+    metrics.registry.collector(
+        'sunlighttt_realtime', 'Realtime notifier', app['notifier'].stats)
+
+app.router.add_route(
+    'GET', '/metrics', metrics_page)
+app.router.add_route(
+    'GET', '/admin/profiles', profiles)
 app.router.add_route(
     'GET', '/ifttt/v1/status', status)
 app.router.add_route(
     'POST', '/ifttt/v1/test/setup', test_setup)
 app.router.add_route(
     'POST', '/ifttt/v1/triggers/{trigger}', trigger)
+app.router.add_route(
+    'POST', '/ifttt/v1/batch/triggers/{trigger}', batch)
 app.router.add_route(
     'POST', '/ifttt/v1/triggers/{trigger}/fields/{field}/options', options)
 app.router.add_route(